@@ -11,15 +11,38 @@ The usage of this program should follow the GNU General Public License.
 
 This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
 """
+from collections import deque
+from typing import Any, Callable, Optional
 import networkx as nx
+import numpy as np
+from scipy import sparse
+import link_stats
+import metrics
+import page_source
+import wiki_cache
+import versioned_graph
 
 
 def calculate_pagerank_manual(graph: nx.DiGraph, alpha: float = 0.85, max_iter: int = 100,
-                              tol: float = 1.0e-6) -> list[dict]:
+                              tol: float = 1.0e-6,
+                              callback: Optional[Callable[[int, float, np.ndarray], Any]] = None,
+                              start: Optional[dict] = None) -> dict:
     """A manual implementation of the PageRank algorithm. Calculates the PageRanks for all nodes in
     the graph, and returns a dictionary of nodes with PageRanks as values. Uses the iterative
-    computation method from https://en.wikipedia.org/wiki/PageRank. Note that the results of this
-    algorithm differ slightly from the NetworkX implementation.
+    computation method from https://en.wikipedia.org/wiki/PageRank. If the graph is a
+    VersionedDiGraph and no callback is given, the result is reused until the graph's nodes or
+    edges change.
+
+    The transition matrix of the graph is built once as a sparse matrix, so that each iteration is
+    a single sparse matrix-vector product.
+
+    If callback is given, callback(iteration, error, page_ranks) is called after each iteration,
+    where page_ranks is an array of the PageRanks after that iteration, in the same order as
+    graph.nodes, and error is its total difference from the previous iteration.
+
+    If start is given, the iteration is warm started from the PageRanks in start, such as those of
+    an earlier version of the graph, instead of from 1/N. Nodes missing from start begin at 1/N.
+    The result meets the same convergence criterion either way, but usually in fewer iterations.
 
     Preconditions:
         - 0 <= alpha <= 1
@@ -29,44 +52,384 @@ def calculate_pagerank_manual(graph: nx.DiGraph, alpha: float = 0.85, max_iter:
     >>> g = wiki_graph.create_digraph('Logic programming languages')
     >>> from math import isclose
     >>> page_ranks = calculate_pagerank_manual(g)
-    >>> isclose(sum(val for val in page_ranks[-1].values()), 1, abs_tol=0.05)
+    >>> isclose(sum(val for val in page_ranks.values()), 1, abs_tol=0.05)
     True
     """
-    all_page_ranks = []
-    page_ranks = {}
-    size = len(graph.nodes)
+    if callback is not None or start is not None:
+        page_ranks = _power_iteration(graph, alpha, max_iter, tol, callback, start)
+        return dict(zip(graph.nodes, page_ranks.tolist()))
 
-    # initialize each node's score to 1/N
-    for node in graph.nodes:
-        page_ranks[node] = 1.0 / size
+    return versioned_graph.memoize(
+        graph, ('pagerank_manual', alpha, max_iter, tol),
+        lambda: dict(zip(graph.nodes, _power_iteration(graph, alpha, max_iter, tol,
+                                                       None).tolist())))
+
+
+def calculate_pagerank_history(graph: nx.DiGraph, alpha: float = 0.85, max_iter: int = 100,
+                               tol: float = 1.0e-6) -> np.ndarray:
+    """Calculate the PageRanks for all nodes in the graph as in calculate_pagerank_manual, and
+    return a 2-D array of the PageRanks at every iteration. Row i of the array holds the PageRanks
+    after i iterations (so row 0 is the initial 1/N), and column j holds the PageRanks of the jth
+    node in graph.nodes.
+
+    Preconditions:
+        - 0 <= alpha <= 1
+        - max_iter >= 1
 
-    # find nodes with no out edges
-    dangling_nodes = [n for n in graph.nodes if graph.out_degree[n] == 0.0]
+    >>> g = nx.DiGraph([('a', 'b'), ('b', 'a'), ('c', 'a')])
+    >>> history = calculate_pagerank_history(g)
+    >>> history[0].tolist()
+    [0.3333333333333333, 0.3333333333333333, 0.3333333333333333]
+    >>> history.shape[1]
+    3
+    """
+    size = graph.number_of_nodes()
+    history = np.empty((max_iter + 1, size))
+    history[0] = 1.0 / size if size != 0 else 0.0
+    iterations = 0
+
+    def record(iteration: int, _: float, page_ranks: np.ndarray) -> None:
+        """Record the PageRanks after the given iteration."""
+        nonlocal iterations
+        history[iteration] = page_ranks
+        iterations = iteration
+
+    _power_iteration(graph, alpha, max_iter, tol, record)
+    return history[:iterations + 1]
+
+
+@metrics.timed('algorithms.power_iteration')
+def _power_iteration(graph: nx.DiGraph, alpha: float, max_iter: int, tol: float,
+                     callback: Optional[Callable[[int, float, np.ndarray], Any]],
+                     start: Optional[dict] = None) -> np.ndarray:
+    """Return an array of the PageRanks of the nodes in the graph, in the same order as
+    graph.nodes, calling callback after each iteration and warm starting from start as described
+    in calculate_pagerank_manual.
+    """
+    nodes = list(graph.nodes)
+    size = len(nodes)
+
+    if size == 0:
+        raise ValueError(
+            f'pagerank calculation failed to converge in {max_iter} iterations')
+
+    matrix, dangling_nodes = transition_matrix(graph, nodes)
 
-    for _ in range(max_iter):
-        page_ranks_last = page_ranks.copy()
-        all_page_ranks.append(page_ranks_last)
-        danglesum = alpha * sum(page_ranks[n] for n in dangling_nodes)
+    # initialize each node's score to 1/N, or to its score in start
+    page_ranks = np.full(size, 1.0 / size)
+    if start is not None:
+        page_ranks = np.fromiter((start.get(node, 1.0 / size) for node in nodes), dtype=float,
+                                 count=size)
+        page_ranks /= page_ranks.sum()
+
+    for iteration in range(1, max_iter + 1):
+        danglesum = alpha * page_ranks[dangling_nodes].sum()
 
         # PR(P) = (1-d)/N + d(sum(PR(i))/(L(i)) for neighbors of P) + d(sum of dangling edge scores)
-        for node in graph.nodes:
-            neighbors = graph.predecessors(node)
-            page_ranks[node] = alpha * sum(page_ranks[n] / graph.out_degree[n]
-                                           for n in neighbors)
-            page_ranks[node] += (1.0 - alpha) / size + danglesum / float(size)
+        page_ranks_last = page_ranks
+        page_ranks = alpha * (matrix @ page_ranks_last) + ((1.0 - alpha) + danglesum) / size
 
         # check for convergence
-        error = sum(abs(page_ranks[n] - page_ranks_last[n])
-                    for n in page_ranks)
-        if error < len(graph.nodes) * tol:
-            return all_page_ranks + [page_ranks]
+        error = float(np.abs(page_ranks - page_ranks_last).sum())
+        if callback is not None:
+            callback(iteration, error, page_ranks)
+        if error < size * tol:
+            return page_ranks
     raise ValueError(
         f'pagerank calculation failed to converge in {max_iter} iterations')
 
 
+class IncrementalPageRank:
+    """The PageRanks of a graph which is changing, kept up to date incrementally.
+
+    The PageRanks are calculated in full once, with calculate_pagerank_manual. After that, nodes
+    and edges should be added and removed through this class, which records how each change
+    affects the PageRanks of the neighbouring nodes as a residual: the amount by which one more
+    iteration of calculate_pagerank_manual would change the node's PageRank. When the PageRanks
+    are next requested, the residuals are pushed through the graph until every node's residual is
+    below (1 - alpha) * tol, which only touches the neighbourhood of the changes. If a change
+    affects every node significantly (for example, adding many nodes at once), the PageRanks are
+    instead recalculated with a power iteration warm started from the current PageRanks, to a
+    tolerance of (1 - alpha) * tol.
+
+    Either way, the total difference between the returned PageRanks and the exact PageRanks of the
+    graph is less than len(graph) * tol, the tolerance of calculate_pagerank_manual. When a node is
+    removed, the PageRanks are scaled to sum to 1 again.
+
+    Instance Attributes:
+      - graph: the graph whose PageRanks are kept up to date
+      - alpha: the damping factor
+      - max_iter: the maximum number of iterations of a full recalculation
+      - tol: the tolerance of each node's residual
+
+    >>> g = nx.DiGraph([('a', 'b'), ('b', 'c'), ('c', 'a'), ('c', 'b')])
+    >>> ranks = IncrementalPageRank(g)
+    >>> ranks.add_edge('a', 'd')
+    >>> ranks.remove_edge('c', 'b')
+    >>> ranks.add_edge('e', 'a')
+    >>> ranks.remove_node('b')
+    >>> expected = calculate_pagerank_manual(g, tol=1.0e-12)
+    >>> actual = ranks.page_ranks()
+    >>> sum(abs(actual[node] - expected[node]) for node in g.nodes) < len(g) * 1.0e-6
+    True
+
+    Removing a node with a self loop, and removing every node:
+
+    >>> g = nx.DiGraph([('a', 'a'), ('a', 'b'), ('b', 'a')])
+    >>> ranks = IncrementalPageRank(g)
+    >>> ranks.remove_node('a')
+    >>> ranks.page_ranks()
+    {'b': 1.0}
+    >>> ranks.remove_node('b')
+    >>> ranks.page_ranks()
+    {}
+
+    Removing every node with a PageRank, leaving only nodes added since:
+
+    >>> ranks = IncrementalPageRank(nx.DiGraph([('a', 'b')]))
+    >>> ranks.add_node('c')
+    >>> ranks.remove_node('a')
+    >>> ranks.remove_node('b')
+    >>> ranks.page_ranks()
+    {'c': 1.0}
+    """
+    graph: nx.DiGraph
+    alpha: float
+    max_iter: int
+    tol: float
+    # The PageRanks, and the residual of each node, excluding the residual shared by all nodes
+    _page_ranks: dict
+    _residuals: dict
+    # The nodes whose residual may be at least tol
+    _dirty: set
+    # The residual shared by all nodes, the uniform term of the PageRank equation (the teleport
+    # probability plus the evenly spread PageRank of nodes with no out edges), and the total
+    # PageRank of nodes with no out edges
+    _shared_residual: float
+    _uniform: float
+    _danglesum: float
+
+    def __init__(self, graph: nx.DiGraph, alpha: float = 0.85, max_iter: int = 100,
+                 tol: float = 1.0e-6, start: Optional[dict] = None) -> None:
+        """Calculate the PageRanks of graph in full, warm started from start if given."""
+        self.graph = graph
+        self.alpha = alpha
+        self.max_iter = max_iter
+        self.tol = tol
+        self._recalculate(start)
+
+    def page_ranks(self) -> dict:
+        """Return a dictionary of the graph's nodes with their up-to-date PageRanks as values."""
+        # Keeping every residual below this keeps their total, divided by 1 - alpha (which bounds
+        # the total difference from the exact PageRanks), below len(graph) * tol
+        threshold = (1.0 - self.alpha) * self.tol
+
+        while True:
+            queue = deque(self._dirty)
+            self._dirty = set()
+            while queue and abs(self._shared_residual) < threshold:
+                node = queue.popleft()
+                residual = self._residuals.get(node, 0.0) + self._shared_residual
+                if abs(residual) >= threshold:
+                    self._push(node, residual, queue, threshold)
+
+            if abs(self._shared_residual) < threshold:
+                return dict(self._page_ranks)
+
+            # The shared residual is too large, so every node would need to be pushed
+            self._recalculate(self._page_ranks)
+
+    def add_node(self, node: Any) -> None:
+        """Add node to the graph, if it isn't already in the graph."""
+        if node in self.graph:
+            return
+
+        self.graph.add_node(node)
+        self._page_ranks[node] = 0.0
+        self._update_uniform()
+        self._residuals[node] = self._uniform - self._shared_residual
+        self._dirty.add(node)
+
+    def remove_node(self, node: Any) -> None:
+        """Remove node and all of its edges from the graph.
+
+        Preconditions:
+          - node in self.graph
+        """
+        # A self loop is both an in edge and an out edge of node
+        for u, v in set(self.graph.in_edges(node)) | set(self.graph.out_edges(node)):
+            self.remove_edge(u, v)
+
+        self._danglesum -= self._page_ranks.pop(node)
+        self._residuals.pop(node, None)
+        self._dirty.discard(node)
+        self.graph.remove_node(node)
+
+        if len(self.graph) == 0:
+            self._page_ranks, self._residuals, self._dirty = {}, {}, set()
+            self._shared_residual = self._uniform = self._danglesum = 0.0
+        elif sum(self._page_ranks.values()) == 0.0:
+            # Every remaining node was just added, so there are no PageRanks to scale
+            self._recalculate(None)
+        else:
+            self._update_uniform()
+            self._normalize()
+
+    def add_edge(self, u: Any, v: Any) -> None:
+        """Add an edge from u to v to the graph, adding u and v first if necessary."""
+        self.add_node(u)
+        self.add_node(v)
+        if self.graph.has_edge(u, v):
+            return
+
+        degree = self.graph.out_degree(u)
+        rank = self.alpha * self._page_ranks[u]
+        if degree == 0:
+            self._danglesum -= self._page_ranks[u]
+            self._update_uniform()
+        else:
+            for successor in self.graph.successors(u):
+                self._add_residual(successor, rank / (degree + 1) - rank / degree)
+
+        self.graph.add_edge(u, v)
+        self._add_residual(v, rank / (degree + 1))
+
+    def remove_edge(self, u: Any, v: Any) -> None:
+        """Remove the edge from u to v from the graph.
+
+        Preconditions:
+          - self.graph.has_edge(u, v)
+        """
+        degree = self.graph.out_degree(u)
+        rank = self.alpha * self._page_ranks[u]
+
+        self.graph.remove_edge(u, v)
+        self._add_residual(v, -rank / degree)
+        if degree == 1:
+            self._danglesum += self._page_ranks[u]
+            self._update_uniform()
+        else:
+            for successor in self.graph.successors(u):
+                self._add_residual(successor, rank / (degree - 1) - rank / degree)
+
+    def _push(self, node: Any, residual: float, queue: deque, threshold: float) -> None:
+        """Move the given residual of node into its PageRank, and pass the resulting change on to
+        the residuals of its successors, adding those which reach threshold to queue.
+        """
+        self._page_ranks[node] += residual
+        self._residuals[node] = -self._shared_residual
+
+        degree = self.graph.out_degree(node)
+        if degree == 0:
+            self._danglesum += residual
+            self._update_uniform()
+            return
+
+        share = self.alpha * residual / degree
+        for successor in self.graph.successors(node):
+            self._residuals[successor] = self._residuals.get(successor, 0.0) + share
+            if abs(self._residuals[successor] + self._shared_residual) >= threshold:
+                queue.append(successor)
+
+    def _add_residual(self, node: Any, amount: float) -> None:
+        """Add amount to the residual of node."""
+        self._residuals[node] = self._residuals.get(node, 0.0) + amount
+        self._dirty.add(node)
+
+    def _normalize(self) -> None:
+        """Scale the PageRanks to sum to 1, such as after the PageRank of a node was removed with
+        it. The residuals are updated to stay the residuals of the scaled PageRanks: scaling by c
+        scales each residual by c, and adds (1 - c) * (1 - alpha) / len(graph) to each of them.
+        """
+        scale = 1.0 / sum(self._page_ranks.values())
+        for node in self._page_ranks:
+            self._page_ranks[node] *= scale
+        for node in self._residuals:
+            self._residuals[node] *= scale
+
+        self._danglesum *= scale
+        self._uniform = (self.alpha * self._danglesum + 1.0 - self.alpha) / len(self.graph)
+        self._shared_residual = (scale * self._shared_residual
+                                 + (1.0 - scale) * (1.0 - self.alpha) / len(self.graph))
+        self._dirty.update(self._residuals)
+
+    def _update_uniform(self) -> None:
+        """Recalculate the uniform term of the PageRank equation after the total PageRank of
+        dangling nodes or the number of nodes has changed, adding the difference to the residual
+        shared by all nodes.
+        """
+        uniform = (self.alpha * self._danglesum + 1.0 - self.alpha) / len(self.graph)
+        self._shared_residual += uniform - self._uniform
+        self._uniform = uniform
+
+    def _recalculate(self, start: Optional[dict]) -> None:
+        """Recalculate the PageRanks in full, warm started from start if given, and the residual
+        left by the last iteration of each node, which are pushed by the next page_ranks call.
+        """
+        nodes = list(self.graph.nodes)
+        page_ranks = _power_iteration(self.graph, self.alpha, self.max_iter,
+                                      (1.0 - self.alpha) * self.tol, None, start)
+        self._page_ranks = dict(zip(nodes, page_ranks.tolist()))
+
+        matrix, dangling_nodes = transition_matrix(self.graph, nodes)
+        self._danglesum = float(page_ranks[dangling_nodes].sum())
+        self._uniform = (self.alpha * self._danglesum + 1.0 - self.alpha) / len(nodes)
+        residuals = self.alpha * (matrix @ page_ranks) + self._uniform - page_ranks
+        self._residuals = dict(zip(nodes, residuals.tolist()))
+        self._dirty = set(self._residuals)
+        self._shared_residual = 0.0
+
+
+def transition_matrix(graph: nx.DiGraph, nodes: list) -> tuple[sparse.csr_matrix, np.ndarray]:
+    """Return the transition matrix of the given graph as a sparse CSR matrix, along with a boolean
+    array which marks the nodes with no out edges. The rows and columns of the matrix are in the
+    same order as nodes, and the entry in row j and column i is 1/L(i) if i links to j, where L(i)
+    is the number of out edges of i.
+
+    Preconditions:
+        - set(nodes) == set(graph.nodes)
+
+    >>> g = nx.DiGraph([('a', 'b'), ('a', 'c'), ('b', 'c')])
+    >>> matrix, dangling = transition_matrix(g, ['a', 'b', 'c'])
+    >>> matrix.toarray().tolist()
+    [[0.0, 0.0, 0.0], [0.5, 0.0, 0.0], [0.5, 1.0, 0.0]]
+    >>> dangling.tolist()
+    [False, False, True]
+    """
+    adjacency = adjacency_matrix(graph, nodes)
+    out_degrees = np.diff(adjacency.indptr)
+
+    # Divide each row of the adjacency matrix by its out degree, then transpose it
+    weights = np.divide(1.0, out_degrees, out=np.zeros(len(nodes)), where=out_degrees != 0)
+    matrix = (sparse.diags(weights) @ adjacency).T.tocsr()
+    return matrix, out_degrees == 0
+
+
+def adjacency_matrix(graph: nx.DiGraph, nodes: list) -> sparse.csr_matrix:
+    """Return the adjacency matrix of graph as a sparse CSR matrix of 0s and 1s, with its rows and
+    columns in the same order as nodes. Row i holds the successors of the ith node.
+
+    Preconditions:
+      - set(nodes) == set(graph.nodes)
+
+    >>> g = nx.DiGraph([('a', 'b'), ('a', 'c'), ('b', 'c')])
+    >>> adjacency_matrix(g, ['a', 'b', 'c']).toarray().tolist()
+    [[0, 1, 1], [0, 0, 1], [0, 0, 0]]
+    """
+    index = {node: i for i, node in enumerate(nodes)}
+    num_edges = graph.number_of_edges()
+
+    sources = np.fromiter((index[u] for u, _ in graph.edges), dtype=np.int64, count=num_edges)
+    targets = np.fromiter((index[v] for _, v in graph.edges), dtype=np.int64, count=num_edges)
+
+    return sparse.csr_matrix((np.ones(num_edges, dtype=np.int64), (sources, targets)),
+                             shape=(len(nodes), len(nodes)))
+
+
 def calculate_pagerank(graph: nx.DiGraph) -> dict:
     """Use the NetworkX PageRank implementation to calculate the PageRanks for all nodes in the
-    graph. Returns a dictionary of nodes with PageRanks as values.
+    graph. Returns a dictionary of nodes with PageRanks as values. If the graph is a
+    VersionedDiGraph, the result is reused until the graph's nodes or edges change.
 
     >>> import wiki_graph
     >>> g = wiki_graph.create_digraph('Logic programming languages')
@@ -75,6 +438,12 @@ def calculate_pagerank(graph: nx.DiGraph) -> dict:
     >>> isclose(sum(val for val in page_ranks.values()), 1)
     True
     """
+    return versioned_graph.memoize(graph, 'pagerank', lambda: _networkx_pagerank(graph))
+
+
+@metrics.timed('algorithms.pagerank')
+def _networkx_pagerank(graph: nx.DiGraph) -> dict:
+    """Return the PageRanks of the nodes in the graph, calculated by NetworkX."""
     return nx.algorithms.link_analysis.pagerank(graph)
 
 
@@ -90,8 +459,7 @@ def assign_pagerank(graph: nx.DiGraph, manual: bool = False) -> None:
     """
     # Calculate PageRanks for the nodes
     if manual:
-        # If using the manual function, use the final set of values
-        page_ranks = calculate_pagerank_manual(graph)[-1]
+        page_ranks = calculate_pagerank_manual(graph)
     else:
         page_ranks = calculate_pagerank(graph)
     # Assign the values as node attributes
@@ -99,9 +467,19 @@ def assign_pagerank(graph: nx.DiGraph, manual: bool = False) -> None:
         graph.nodes[node]["pagerank"] = page_ranks[node]
 
 
-def assign_link_stats(graph: nx.DiGraph) -> None:
+def assign_link_stats(graph: nx.DiGraph, cache: Optional[wiki_cache.WikiCache] = None,
+                      workers: int = 4, source: Optional[page_source.PageSource] = None) -> None:
     """Calculate link statistics for the given graph and assign them as node attributes.
 
+    The links and backlinks of many pages are counted at once by link_stats.fetch_link_counts,
+    on up to workers threads, from source (the live English Wikipedia by default). If cache is
+    given, the counts are read from it when available, and stored in it otherwise. If the graph is
+    a VersionedDiGraph, the statistics are reused by calls with the same source and cache until
+    the graph's nodes or edges change.
+
+    Preconditions:
+      - workers >= 1
+
     >>> import wiki_graph
     >>> g = wiki_graph.create_digraph('Prolog programming language family')
     >>> assign_link_stats(g)
@@ -114,12 +492,32 @@ def assign_link_stats(graph: nx.DiGraph) -> None:
     1
     >>> node['local_backlinks']
     0
+    >>> g = versioned_graph.VersionedDiGraph([('Prolog', 'Datalog')])
+    >>> assign_link_stats(g, source=page_source.StubSource({}, {'Prolog': ['Datalog']}))
+    >>> assign_link_stats(g, source=page_source.StubSource({}, {'Prolog': ['Datalog', 'Logic']}))
+    >>> g.nodes['Prolog']['links']
+    2
     """
+    # The counts depend on where they're fetched from, so the source and cache are part of the key
+    stats = versioned_graph.memoize(graph, ('link_stats', source, cache),
+                                    lambda: _calculate_link_stats(graph, cache, workers, source))
     for node in graph.nodes:
-        node_object = graph.nodes[node]['object']
-        graph.add_node(node, local_links=len(graph.out_edges(node)),
-                       local_backlinks=len(graph.in_edges(node)), links=len(node_object.links),
-                       backlinks=len(node_object.backlinks))
+        graph.add_node(node, **stats[node])
+
+
+@metrics.timed('algorithms.link_stats')
+def _calculate_link_stats(graph: nx.DiGraph, cache: Optional[wiki_cache.WikiCache],
+                          workers: int, source: Optional[page_source.PageSource] = None
+                          ) -> dict[str, dict[str, int]]:
+    """Return a dictionary mapping each node of the graph to its link statistics, as described in
+    assign_link_stats.
+    """
+    counts = link_stats.fetch_link_counts(list(graph.nodes), workers=workers, cache=cache,
+                                          source=source)
+    return {node: {'local_links': len(graph.out_edges(node)),
+                   'local_backlinks': len(graph.in_edges(node)),
+                   'links': counts[node]['links'], 'backlinks': counts[node]['backlinks']}
+            for node in graph.nodes}
 
 
 if __name__ == '__main__':
@@ -129,6 +527,7 @@ if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'max-line-length': 100,
-        'extra-imports': ['networkx', 'wiki_graph'],
+        'extra-imports': ['networkx', 'numpy', 'scipy', 'link_stats', 'metrics', 'page_source',
+                          'wiki_graph', 'wiki_cache', 'versioned_graph'],
         'max-nested-blocks': 4
     })
@@ -0,0 +1,299 @@
+"""CSC111 Winter 2021: Project Phase 2
+
+Module Description
+==================
+This module contains a non-interactive job which precomputes the recommendations of
+recommendations.top_wiki_page_recommendations for every page of a category graph saved by
+compact_graph.save. It can be run from the command line, for example:
+
+    python batch_recommend.py logic.graph logic.jsonl --n 10 --processes 4
+
+The pages are split into shards of consecutive ids, which are processed by a pool of worker
+processes. Each worker memory-maps the same graph file, so the adjacency structure is shared
+read-only between them through the operating system's page cache instead of being copied.
+
+Results are streamed to a JSON Lines file, with one line per page, or to a directory of Parquet
+files, with one file per shard. After each shard is written, a checkpoint file records how much of
+the output is complete, so that an interrupted job continues where it left off when it is run again
+with the same arguments. The checkpoint is removed when the job finishes. Parquet output requires
+the optional pyarrow package.
+
+Run without arguments, this module runs its doctests and python_ta checks instead.
+
+Copyright and Usage Information
+===============================
+The usage of this program should follow the GNU General Public License.
+
+This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from typing import Any, Iterable, Iterator, Optional
+import numpy as np
+import compact_graph
+import similarity
+
+# The output formats supported by recommend_all
+FORMATS = ('jsonl', 'parquet')
+
+# The default number of pages in each shard
+DEFAULT_SHARD_SIZE = 1024
+
+# The suffix added to the output path to get the default checkpoint path
+CHECKPOINT_SUFFIX = '.checkpoint'
+
+
+class _Recommender:
+    """The recommendations of the shards of one graph, which is loaded once in each process.
+
+    Instance Attributes:
+      - n: the maximum number of recommendations for each page
+      - shard_size: the number of pages in each shard
+
+    Representation Invariants:
+      - self.n > 0
+      - self.shard_size > 0
+    """
+    n: int
+    shard_size: int
+    _titles: list[str]
+    _adjacency: Any
+    _transposed: Any
+    _degrees: np.ndarray
+    _ranks: np.ndarray
+
+    def __init__(self, graph_path: str, n: int, shard_size: int) -> None:
+        """Load the graph saved at graph_path, for finding n recommendations for each page of
+        shards of shard_size pages.
+        """
+        graph = compact_graph.load(graph_path)
+        self.n = n
+        self.shard_size = shard_size
+        self._titles = graph.titles
+        self._adjacency = graph.adjacency_matrix()
+        self._transposed = self._adjacency.T
+        self._degrees = graph.out_degrees()
+        self._ranks = similarity.title_ranks(graph.titles)
+
+    def shard(self, start: int) -> list[tuple[str, list[tuple[float, str]]]]:
+        """Return a list of each page of the shard starting at id start, and its recommendations.
+
+        Preconditions:
+          - start % self.shard_size == 0
+        """
+        end = min(start + self.shard_size, len(self._titles))
+        block = similarity.block_top_k(self._adjacency, self._transposed, self._degrees,
+                                       self._ranks, self._titles, start, end, self.n)
+        return list(zip(self._titles[start:end], block))
+
+
+# The recommender of the current worker process, which is set by _init_worker
+_worker_recommender: Optional[_Recommender] = None
+
+
+def recommend_all(graph_path: str, output_path: str, n: int = 10, processes: int = 1,
+                  shard_size: int = DEFAULT_SHARD_SIZE, output_format: str = 'jsonl',
+                  checkpoint_path: Optional[str] = None) -> int:
+    """Write the top n recommendations of every page of the graph saved at graph_path to
+    output_path, in the given format, and return the number of pages written by this call.
+
+    The shards are processed by the given number of worker processes, or on the calling process if
+    processes is 1. If a checkpoint for the same job exists at checkpoint_path (output_path with
+    CHECKPOINT_SUFFIX added by default), the shards it records as complete are skipped. Raise a
+    ValueError if the checkpoint was written for a job with different arguments, or if the output
+    it records has since been removed.
+
+    Preconditions:
+      - n > 0
+      - processes >= 1
+      - shard_size > 0
+      - output_format in FORMATS
+
+    >>> import os, tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> g = compact_graph.CompactGraph('Logic', ['a', 'b', 'c', 'x', 'y'],
+    ...                                [0, 0, 1, 1, 2], [3, 4, 3, 4, 3])
+    >>> compact_graph.save(g, os.path.join(d, 'logic.graph'))
+    >>> recommend_all(os.path.join(d, 'logic.graph'), os.path.join(d, 'logic.jsonl'), n=2,
+    ...               shard_size=2)
+    5
+    >>> with open(os.path.join(d, 'logic.jsonl')) as file:
+    ...     print(file.readline(), end='')
+    {"page": "a", "recommendations": [{"page": "b", "score": 1.0}, {"page": "c", "score": 0.5}]}
+    >>> compact_graph.save(compact_graph.CompactGraph('Empty', [], [], []),
+    ...                    os.path.join(d, 'empty.graph'))
+    >>> recommend_all(os.path.join(d, 'empty.graph'), os.path.join(d, 'empty.jsonl'))
+    0
+
+    A checkpoint can't be resumed once its output has been removed:
+
+    >>> job = {'graph': os.path.abspath(os.path.join(d, 'logic.graph')), 'pages': 5, 'n': 2,
+    ...        'shard_size': 2, 'format': 'jsonl'}
+    >>> _write_checkpoint(os.path.join(d, 'lost.jsonl' + CHECKPOINT_SUFFIX),
+    ...                   {'job': job, 'shards': 1, 'offset': 100})
+    >>> recommend_all(os.path.join(d, 'logic.graph'), os.path.join(d, 'lost.jsonl'), n=2,
+    ...               shard_size=2)  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ValueError: The checkpoint at ...lost.jsonl.checkpoint records output which is missing from ...
+    """
+    checkpoint_path = checkpoint_path or output_path + CHECKPOINT_SUFFIX
+    num_pages = len(compact_graph.load(graph_path))
+    job = {'graph': os.path.abspath(graph_path), 'pages': num_pages, 'n': n,
+           'shard_size': shard_size, 'format': output_format}
+
+    checkpoint = _read_checkpoint(checkpoint_path, job)
+    if checkpoint['shards'] and not os.path.exists(output_path):
+        raise ValueError(f'The checkpoint at {checkpoint_path} records output which is missing '
+                         f'from {output_path}. Remove the checkpoint to start over.')
+    starts = range(checkpoint['shards'] * shard_size, num_pages, shard_size)
+
+    if processes <= 1:
+        recommender = _Recommender(graph_path, n, shard_size)
+        written = _write_shards(map(recommender.shard, starts), output_path, output_format,
+                                checkpoint_path, checkpoint)
+    else:
+        with multiprocessing.Pool(processes, _init_worker,
+                                  (graph_path, n, shard_size)) as pool:
+            written = _write_shards(pool.imap(_worker_shard, starts), output_path, output_format,
+                                    checkpoint_path, checkpoint)
+
+    # No checkpoint is written if there were no shards to write
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return written
+
+
+def _init_worker(graph_path: str, n: int, shard_size: int) -> None:
+    """Load the graph in a new worker process."""
+    global _worker_recommender
+    _worker_recommender = _Recommender(graph_path, n, shard_size)
+
+
+def _worker_shard(start: int) -> list[tuple[str, list[tuple[float, str]]]]:
+    """Return the recommendations of the shard starting at id start, in a worker process."""
+    return _worker_recommender.shard(start)
+
+
+def _write_shards(shards: Iterable[list[tuple[str, list[tuple[float, str]]]]], output_path: str,
+                  output_format: str, checkpoint_path: str, checkpoint: dict) -> int:
+    """Write the given shards to output_path in order, updating the checkpoint after each one, and
+    return the number of pages written.
+    """
+    written = 0
+
+    if output_format == 'parquet':
+        os.makedirs(output_path, exist_ok=True)
+        for shard in shards:
+            _write_parquet(shard, os.path.join(output_path,
+                                               f"part-{checkpoint['shards']:05d}.parquet"))
+            written += len(shard)
+            checkpoint['shards'] += 1
+            _write_checkpoint(checkpoint_path, checkpoint)
+        return written
+
+    # Discard anything written after the last checkpoint, then append to the file
+    with open(output_path, 'r+b' if checkpoint['shards'] else 'wb') as file:
+        file.truncate(checkpoint['offset'])
+        file.seek(checkpoint['offset'])
+        for shard in shards:
+            file.writelines(line.encode('utf-8') for line in _json_lines(shard))
+            file.flush()
+            os.fsync(file.fileno())
+            written += len(shard)
+            checkpoint['shards'] += 1
+            checkpoint['offset'] = file.tell()
+            _write_checkpoint(checkpoint_path, checkpoint)
+
+    return written
+
+
+def _json_lines(shard: list[tuple[str, list[tuple[float, str]]]]) -> Iterator[str]:
+    """Yield a line of JSON for each page of shard."""
+    for page, recommendations in shard:
+        yield json.dumps({'page': page,
+                          'recommendations': [{'page': other, 'score': score}
+                                              for score, other in recommendations]}) + '\n'
+
+
+def _write_parquet(shard: list[tuple[str, list[tuple[float, str]]]], path: str) -> None:
+    """Write the recommendations of shard to a Parquet file at path, with one row per
+    recommendation.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError('Parquet output requires the pyarrow package.') from error
+
+    rows = [(page, rank, other, score) for page, recommendations in shard
+            for rank, (score, other) in enumerate(recommendations)]
+    columns = ['page', 'rank', 'recommendation', 'score']
+    table = pyarrow.table({name: [row[i] for row in rows] for i, name in enumerate(columns)})
+
+    # Write to a temporary file first, so that a partially written file is never left at path
+    pyarrow.parquet.write_table(table, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def _read_checkpoint(path: str, job: dict) -> dict:
+    """Return the checkpoint at path, or a new checkpoint if there isn't one. Raise a ValueError if
+    the checkpoint was written for a different job.
+    """
+    if not os.path.exists(path):
+        return {'job': job, 'shards': 0, 'offset': 0}
+
+    with open(path) as file:
+        checkpoint = json.load(file)
+    if checkpoint['job'] != job:
+        raise ValueError(f'The checkpoint at {path} is for a different job. Remove it to start '
+                         'over.')
+    return checkpoint
+
+
+def _write_checkpoint(path: str, checkpoint: dict) -> None:
+    """Atomically replace the checkpoint at path."""
+    with open(path + '.tmp', 'w') as file:
+        json.dump(checkpoint, file)
+    os.replace(path + '.tmp', path)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Run recommend_all with the given command line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Precompute the recommendations of every page of a saved category graph.')
+    parser.add_argument('graph', help='the path of a graph saved by compact_graph.save')
+    parser.add_argument('output', help='the path of the output file, or directory for parquet')
+    parser.add_argument('--n', type=int, default=10, help='recommendations per page')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help='the number of worker processes')
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE,
+                        help='the number of pages in each shard')
+    parser.add_argument('--format', choices=FORMATS, default='jsonl', help='the output format')
+    parser.add_argument('--checkpoint', help='the path of the checkpoint file')
+    args = parser.parse_args(argv)
+
+    written = recommend_all(args.graph, args.output, args.n, args.processes, args.shard_size,
+                            args.format, args.checkpoint)
+    print(f'Wrote the recommendations of {written} pages to {args.output}.')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main()
+    else:
+        import doctest
+        doctest.testmod()
+
+        import python_ta
+        python_ta.check_all(config={
+            'max-line-length': 100,
+            'extra-imports': ['argparse', 'json', 'multiprocessing', 'os', 'sys', 'numpy',
+                              'compact_graph', 'similarity', 'pyarrow', 'pyarrow.parquet'],
+            'max-nested-blocks': 4,
+            'allowed-io': ['recommend_all', '_write_shards', '_read_checkpoint',
+                           '_write_checkpoint', 'main']
+        })
@@ -0,0 +1,467 @@
+"""CSC111 Winter 2021: Project Phase 2
+
+Module Description
+==================
+This module contains benchmarks for the algorithms in this project, which are run on synthetic
+graphs so that their results are reproducible and don't depend on the Wikipedia API.
+
+The benchmark suite times the main steps of the program on seeded synthetic categories with
+power-law degree distributions, from 100 to 10^5 pages by default, and records the results as
+JSON so that they can be compared across commits. For example:
+
+    python benchmark.py --output before.json
+    (make some changes)
+    python benchmark.py --output after.json --baseline before.json
+
+Graphs of 10^6 pages take several minutes and a few gigabytes of memory, so they are only
+benchmarked when chosen with --sizes, such as --sizes 1000 1000000. Run without arguments, this
+module runs its doctests and python_ta checks instead of the benchmarks.
+
+Copyright and Usage Information
+===============================
+The usage of this program should follow the GNU General Public License.
+
+This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Optional
+import numpy as np
+import algorithms
+import compact_graph
+import layout
+import minhash
+import page_source
+import recommendations
+import similarity
+import versioned_graph
+
+# The default numbers of pages of the graphs in the benchmark suite
+SUITE_SIZES = (100, 1000, 10 ** 4, 10 ** 5)
+
+# The default fraction by which a benchmark must be slower than its baseline to be a regression
+DEFAULT_TOLERANCE = 0.2
+
+
+def synthetic_category(num_pages: int, avg_links: int = 10, cluster_size: int = 50,
+                       seed: int = 0) -> versioned_graph.VersionedDiGraph:
+    """Return a graph resembling a Wikipedia category with num_pages pages. The pages are split
+    into clusters of related pages, and each page links to about avg_links other pages, mostly
+    within its own cluster, so that pages in the same cluster are similar to each other.
+
+    Preconditions:
+      - num_pages > 1
+      - avg_links > 0
+      - cluster_size > 1
+
+    >>> g = synthetic_category(100, seed=1)
+    >>> len(g.nodes)
+    100
+    >>> g.graph['category']
+    'Synthetic category (100 pages)'
+    """
+    rng = random.Random(seed)
+    titles = [f'Page {i}' for i in range(num_pages)]
+    graph = versioned_graph.VersionedDiGraph(category=f'Synthetic category ({num_pages} pages)')
+    graph.add_nodes_from(titles)
+
+    for i, title in enumerate(titles):
+        cluster_start = i - i % cluster_size
+        cluster_end = min(cluster_start + cluster_size, num_pages)
+        for _ in range(rng.randint(1, 2 * avg_links - 1)):
+            # Link within the cluster 80% of the time, and to any page otherwise
+            if rng.random() < 0.8:
+                target = rng.randrange(cluster_start, cluster_end)
+            else:
+                target = rng.randrange(num_pages)
+            if target != i:
+                graph.add_edge(title, titles[target])
+
+    return graph
+
+
+def powerlaw_category(num_pages: int, avg_links: float = 8, exponent: float = 2.5,
+                      locality: float = 0.5, cluster_size: int = 50,
+                      seed: int = 0) -> compact_graph.CompactGraph:
+    """Return a graph resembling a large Wikipedia category with num_pages pages, whose numbers of
+    links and backlinks both follow power laws with the given exponent, as they do on Wikipedia.
+
+    Each page links to about avg_links other pages on average, although a few pages link to very
+    many. A fraction locality of the links are to pages in the same cluster of cluster_size
+    consecutive pages, so that pages in the same cluster are similar to each other, and the rest
+    are to pages chosen in proportion to their popularity, so that a few pages have very many
+    backlinks. The same arguments always give the same graph.
+
+    Preconditions:
+      - num_pages > 1
+      - avg_links > 0
+      - exponent > 2
+      - 0 <= locality <= 1
+      - cluster_size > 0
+
+    >>> g = powerlaw_category(1000, seed=1)
+    >>> len(g)
+    1000
+    >>> g.number_of_edges() == powerlaw_category(1000, seed=1).number_of_edges()
+    True
+    >>> bool(g.in_degrees().max() > 10 * g.in_degrees().mean())
+    True
+    """
+    rng = np.random.default_rng(seed)
+
+    # Draw the number of links of each page from a Pareto distribution with mean avg_links
+    min_links = avg_links * (exponent - 2) / (exponent - 1)
+    out_degrees = np.minimum(min_links * rng.random(num_pages) ** (-1 / (exponent - 1)),
+                             num_pages - 1).astype(np.int64)
+    sources = np.repeat(np.arange(num_pages), out_degrees)
+
+    # Link to pages in proportion to a Zipf distribution over a random order of popularity, which
+    # gives the numbers of backlinks a power law tail with the same exponent
+    weights = np.cumsum(np.arange(1, num_pages + 1) ** (-1 / (exponent - 1)))
+    popularity = rng.permutation(num_pages)
+    targets = popularity[np.minimum(np.searchsorted(weights, rng.random(len(sources))
+                                                    * weights[-1]), num_pages - 1)]
+
+    # Replace some of the links with links within the same cluster
+    local = rng.random(len(sources)) < locality
+    cluster_starts = sources[local] - sources[local] % cluster_size
+    targets[local] = np.minimum(cluster_starts + rng.integers(0, cluster_size, local.sum()),
+                                num_pages - 1)
+
+    kept = sources != targets
+    return compact_graph.CompactGraph(f'Power-law category ({num_pages} pages)',
+                                      [f'Page {i}' for i in range(num_pages)],
+                                      sources[kept], targets[kept])
+
+
+def stub_source(graph: compact_graph.CompactGraph,
+                latency: float = 0.0) -> page_source.StubSource:
+    """Return a page source answering queries as if graph's category was on Wikipedia, and the
+    links of each page were its edges in graph, which delays each query by latency seconds to
+    simulate the network.
+
+    Preconditions:
+      - latency >= 0
+
+    >>> import link_stats
+    >>> g = compact_graph.CompactGraph('Logic', ['a', 'b', 'c'], [0, 0, 1], [1, 2, 2])
+    >>> link_stats.fetch_link_counts(['a', 'c'], source=stub_source(g))
+    {'a': {'links': 2, 'backlinks': 0}, 'c': {'links': 0, 'backlinks': 2}}
+    """
+    return page_source.StubSource({f'Category:{graph.category}': graph.titles},
+                                  {title: graph.successors(title) for title in graph.titles},
+                                  latency=latency)
+
+
+def benchmark_crawl(num_pages: int = 1000, workers: tuple[int, ...] = (1, 4, 16),
+                    latency: float = 0.01, seed: int = 0) -> list[dict[str, Any]]:
+    """Build the graph of a powerlaw_category with num_pages pages with wiki_graph.create_digraph,
+    fetching it from a stub_source with the given latency, once with each number of workers, and
+    return a list of the time taken, the throughput and the number of queries to each endpoint of
+    each build.
+
+    Preconditions:
+      - num_pages > 1
+      - all(count >= 1 for count in workers)
+      - latency >= 0
+
+    >>> results = benchmark_crawl(100, workers=(2,), latency=0)
+    >>> results[0]['calls']
+    {'categorymembers': 1, 'links': 100}
+    """
+    import wiki_graph
+    category = powerlaw_category(num_pages, seed=seed)
+
+    results = []
+    for count in workers:
+        source = stub_source(category, latency)
+        start = time.perf_counter()
+        wiki_graph.create_digraph(category.category, workers=count, source=source)
+        seconds = time.perf_counter() - start
+        results.append({'workers': count, 'pages': num_pages, 'seconds': seconds,
+                        'pages_per_second': num_pages / seconds, 'calls': dict(source.calls)})
+
+    return results
+
+
+def time_function(func: Callable[[], Any], runs: int = 3,
+                  setup: Optional[Callable[[], Any]] = None) -> dict[str, float]:
+    """Call func() runs times, calling setup() before each call if it is given, and return a
+    dictionary of the fastest and median time taken by func, in seconds.
+
+    Preconditions:
+      - runs > 0
+
+    >>> results = time_function(lambda: sum(range(1000)), runs=2)
+    >>> results['min_seconds'] <= results['median_seconds']
+    True
+    """
+    times = []
+    for _ in range(runs):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return {'min_seconds': min(times), 'median_seconds': statistics.median(times)}
+
+
+def benchmark_suite(sizes: tuple[int, ...] = SUITE_SIZES, runs: int = 3, seed: int = 0,
+                    log: Optional[Callable[[str], Any]] = None) -> dict[str, Any]:
+    """Time the main steps of the program on a powerlaw_category graph of each of the given sizes,
+    and return a dictionary of the results, which can be saved as JSON. If log is given, it is
+    called with a line describing each result as it is measured.
+
+    Each step is timed from a cold start, without the results memoized on the graph by earlier
+    runs, except for top_wiki_page_recommendations, which times a single query once the similarity
+    index it reads from has been built. Building the index is timed by the similarity_index step.
+    The link statistics are fetched from a stub_source, and the layout is the one used by
+    the visualize module.
+
+    Preconditions:
+      - all(size > 1 for size in sizes)
+      - runs > 0
+
+    >>> results = benchmark_suite((100,), runs=1)
+    >>> names = sorted(result['function'] for result in results['results'])
+    >>> names  # doctest: +NORMALIZE_WHITESPACE
+    ['assign_link_stats', 'calculate_pagerank', 'calculate_pagerank_manual', 'layout',
+     'similarity_index', 'top_wiki_page_recommendations']
+    """
+    results = []
+    for size in sizes:
+        category = powerlaw_category(size, seed=seed)
+        graph = category.to_digraph()
+        source = stub_source(category)
+
+        # Recommend pages for the page with the most links, which is the slowest kind of query
+        page = category.titles[int(np.argmax(category.out_degrees()))]
+
+        def recommend() -> list:
+            """Return the recommendations for page."""
+            return recommendations.top_wiki_page_recommendations(page, 10, graph)
+
+        # Each step, and the setup called before each run of it
+        steps = {'calculate_pagerank_manual':
+                     (lambda: algorithms.calculate_pagerank_manual(graph), graph.clear_memo),
+                 'calculate_pagerank':
+                     (lambda: algorithms.calculate_pagerank(graph), graph.clear_memo),
+                 'similarity_index':
+                     (lambda: similarity.SimilarityIndex(graph), graph.clear_memo),
+                 'top_wiki_page_recommendations': (recommend, recommend),
+                 'assign_link_stats':
+                     (lambda: algorithms.assign_link_stats(graph, source=source), graph.clear_memo),
+                 'layout': (lambda: layout.graph_layout(graph, seed), graph.clear_memo)}
+
+        for name, (step, setup) in steps.items():
+            result = {'function': name, 'nodes': size, 'edges': category.number_of_edges(),
+                      'runs': runs, **time_function(step, runs, setup)}
+            results.append(result)
+            if log is not None:
+                log(f"{name} ({size} nodes): {result['min_seconds']:.6f} s")
+
+    return {'commit': _git_commit(), 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'platform': platform.platform(), 'seed': seed,
+            'results': results}
+
+
+def compare_results(baseline: dict[str, Any], current: dict[str, Any],
+                    tolerance: float = DEFAULT_TOLERANCE) -> list[dict[str, Any]]:
+    """Return a list of the benchmarks in both baseline and current, which are results returned
+    by benchmark_suite, with the fastest time of each, the ratio of the current time to the
+    baseline time, and whether the benchmark is more than tolerance slower than the baseline.
+
+    Preconditions:
+      - tolerance >= 0
+
+    >>> old = {'results': [{'function': 'layout', 'nodes': 100, 'min_seconds': 1.0}]}
+    >>> new = {'results': [{'function': 'layout', 'nodes': 100, 'min_seconds': 1.5}]}
+    >>> compare_results(old, new)  # doctest: +NORMALIZE_WHITESPACE
+    [{'function': 'layout', 'nodes': 100, 'baseline_seconds': 1.0, 'current_seconds': 1.5,
+      'ratio': 1.5, 'regression': True}]
+    """
+    baseline_times = {(result['function'], result['nodes']): result['min_seconds']
+                      for result in baseline['results']}
+    comparisons = []
+    for result in current['results']:
+        key = (result['function'], result['nodes'])
+        if key in baseline_times:
+            ratio = result['min_seconds'] / max(baseline_times[key], 1e-9)
+            comparisons.append({'function': key[0], 'nodes': key[1],
+                                'baseline_seconds': baseline_times[key],
+                                'current_seconds': result['min_seconds'], 'ratio': ratio,
+                                'regression': ratio > 1 + tolerance})
+
+    return comparisons
+
+
+def _git_commit() -> Optional[str]:
+    """Return the hash of the git commit being benchmarked, or None if it can't be found."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_minhash_recall(graph: versioned_graph.VersionedDiGraph, n: int = 10,
+                             sample: int = 200, bands: int = 64, rows: int = 1,
+                             seed: int = 0) -> dict[str, float]:
+    """Compare the approximate recommendations of minhash.MinHashIndex with the exact
+    recommendations of recommendations.top_wiki_page_recommendations for a random sample of
+    pages, and return a dictionary of the results.
+
+    The results are the recall@n (the fraction of the exact top n pages that were also in the
+    approximate top n), and the time taken to build each index and to answer each query.
+
+    Preconditions:
+      - n > 0
+      - sample > 0
+
+    >>> results = benchmark_minhash_recall(synthetic_category(200, seed=1), sample=20)
+    >>> 0 <= results['recall'] <= 1
+    True
+    """
+    pages = random.Random(seed).sample(list(graph.nodes), min(sample, len(graph)))
+
+    start = time.perf_counter()
+    exact_index = similarity.SimilarityIndex(graph, n)
+    exact_build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    approx_index = minhash.MinHashIndex(graph, bands, rows, seed)
+    approx_build = time.perf_counter() - start
+
+    found = total = 0
+    exact_query = approx_query = 0.0
+    for page in pages:
+        start = time.perf_counter()
+        exact = {recommendation[1] for recommendation in exact_index.recommendations(page, n)}
+        exact_query += time.perf_counter() - start
+
+        start = time.perf_counter()
+        approx = {recommendation[1] for recommendation in approx_index.recommendations(page, n)}
+        approx_query += time.perf_counter() - start
+
+        found += len(exact & approx)
+        total += len(exact)
+
+    return {'recall': found / total if total else 1.0,
+            'exact_build_seconds': exact_build,
+            'approx_build_seconds': approx_build,
+            'exact_query_seconds': exact_query / len(pages),
+            'approx_query_seconds': approx_query / len(pages)}
+
+
+def benchmark_startup(args: list[str], runs: int = 5) -> dict[str, float]:
+    """Run the Python interpreter with the given arguments in a new process runs times, and return
+    a dictionary of the fastest and median wall-clock time taken, in seconds. This measures the
+    cold start latency of a command, including the time taken to import its modules.
+
+    Preconditions:
+      - runs > 0
+
+    >>> results = benchmark_startup(['-c', 'pass'], runs=1)
+    >>> results['min_seconds'] > 0
+    True
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+
+    return {'min_seconds': min(times), 'median_seconds': statistics.median(times)}
+
+
+def benchmark_import_time(module: str, runs: int = 5) -> dict[str, float]:
+    """Return the time taken to import the given module in a new Python process, as in
+    benchmark_startup.
+
+    Preconditions:
+      - runs > 0
+    """
+    return benchmark_startup(['-c', f'import {module}'], runs)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Run the benchmark suite with the given command line arguments, and exit with status 1 if
+    any benchmark regressed compared to the baseline.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the program on synthetic graphs.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SUITE_SIZES,
+                        help='the numbers of pages of the graphs')
+    parser.add_argument('--runs', type=int, default=3, help='the number of runs of each step')
+    parser.add_argument('--seed', type=int, default=0, help='the seed of the graphs')
+    parser.add_argument('--output', '-o', help='the path to save the results to as JSON')
+    parser.add_argument('--baseline', help='the path of earlier results to compare with')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='the fraction slower than the baseline that is a regression')
+    parser.add_argument('--startup', action='store_true',
+                        help='also report the startup time of the program and its modules')
+    parser.add_argument('--minhash', action='store_true',
+                        help='also report the recall of approximate recommendations')
+    parser.add_argument('--crawl', action='store_true',
+                        help='also report the throughput of building a graph from a stub API')
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        # Report the cold start latency of the program and of importing each of its main modules
+        print('python main.py --help:', benchmark_startup(['main.py', '--help']))
+        for module in ['main', 'compact_graph', 'wiki_graph', 'algorithms', 'recommendations',
+                       'visualize']:
+            print(f'import {module}:', benchmark_import_time(module))
+
+    if args.minhash:
+        # Report the recall and speed of the approximate recommendations for different settings
+        graph = synthetic_category(20000, seed=1)
+        for bands, rows in [(32, 1), (64, 1), (64, 2), (32, 4)]:
+            print(f'bands={bands}, rows={rows}:',
+                  benchmark_minhash_recall(graph, bands=bands, rows=rows))
+
+    if args.crawl:
+        # Report the throughput and number of queries of the crawler with different numbers of
+        # workers, with a simulated network latency
+        for result in benchmark_crawl():
+            print(result)
+
+    results = benchmark_suite(tuple(args.sizes), args.runs, args.seed, print)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            comparisons = compare_results(json.load(file), results, args.tolerance)
+        for comparison in comparisons:
+            print(f"{comparison['function']} ({comparison['nodes']} nodes): "
+                  f"{comparison['ratio']:.2f}x the baseline"
+                  + (' (regression)' if comparison['regression'] else ''))
+        if any(comparison['regression'] for comparison in comparisons):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main()
+    else:
+        import doctest
+        doctest.testmod()
+
+        import python_ta
+        python_ta.check_all(config={
+            'max-line-length': 100,
+            'extra-imports': ['argparse', 'json', 'platform', 'random', 'statistics', 'subprocess',
+                              'sys', 'time', 'numpy', 'algorithms', 'compact_graph', 'layout',
+                              'minhash', 'page_source', 'recommendations', 'similarity',
+                              'versioned_graph'],
+            'max-nested-blocks': 4,
+            'allowed-io': ['main']
+        })
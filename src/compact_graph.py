@@ -0,0 +1,324 @@
+"""CSC111 Winter 2021: Project Phase 2
+
+Module Description
+==================
+This module contains a compact representation of the graph of a Wikipedia category. Pages are
+identified by integer ids, links are stored as compressed sparse row (CSR) arrays in both
+directions, and node attributes such as PageRanks and link counts are stored in arrays, so that the
+graph uses little memory and can be pickled or shared between processes cheaply.
+
+Graphs can be converted to and from NetworkX DiGraphs, for use with the rest of the program, and
+saved to a binary file which is memory-mapped when it is loaded, so that even large graphs can be
+opened almost instantly.
+
+The file starts with an 8 byte magic string, a 4 byte little-endian format version, and an 8 byte
+little-endian length, followed by a JSON header of that length. The header holds the category and
+the byte offset, data type and length of each array. The arrays follow, each starting at a multiple
+of 64 bytes. The titles are stored as a single array of UTF-8 bytes, separated by newlines.
+
+Copyright and Usage Information
+===============================
+The usage of this program should follow the GNU General Public License.
+
+This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
+"""
+from __future__ import annotations
+import json
+import struct
+import sys
+from typing import Optional, TYPE_CHECKING
+import numpy as np
+
+# networkx and scipy are slow to import, so they are only imported by the methods that need them
+if TYPE_CHECKING:
+    import networkx as nx
+    from scipy import sparse
+    import versioned_graph
+
+# The version of the binary file format written by save, which must be incremented whenever the
+# format changes
+FORMAT_VERSION = 1
+
+# The start of every graph file, the format of the version and header length which follow it, and
+# the alignment in bytes of each array in the file
+_MAGIC = b'WIKIGRPH'
+_PREFIX = struct.Struct('<IQ')
+_ALIGNMENT = 64
+
+# The names of the array attributes of a CompactGraph which are saved to graph files
+_ARRAYS = ('out_indptr', 'out_indices', 'in_indptr', 'in_indices', 'pagerank', 'links',
+           'backlinks')
+
+
+class CompactGraph:
+    """A compact, directed graph of the pages in a Wikipedia category.
+
+    The ids of the pages are 0 to n - 1, where n is the number of pages, and the successors of the
+    page with id i are out_indices[out_indptr[i]:out_indptr[i + 1]], in increasing order. The
+    predecessors are stored in the same way in in_indptr and in_indices.
+
+    Instance Attributes:
+      - category: the title of the category, without the category prefix
+      - titles: the title of each page, indexed by id
+      - out_indptr: where the successors of each page start and end in out_indices
+      - out_indices: the ids of the successors of every page
+      - in_indptr: where the predecessors of each page start and end in in_indices
+      - in_indices: the ids of the predecessors of every page
+      - pagerank: the PageRank of each page, or NaN if it hasn't been assigned
+      - links: the total number of links of each page, or -1 if it hasn't been assigned
+      - backlinks: the total number of backlinks of each page, or -1 if it hasn't been assigned
+
+    Representation Invariants:
+      - len(self.out_indptr) == len(self.in_indptr) == len(self.titles) + 1
+      - len(self.out_indices) == len(self.in_indices)
+      - len(self.pagerank) == len(self.links) == len(self.backlinks) == len(self.titles)
+
+    >>> g = CompactGraph('Logic', ['Prolog', 'Datalog', 'Mercury'], [0, 1, 2], [1, 0, 0])
+    >>> g.successors('Mercury')
+    ['Prolog']
+    >>> g.predecessors('Prolog')
+    ['Datalog', 'Mercury']
+    >>> sorted(g.to_digraph().edges)
+    [('Datalog', 'Prolog'), ('Mercury', 'Prolog'), ('Prolog', 'Datalog')]
+    """
+    __slots__ = ('category', 'titles', 'out_indptr', 'out_indices', 'in_indptr', 'in_indices',
+                 'pagerank', 'links', 'backlinks', '_ids')
+    category: str
+    titles: list[str]
+    out_indptr: np.ndarray
+    out_indices: np.ndarray
+    in_indptr: np.ndarray
+    in_indices: np.ndarray
+    pagerank: np.ndarray
+    links: np.ndarray
+    backlinks: np.ndarray
+    _ids: dict[str, int]
+
+    def __init__(self, category: str, titles: list[str], sources: list[int],
+                 targets: list[int]) -> None:
+        """Initialize a graph of the given category, with the given page titles and an edge from
+        page sources[i] to page targets[i] for each i. Duplicate edges are ignored.
+
+        Preconditions:
+          - len(sources) == len(targets)
+          - all(0 <= i < len(titles) for i in sources + targets)
+        """
+        size = len(titles)
+        self.category = category
+        self.titles = [sys.intern(title) for title in titles]
+        self._ids = {title: i for i, title in enumerate(self.titles)}
+
+        # Sort the edges by source, then target, removing duplicates
+        keys = np.unique(np.asarray(sources, dtype=np.int64) * size
+                         + np.asarray(targets, dtype=np.int64))
+        sources, targets = keys // max(size, 1), keys % max(size, 1)
+
+        self.out_indptr = _indptr(sources, size)
+        self.out_indices = targets.astype(np.int32)
+
+        order = np.lexsort((sources, targets))
+        self.in_indptr = _indptr(targets, size)
+        self.in_indices = sources[order].astype(np.int32)
+
+        self.pagerank = np.full(size, np.nan)
+        self.links = np.full(size, -1, dtype=np.int64)
+        self.backlinks = np.full(size, -1, dtype=np.int64)
+
+    def __len__(self) -> int:
+        """Return the number of pages in the graph."""
+        return len(self.titles)
+
+    def __contains__(self, title: str) -> bool:
+        """Return whether the page with the given title is in the graph."""
+        return title in self._ids
+
+    def number_of_edges(self) -> int:
+        """Return the number of links between pages in the graph."""
+        return len(self.out_indices)
+
+    def id_of(self, title: str) -> int:
+        """Return the id of the page with the given title.
+
+        Preconditions:
+          - title in self
+        """
+        return self._ids[title]
+
+    def successors(self, title: str) -> list[str]:
+        """Return the titles of the pages linked to by the page with the given title.
+
+        Preconditions:
+          - title in self
+        """
+        i = self._ids[title]
+        return [self.titles[j] for j in self.out_indices[self.out_indptr[i]:self.out_indptr[i + 1]]]
+
+    def predecessors(self, title: str) -> list[str]:
+        """Return the titles of the pages which link to the page with the given title.
+
+        Preconditions:
+          - title in self
+        """
+        i = self._ids[title]
+        return [self.titles[j] for j in self.in_indices[self.in_indptr[i]:self.in_indptr[i + 1]]]
+
+    def out_degrees(self) -> np.ndarray:
+        """Return an array of the number of successors of each page, indexed by id."""
+        return np.diff(self.out_indptr)
+
+    def in_degrees(self) -> np.ndarray:
+        """Return an array of the number of predecessors of each page, indexed by id."""
+        return np.diff(self.in_indptr)
+
+    def adjacency_matrix(self) -> sparse.csr_matrix:
+        """Return the adjacency matrix of the graph, in the same form as
+        algorithms.adjacency_matrix, without copying the edge arrays.
+        """
+        from scipy import sparse
+        size = len(self.titles)
+        return sparse.csr_matrix((np.ones(len(self.out_indices), dtype=np.int64),
+                                  self.out_indices, self.out_indptr), shape=(size, size))
+
+    def to_digraph(self) -> versioned_graph.VersionedDiGraph:
+        """Return a NetworkX DiGraph of this graph, for use with the algorithms, recommendations
+        and visualize modules. Assigned PageRanks and link statistics are copied to the
+        pagerank, links, backlinks, local_links and local_backlinks node attributes.
+        """
+        import versioned_graph
+        digraph = versioned_graph.VersionedDiGraph(category=self.category)
+        out_degrees = self.out_degrees()
+        in_degrees = self.in_degrees()
+
+        for i, title in enumerate(self.titles):
+            attributes = {}
+            if not np.isnan(self.pagerank[i]):
+                attributes['pagerank'] = float(self.pagerank[i])
+            if self.links[i] >= 0:
+                attributes.update(links=int(self.links[i]), backlinks=int(self.backlinks[i]),
+                                  local_links=int(out_degrees[i]),
+                                  local_backlinks=int(in_degrees[i]))
+            digraph.add_node(title, **attributes)
+
+        sources = np.repeat(np.arange(len(self.titles)), out_degrees)
+        digraph.add_edges_from((self.titles[u], self.titles[v])
+                               for u, v in zip(sources.tolist(), self.out_indices.tolist()))
+        return digraph
+
+
+def from_digraph(graph: nx.DiGraph, category: Optional[str] = None) -> CompactGraph:
+    """Return a CompactGraph of the given NetworkX DiGraph, whose nodes are page titles. The
+    pagerank, links and backlinks node attributes are copied when they are present. The category is
+    taken from the graph's category attribute if it isn't given.
+
+    >>> import networkx as nx
+    >>> g = nx.DiGraph([('Prolog', 'Datalog')], category='Logic')
+    >>> g.nodes['Prolog']['pagerank'] = 0.25
+    >>> compact = from_digraph(g)
+    >>> compact.category, compact.titles, compact.pagerank.tolist()
+    ('Logic', ['Prolog', 'Datalog'], [0.25, nan])
+    """
+    titles = list(graph.nodes)
+    ids = {title: i for i, title in enumerate(titles)}
+    compact = CompactGraph(category if category is not None else graph.graph['category'], titles,
+                           [ids[u] for u, _ in graph.edges], [ids[v] for _, v in graph.edges])
+
+    for i, (_, data) in enumerate(graph.nodes(data=True)):
+        compact.pagerank[i] = data.get('pagerank', np.nan)
+        compact.links[i] = data.get('links', -1)
+        compact.backlinks[i] = data.get('backlinks', -1)
+
+    return compact
+
+
+def save(graph: CompactGraph, path: str) -> None:
+    """Save graph, including its PageRanks and link statistics, to a binary file at path.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'logic.graph')
+    >>> g = CompactGraph('Logic', ['Prolog', 'Datalog', 'Mercury'], [0, 1, 2], [1, 0, 0])
+    >>> g.pagerank[:] = [0.5, 0.3, 0.2]
+    >>> save(g, path)
+    >>> loaded = load(path)
+    >>> loaded.category, loaded.titles, loaded.successors('Mercury'), loaded.pagerank.tolist()
+    ('Logic', ['Prolog', 'Datalog', 'Mercury'], ['Prolog'], [0.5, 0.3, 0.2])
+    """
+    arrays = {'titles': np.frombuffer('\n'.join(graph.titles).encode('utf-8'), dtype=np.uint8)}
+    arrays.update((name, getattr(graph, name)) for name in _ARRAYS)
+
+    # Lay out the arrays after the header, which is padded to a multiple of _ALIGNMENT bytes
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        entries[name] = [offset, array.dtype.str, len(array)]
+        offset = _align(offset + array.nbytes)
+
+    header = json.dumps({'category': graph.category, 'arrays': entries}).encode('utf-8')
+    start = _align(len(_MAGIC) + _PREFIX.size + len(header))
+
+    with open(path, 'wb') as file:
+        file.write(_MAGIC + _PREFIX.pack(FORMAT_VERSION, len(header)) + header)
+        for name, array in arrays.items():
+            file.seek(start + entries[name][0])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.truncate(start + offset)
+
+
+def load(path: str) -> CompactGraph:
+    """Load a graph saved by save from the binary file at path. The graph's arrays are
+    memory-mapped from the file rather than read into memory, and changing them doesn't change the
+    file.
+
+    Raise a ValueError if the file isn't a graph file, or was saved in another format version.
+    """
+    with open(path, 'rb') as file:
+        prefix = file.read(len(_MAGIC) + _PREFIX.size)
+        if len(prefix) != len(_MAGIC) + _PREFIX.size or prefix[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f'{path} is not a graph file.')
+        version, header_length = _PREFIX.unpack(prefix[len(_MAGIC):])
+        if version != FORMAT_VERSION:
+            raise ValueError(f'{path} has format version {version}, but version '
+                             f'{FORMAT_VERSION} is required.')
+        header = json.loads(file.read(header_length).decode('utf-8'))
+
+    start = _align(len(prefix) + header_length)
+    data = np.memmap(path, dtype=np.uint8, mode='c')
+    arrays = {}
+    for name, (offset, dtype, length) in header['arrays'].items():
+        begin = start + offset
+        arrays[name] = data[begin:begin + length * np.dtype(dtype).itemsize].view(dtype)
+
+    graph = CompactGraph.__new__(CompactGraph)
+    graph.category = header['category']
+    titles = arrays.pop('titles').tobytes().decode('utf-8')
+    graph.titles = [sys.intern(title) for title in titles.split('\n')] if titles else []
+    graph._ids = {title: i for i, title in enumerate(graph.titles)}
+    for name in _ARRAYS:
+        setattr(graph, name, arrays[name])
+
+    return graph
+
+
+def _align(offset: int) -> int:
+    """Return the smallest multiple of _ALIGNMENT which is at least offset."""
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _indptr(rows: np.ndarray, size: int) -> np.ndarray:
+    """Return the CSR index pointer array for the given sorted row indices of a matrix with size
+    rows.
+    """
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+    return indptr
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 100,
+        'extra-imports': ['json', 'struct', 'sys', 'networkx', 'numpy', 'scipy', 'versioned_graph'],
+        'max-nested-blocks': 4
+    })
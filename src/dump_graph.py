@@ -0,0 +1,311 @@
+"""CSC111 Winter 2021: Project Phase 2
+
+Module Description
+==================
+This module is for creating NetworkX graphs of Wikipedia categories from the gzip-compressed SQL
+dumps published at https://dumps.wikimedia.org, without making any requests to the Wikipedia API.
+
+Each of the categorylinks, page, pagelinks and linktarget dumps (current dumps of the other tables
+refer to the linktarget dump) is streamed from disk once, and only the rows that involve members
+of the category are kept, so memory use depends on the size of the category rather than the size
+of the dumps. The only exception is a categorylinks dump which refers to link targets, which
+requires the category's row of the linktarget dump to be found first.
+
+Copyright and Usage Information
+===============================
+The usage of this program should follow the GNU General Public License.
+
+This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
+"""
+import gzip
+import itertools
+import re
+from typing import Iterator, Optional, TextIO, Union
+import networkx as nx
+import versioned_graph
+
+# The title prefixes of the namespaces that category members commonly belong to
+NAMESPACE_PREFIXES = {0: '', 2: 'User:', 4: 'Wikipedia:', 6: 'File:', 10: 'Template:',
+                      12: 'Help:', 14: 'Category:', 100: 'Portal:', 118: 'Draft:'}
+
+# A single value or parenthesis within the VALUES list of an INSERT statement
+_TOKEN = re.compile(r"'((?:[^'\\]|\\.)*)'|(NULL)|([^,()'\s;]+)|([()])")
+
+# The columns of each table in the older schema, used for dumps without a CREATE TABLE statement
+LEGACY_COLUMNS = {'categorylinks': ('cl_from', 'cl_to'),
+                  'page': ('page_id', 'page_namespace', 'page_title'),
+                  'pagelinks': ('pl_from', 'pl_namespace', 'pl_title', 'pl_from_namespace')}
+
+# The namespace of category pages
+_CATEGORY_NAMESPACE = 14
+
+# The definition of a column within a CREATE TABLE statement
+_COLUMN = re.compile(r'\s*`(\w+)`')
+
+# A backslash escape sequence within a quoted string
+_ESCAPE = re.compile(r'\\(.)')
+_ESCAPES = {'0': '\0', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+
+
+def create_digraph_from_dumps(category: str, categorylinks_path: str, page_path: str,
+                              pagelinks_path: str,
+                              linktarget_path: Optional[str] = None) -> nx.DiGraph:
+    """Return a NetworkX DiGraph of the given Wikipedia category, built from the categorylinks,
+    page and pagelinks SQL dumps at the given paths. The graph has the same shape as the graph
+    returned by wiki_graph.create_digraph: its nodes are the titles of the category's members,
+    sorted alphabetically.
+
+    The columns of each dump are read from its CREATE TABLE statement. Current dumps identify the
+    target of each link (pl_target_id), and of each category membership (cl_target_id), by the id
+    of a row of the linktarget table, so linktarget_path must then be the path of the linktarget
+    dump. Older dumps, which name the targets directly (pl_namespace and pl_title, and cl_to), are
+    also supported. Raise a ValueError if a dump has neither set of columns, or if the linktarget
+    dump is needed but not given.
+
+    >>> import os, tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> paths = [os.path.join(d, name) for name in ['cl.sql.gz', 'page.sql.gz', 'pl.sql.gz']]
+    >>> write_dump(paths[0], 'categorylinks', [(1, 'Logic_programming_languages'),
+    ...                                        (2, 'Logic_programming_languages'),
+    ...                                        (3, 'Programming_languages')])
+    >>> write_dump(paths[1], 'page', [(1, 0, 'Prolog'), (2, 0, "Ciao_(programming_language)"),
+    ...                               (3, 0, 'Python_(programming_language)')])
+    >>> write_dump(paths[2], 'pagelinks', [(1, 0, 'Ciao_(programming_language)', 0),
+    ...                                    (2, 0, 'Prolog', 0), (1, 0, 'Logic', 0),
+    ...                                    (3, 0, 'Prolog', 0)])
+    >>> g = create_digraph_from_dumps('Logic programming languages', *paths)
+    >>> list(g.nodes)
+    ['Ciao (programming language)', 'Prolog']
+    >>> sorted(g.edges)
+    [('Ciao (programming language)', 'Prolog'), ('Prolog', 'Ciao (programming language)')]
+
+    With the current schema, the same graph is built through the linktarget table:
+
+    >>> paths.append(os.path.join(d, 'lt.sql.gz'))
+    >>> write_dump(paths[3], 'linktarget', [(7, 14, 'Logic_programming_languages'),
+    ...                                     (8, 0, 'Prolog'), (9, 0, 'Ciao_(programming_language)'),
+    ...                                     (10, 0, 'Logic')],
+    ...            ('lt_id', 'lt_namespace', 'lt_title'))
+    >>> write_dump(paths[0], 'categorylinks', [(1, 'Prolog', 7), (2, 'Ciao', 7)],
+    ...            ('cl_from', 'cl_sortkey', 'cl_target_id'))
+    >>> write_dump(paths[2], 'pagelinks', [(1, 0, 9), (2, 0, 8), (1, 0, 10)],
+    ...            ('pl_from', 'pl_from_namespace', 'pl_target_id'))
+    >>> sorted(create_digraph_from_dumps('Logic programming languages', *paths).edges)
+    [('Ciao (programming language)', 'Prolog'), ('Prolog', 'Ciao (programming language)')]
+    >>> create_digraph_from_dumps('Logic programming languages', *paths[:3])
+    Traceback (most recent call last):
+    ValueError: The categorylinks dump refers to link targets, so the linktarget dump is required.
+    """
+    cl_to = category.replace(' ', '_')
+
+    # Find the ids of the category's members
+    rows = _iter_dump(categorylinks_path, 'categorylinks',
+                      [('cl_from', 'cl_to'), ('cl_from', 'cl_target_id')])
+    if next(rows)[1] == 'cl_to':
+        member_ids = {page_id for page_id, to in rows if to == cl_to}
+    else:
+        # The category page's link target id, which is unique, so the search stops once it's found.
+        # The members can't be known before it is found, so the linktarget dump is searched first
+        target_id = next((lt_id for lt_id, namespace, title in
+                          _iter_linktargets(linktarget_path, 'categorylinks')
+                          if namespace == _CATEGORY_NAMESPACE and title == cl_to), None)
+        member_ids = {page_id for page_id, target in rows
+                      if target is not None and target == target_id}
+    if not member_ids:
+        raise ValueError('Category not found.')
+
+    # Find the namespace and title of each member
+    members = {page_id: (namespace, title) for page_id, namespace, title in
+               iter_columns(page_path, 'page', ('page_id', 'page_namespace', 'page_title'))
+               if page_id in member_ids}
+    titles = {key: _display_title(*key) for key in members.values()}
+
+    digraph = versioned_graph.VersionedDiGraph(category=category)
+
+    # Add each page to the graph
+    digraph.add_nodes_from(sorted(titles.values()))
+
+    # Find the namespace and title of the target of each link from a member
+    rows = _iter_dump(pagelinks_path, 'pagelinks',
+                      [('pl_from', 'pl_namespace', 'pl_title'), ('pl_from', 'pl_target_id')])
+    if len(next(rows)) == 3:
+        links = ((page_id, (namespace, title)) for page_id, namespace, title in rows
+                 if page_id in members)
+    else:
+        # Keep the link target ids of the links from members until the linktarget dump is read
+        linktargets = _iter_linktargets(linktarget_path, 'pagelinks')
+        target_ids = [(page_id, target_id) for page_id, target_id in rows if page_id in members]
+        needed = {target_id for _, target_id in target_ids}
+        targets = {lt_id: (namespace, title) for lt_id, namespace, title in linktargets
+                   if lt_id in needed and (namespace, title) in titles}
+        links = ((page_id, targets.get(target_id)) for page_id, target_id in target_ids)
+
+    # Add links between pages within the category
+    for page_id, target in links:
+        if target in titles:
+            digraph.add_edge(titles[members[page_id]], titles[target])
+
+    return digraph
+
+
+def iter_rows(path: str, table: str) -> Iterator[tuple]:
+    """Yield the rows inserted into the given table by the gzip-compressed SQL dump at path, one at
+    a time. Integer columns are returned as ints, NULL as None, and everything else as strings.
+    """
+    prefix = f'INSERT INTO `{table}` VALUES '
+
+    with gzip.open(path, 'rt', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            if line.startswith(prefix):
+                yield from _parse_values(line, len(prefix))
+
+
+def iter_columns(path: str, table: str, names: tuple[str, ...]) -> Iterator[tuple]:
+    """Yield the values of the columns with the given names of each row inserted into the given
+    table by the dump at path, as in iter_rows.
+
+    Preconditions:
+      - every name in names is a column of the dump, as returned by dump_columns
+    """
+    rows = _iter_dump(path, table, [names])
+    next(rows)
+    yield from rows
+
+
+def dump_columns(path: str, table: str) -> list[str]:
+    """Return the names of the columns of the given table, in order, from the CREATE TABLE
+    statement of the dump at path. If the dump has no CREATE TABLE statement, return the columns
+    of the table in the older schema, in LEGACY_COLUMNS.
+    """
+    with gzip.open(path, 'rt', encoding='utf-8', errors='replace') as file:
+        return _read_columns(file, table)[0]
+
+
+def write_dump(path: str, table: str, rows: list[tuple],
+               columns: Optional[tuple[str, ...]] = None) -> None:
+    """Write a gzip-compressed SQL dump at path which inserts the given rows into the given table,
+    in the same format as the dumps published by Wikimedia. If columns is given, the dump starts
+    with a CREATE TABLE statement with columns of those names. This is useful for creating small
+    test fixtures.
+    """
+    values = ','.join('(' + ','.join(_format_value(value) for value in row) + ')' for row in rows)
+
+    with gzip.open(path, 'wt', encoding='utf-8') as file:
+        file.write(f'-- MySQL dump of `{table}`\n')
+        if columns is not None:
+            definitions = ',\n'.join(f'  `{name}` varbinary(255) NOT NULL' for name in columns)
+            file.write(f'CREATE TABLE `{table}` (\n{definitions}\n) ENGINE=InnoDB;\n')
+        if rows:
+            file.write(f'INSERT INTO `{table}` VALUES {values};\n')
+
+
+def _read_columns(file: TextIO, table: str) -> tuple[list[str], str]:
+    """Read the dump of the given table in file up to the end of its CREATE TABLE statement, or up
+    to its first INSERT statement, and return the names of the table's columns as in dump_columns,
+    along with the last line read.
+    """
+    columns = []
+    in_statement = False
+    line = ''
+    for line in file:
+        if line.startswith(f'CREATE TABLE `{table}`'):
+            in_statement = True
+        elif in_statement and _COLUMN.match(line):
+            columns.append(_COLUMN.match(line).group(1))
+        elif in_statement or line.startswith('INSERT INTO'):
+            break
+
+    return columns or list(LEGACY_COLUMNS.get(table, ())), line
+
+
+def _iter_dump(path: str, table: str, choices: list[tuple[str, ...]]) -> Iterator[tuple]:
+    """Yield the first of choices whose columns are all in the dump of the given table at path, and
+    then the values of those columns of each row inserted by the dump, as in iter_columns, reading
+    the dump only once. Raise a ValueError if none of choices is in the dump.
+    """
+    prefix = f'INSERT INTO `{table}` VALUES '
+
+    with gzip.open(path, 'rt', encoding='utf-8', errors='replace') as file:
+        columns, line = _read_columns(file, table)
+        choice = next((choice for choice in choices
+                       if all(name in columns for name in choice)), None)
+        if choice is None:
+            raise ValueError(f'The {table} dump at {path} has none of the supported sets of '
+                             f'columns {choices}, but has the columns {columns}.')
+        yield choice
+
+        indexes = [columns.index(name) for name in choice]
+        for line in itertools.chain([line], file):
+            if line.startswith(prefix):
+                for row in _parse_values(line, len(prefix)):
+                    yield tuple(row[i] for i in indexes)
+
+
+def _iter_linktargets(path: Optional[str], table: str) -> Iterator[tuple]:
+    """Yield the id, namespace and title of each row of the linktarget dump at path, which the dump
+    of the given table refers to. Raise a ValueError if path is None.
+    """
+    if path is None:
+        raise ValueError(f'The {table} dump refers to link targets, so the linktarget dump is '
+                         f'required.')
+    return iter_columns(path, 'linktarget', ('lt_id', 'lt_namespace', 'lt_title'))
+
+
+def _parse_values(line: str, start: int) -> Iterator[tuple]:
+    """Yield the tuples in the VALUES list of the INSERT statement in line, which begins at index
+    start.
+    """
+    row = []
+    for match in _TOKEN.finditer(line, start):
+        string, null, literal, paren = match.groups()
+        if paren == ')':
+            yield tuple(row)
+        elif paren == '(':
+            row = []
+        elif string is not None:
+            row.append(_ESCAPE.sub(lambda m: _ESCAPES.get(m.group(1), m.group(1)), string))
+        elif null is not None:
+            row.append(None)
+        else:
+            row.append(_parse_literal(literal))
+
+
+def _parse_literal(literal: str) -> Union[int, float, str]:
+    """Return the value of the given unquoted SQL literal."""
+    try:
+        return int(literal)
+    except ValueError:
+        try:
+            return float(literal)
+        except ValueError:
+            return literal
+
+
+def _format_value(value: Optional[Union[int, float, str]]) -> str:
+    """Return the given value as an SQL literal."""
+    if value is None:
+        return 'NULL'
+    elif isinstance(value, str):
+        return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+    else:
+        return str(value)
+
+
+def _display_title(namespace: int, title: str) -> str:
+    """Return the title of the page with the given namespace and dump title, in the same form as
+    the Wikipedia API uses.
+    """
+    prefix = NAMESPACE_PREFIXES.get(namespace, '')
+    return prefix + title.replace('_', ' ')
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 100,
+        'extra-imports': ['gzip', 'itertools', 're', 'networkx', 'versioned_graph'],
+        'max-nested-blocks': 4
+    })
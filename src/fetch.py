@@ -0,0 +1,193 @@
+"""CSC111 Winter 2021: Project Phase 2
+
+Module Description
+==================
+This module contains helpers for fetching data from the Wikipedia API. Independent requests can be
+run concurrently on a bounded pool of worker threads, with per-host rate limiting and retries with
+exponential backoff.
+
+Copyright and Usage Information
+===============================
+The usage of this program should follow the GNU General Public License.
+
+This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Iterable, Iterator, Optional
+import requests
+import metrics
+import wiki_cache
+
+# The exceptions that are worth retrying: network failures and malformed (usually truncated) JSON
+RETRY_EXCEPTIONS = (requests.RequestException, ValueError)
+
+# The URL of the Wikipedia API in each language, and the user agent sent with requests to it
+API_URL = 'https://{language}.wikipedia.org/w/api.php'
+USER_AGENT = 'csc111-graph-project (https://github.com/mtoohey31/csc111-graph-project)'
+
+
+class RateLimiter:
+    """A thread-safe rate limiter which spaces out requests to the same host.
+
+    Instance Attributes:
+      - interval: the minimum number of seconds between the starts of two requests to one host
+
+    Representation Invariants:
+      - self.interval >= 0
+
+    >>> limiter = RateLimiter(0)
+    >>> limiter.wait('en.wikipedia.org')
+    """
+    interval: float
+    _next_slots: dict[str, float]
+    _lock: threading.Lock
+
+    def __init__(self, rate: float) -> None:
+        """Initialize a rate limiter allowing at most rate requests per second to each host. A rate
+        of 0 means that requests are not limited.
+
+        Preconditions:
+          - rate >= 0
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slots = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host: str) -> None:
+        """Block until a request to host is allowed to start."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slots.get(host, now))
+            self._next_slots[host] = slot + self.interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def call_with_retries(func: Callable[[Any], Any], item: Any, host: str,
+                      limiter: Optional[RateLimiter] = None, retries: int = 3,
+                      backoff: float = 0.5) -> Any:
+    """Return func(item), waiting on limiter before each attempt and retrying failed attempts up to
+    retries times, sleeping backoff * 2 ** attempt seconds between them.
+
+    Preconditions:
+      - retries >= 0
+      - backoff >= 0
+
+    A CacheMissError from an offline cache is raised immediately, without retrying.
+
+    >>> call_with_retries(len, 'Prolog', 'en.wikipedia.org')
+    6
+    >>> cache = wiki_cache.WikiCache(':memory:', offline=True)
+    >>> call_with_retries(lambda title: cache.fetch('links', title, len), 'Prolog',
+    ...                   'en.wikipedia.org', backoff=60)
+    Traceback (most recent call last):
+    wiki_cache.CacheMissError: links of 'Prolog' is not cached
+    """
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.wait(host)
+        try:
+            return func(item)
+        except wiki_cache.CacheMissError:
+            # A miss in an offline cache can't be fixed by trying again
+            raise
+        except RETRY_EXCEPTIONS:
+            if attempt >= retries:
+                raise
+            metrics.count('api_retries', host=host)
+            time.sleep(backoff * 2 ** attempt)
+            attempt += 1
+
+
+def fetch_all(func: Callable[[Any], Any], items: Iterable, host: str, workers: int = 1,
+              limiter: Optional[RateLimiter] = None, retries: int = 3,
+              backoff: float = 0.5) -> list:
+    """Return the list of func(item) for each item in items, in the same order as items.
+
+    If workers is 1, the items are fetched one at a time on the calling thread. Otherwise, at most
+    workers items are fetched at once on a thread pool. Each call is rate limited and retried as
+    in call_with_retries.
+
+    Preconditions:
+      - workers >= 1
+
+    >>> fetch_all(len, ['Prolog', 'Datalog', 'Mercury'], 'en.wikipedia.org', workers=2)
+    [6, 7, 7]
+    """
+    if workers <= 1:
+        return [call_with_retries(func, item, host, limiter, retries, backoff) for item in items]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(call_with_retries, func, item, host, limiter, retries, backoff)
+                   for item in items]
+        return [future.result() for future in futures]
+
+
+def fetch_as_completed(func: Callable[[Any], Any], items: Iterable, host: str, workers: int = 1,
+                       limiter: Optional[RateLimiter] = None, retries: int = 3,
+                       backoff: float = 0.5) -> Iterator[tuple[int, Any]]:
+    """Yield the index of each item in items with func(item), as soon as each is fetched. Items are
+    fetched as in fetch_all, so they are yielded in order if workers is 1, and in the order they
+    finish otherwise. If the iterator is closed early, the items which haven't started are
+    cancelled.
+
+    Preconditions:
+      - workers >= 1
+
+    >>> sorted(fetch_as_completed(len, ['Prolog', 'Datalog'], 'en.wikipedia.org', workers=2))
+    [(0, 6), (1, 7)]
+    """
+    if workers <= 1:
+        for i, item in enumerate(items):
+            yield i, call_with_retries(func, item, host, limiter, retries, backoff)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(call_with_retries, func, item, host, limiter, retries,
+                                   backoff): i
+                   for i, item in enumerate(items)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def api_query(language: str = 'en', timeout: float = 10.0) -> Callable[[dict], dict]:
+    """Return a function which sends a query with the given parameters to the Wikipedia API in the
+    given language, and returns the decoded JSON response. The function can be called from several
+    threads at once.
+
+    A ValueError is raised if the response isn't valid JSON or the API reports an error, so that
+    the query can be retried by call_with_retries.
+    """
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    url = API_URL.format(language=language)
+
+    def query(params: dict) -> dict:
+        reply = session.get(url, params={**params, 'format': 'json'}, timeout=timeout)
+        metrics.count('api_bytes', len(reply.content))
+        response = reply.json()
+        if 'error' in response:
+            raise ValueError(response['error'].get('info', 'API error'))
+        return response
+
+    return query
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 100,
+        'extra-imports': ['threading', 'time', 'concurrent.futures', 'requests', 'metrics',
+                          'wiki_cache'],
+        'max-nested-blocks': 4
+    })
@@ -0,0 +1,186 @@
+"""CSC111 Winter 2021: Project Phase 2
+
+Module Description
+==================
+This module calculates the positions of the nodes of graphs for the visualizations in the visualize
+module. Layouts are seeded, so the same graph is always drawn the same way. If the graph is a
+VersionedDiGraph, its layout is memoized until its nodes or edges change, and is then warm-started
+from the previous layout, so that different views of a graph match, and a graph looks much the same
+after a small edit.
+
+Two force-directed layout methods are available. The spring method is NetworkX's
+Fruchterman-Reingold layout, which compares every pair of nodes in each iteration. The mesh method
+is a scalable approximation of the same layout for large graphs: the nodes are counted on a grid,
+and the repulsion between all of the grid cells is calculated at once by convolving the counts with
+a force kernel using the fast Fourier transform, so each iteration takes time proportional to the
+number of nodes and edges.
+
+Copyright and Usage Information
+===============================
+The usage of this program should follow the GNU General Public License.
+
+This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
+"""
+from typing import Any, Optional
+import networkx as nx
+import numpy as np
+from scipy import fft
+import algorithms
+import metrics
+import versioned_graph
+
+# The layout methods, where auto chooses mesh for graphs with more than SCALABLE_THRESHOLD nodes
+METHODS = ('auto', 'spring', 'mesh')
+SCALABLE_THRESHOLD = 1000
+
+# The default seed of the random initial positions of the nodes
+DEFAULT_SEED = 0
+
+# The default number of iterations of a layout, and the fraction of them used when warm-starting
+DEFAULT_ITERATIONS = 50
+WARM_START_FRACTION = 0.2
+
+# The smallest and largest number of grid cells along each side of the mesh layout's grid
+_MIN_GRID = 16
+_MAX_GRID = 256
+
+
+def graph_layout(graph: nx.DiGraph, seed: int = DEFAULT_SEED, method: str = 'auto',
+                 iterations: int = DEFAULT_ITERATIONS) -> dict[Any, np.ndarray]:
+    """Return a dictionary mapping each node of graph to its position, an array of two
+    coordinates between -1 and 1, as calculated by compute_layout.
+
+    If graph is a VersionedDiGraph, the layout is reused until the graph's nodes or edges change,
+    and is then warm-started from the previous layout with the same seed and method.
+
+    Preconditions:
+      - method in METHODS
+      - iterations > 0
+
+    >>> g = versioned_graph.VersionedDiGraph([('a', 'b'), ('b', 'c')])
+    >>> graph_layout(g) is graph_layout(g)
+    True
+    >>> g.add_edge('c', 'd')
+    >>> sorted(graph_layout(g))
+    ['a', 'b', 'c', 'd']
+    """
+    key = ('layout', seed, method, iterations)
+    start = graph.last_value(key) if isinstance(graph, versioned_graph.VersionedDiGraph) else None
+    return versioned_graph.memoize(graph, key,
+                                   lambda: compute_layout(graph, seed, method, iterations, start))
+
+
+@metrics.timed('layout.compute_layout')
+def compute_layout(graph: nx.DiGraph, seed: int = DEFAULT_SEED, method: str = 'auto',
+                   iterations: int = DEFAULT_ITERATIONS,
+                   start: Optional[dict[Any, np.ndarray]] = None) -> dict[Any, np.ndarray]:
+    """Return a dictionary mapping each node of graph to its position, using the given layout
+    method and number of iterations. The initial positions of the nodes are chosen randomly
+    using seed, unless start is given, in which case the nodes in start begin at their positions
+    in it, and only a fraction of the iterations are run.
+
+    Preconditions:
+      - method in METHODS
+      - iterations > 0
+
+    >>> g = nx.DiGraph([('a', 'b'), ('b', 'c'), ('c', 'a')])
+    >>> spring = compute_layout(g, method='spring')
+    >>> all((spring[node] == compute_layout(g, method='spring')[node]).all() for node in g)
+    True
+    >>> mesh = compute_layout(g, method='mesh')
+    >>> bool(np.abs(np.array(list(mesh.values()))).max() <= 1)
+    True
+    """
+    nodes = list(graph.nodes)
+    if not nodes:
+        return {}
+    if method == 'auto':
+        method = 'mesh' if len(nodes) > SCALABLE_THRESHOLD else 'spring'
+
+    rng = np.random.default_rng(seed)
+    positions = rng.uniform(-1, 1, size=(len(nodes), 2))
+    if start is not None:
+        iterations = max(1, int(iterations * WARM_START_FRACTION))
+        for i, node in enumerate(nodes):
+            if node in start:
+                positions[i] = start[node]
+
+    if method == 'spring':
+        layout = nx.spring_layout(graph, k=1 / len(nodes) ** (1 / 4),
+                                  pos=dict(zip(nodes, positions)), iterations=iterations,
+                                  seed=seed)
+        return {node: layout[node] for node in nodes}
+
+    # Cooling from a lower temperature keeps a warm-started layout close to where it started
+    temperature = 0.1 if start is None else 0.01
+    positions = _mesh_layout(algorithms.adjacency_matrix(graph, nodes), (positions + 1) / 2,
+                             iterations, temperature)
+    return dict(zip(nodes, nx.rescale_layout(positions)))
+
+
+def _mesh_layout(adjacency: Any, positions: np.ndarray, iterations: int,
+                 temperature: float) -> np.ndarray:
+    """Return the positions of the nodes of the graph with the given sparse adjacency matrix after
+    the given number of iterations of the mesh layout, starting from the given positions, which
+    are roughly within the unit square. Each node moves at most temperature in the first
+    iteration, and the temperature is lowered to 0 linearly.
+    """
+    size = len(positions)
+    positions = positions.copy()
+    edges = adjacency.tocoo()
+    sources, targets = edges.row, edges.col
+    optimal_distance = 1 / np.sqrt(size)
+
+    # The repulsive force between two cells, by the difference of their grid coordinates, which is
+    # proportional to 1 / distance in the direction away from the other cell
+    grid = int(np.clip(2 * np.sqrt(size), _MIN_GRID, _MAX_GRID))
+    offsets = np.arange(-(grid - 1), grid)
+    dx, dy = np.meshgrid(offsets, offsets, indexing='ij')
+    squared = np.maximum(dx ** 2 + dy ** 2, 1)
+
+    # The Fourier transforms of the kernels are calculated once, padded to avoid wrapping around
+    padded = fft.next_fast_len(3 * grid - 2)
+    kernels = [fft.rfft2(kernel, (padded, padded)) for kernel in (dx / squared, dy / squared)]
+
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        # Count the nodes in each grid cell
+        low = positions.min(axis=0)
+        cell_size = max(float((positions.max(axis=0) - low).max()), 1e-9) / grid * (1 + 1e-9)
+        cells = np.minimum(((positions - low) / cell_size).astype(np.int64), grid - 1)
+        flat = cells[:, 0] * grid + cells[:, 1]
+        counts = np.bincount(flat, minlength=grid * grid).reshape(grid, grid).astype(float)
+
+        # Repulsion between all nodes, through their cells, as in Fruchterman-Reingold
+        transformed = fft.rfft2(counts, (padded, padded))
+        scale = optimal_distance ** 2 / cell_size
+        displacement = np.column_stack([
+            scale * fft.irfft2(transformed * kernel, (padded, padded))[
+                grid - 1:2 * grid - 1, grid - 1:2 * grid - 1].ravel()[flat]
+            for kernel in kernels])
+
+        # Attraction between linked nodes, proportional to their distance squared
+        delta = positions[targets] - positions[sources]
+        force = delta * (np.hypot(delta[:, 0], delta[:, 1]) / optimal_distance)[:, None]
+        for axis in range(2):
+            displacement[:, axis] += (np.bincount(sources, force[:, axis], size)
+                                      - np.bincount(targets, force[:, axis], size))
+
+        # Move each node in the direction of its displacement, by at most the temperature
+        length = np.maximum(np.hypot(displacement[:, 0], displacement[:, 1]), 1e-9)
+        positions += displacement * (np.minimum(length, temperature) / length)[:, None]
+        temperature -= cooling
+
+    return positions
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 100,
+        'extra-imports': ['networkx', 'numpy', 'scipy', 'algorithms', 'metrics', 'versioned_graph'],
+        'max-nested-blocks': 4
+    })
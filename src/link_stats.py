@@ -0,0 +1,134 @@
+"""CSC111 Winter 2021: Project Phase 2
+
+Module Description
+==================
+This module is for counting the links and backlinks of many Wikipedia pages at once. Rather than
+walking the full link lists of each page one request at a time, the titles are split into batches
+which are each sent as a single multi-title query, and the batches are run concurrently. Only
+counts are kept, so the link lists are never held in memory, and backlinks are requested with the
+smallest possible set of properties.
+
+Copyright and Usage Information
+===============================
+The usage of this program should follow the GNU General Public License.
+
+This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
+"""
+from typing import Callable, Optional
+import fetch
+import metrics
+import page_source
+import wiki_cache
+
+# The largest number of titles the Wikipedia API accepts in one query
+BATCH_SIZE = 50
+
+# The query parameters used to list each kind of link, and the key of the list in each page of the
+# response
+_QUERIES = {'links': ({'prop': 'links', 'pllimit': 'max'}, 'links'),
+            'backlinks': ({'prop': 'linkshere', 'lhprop': 'pageid', 'lhlimit': 'max'},
+                          'linkshere')}
+
+
+def fetch_link_counts(titles: list[str], workers: int = 4, rate: Optional[float] = None,
+                      retries: int = 3, cache: Optional[wiki_cache.WikiCache] = None,
+                      batch_size: int = BATCH_SIZE,
+                      source: Optional[page_source.PageSource] = None) -> dict[str, dict[str, int]]:
+    """Return a dictionary mapping each of the given titles to the number of links and backlinks
+    of that page, where the number of links is the same as len(source.links(title)). Pages that
+    don't exist have no links or backlinks.
+
+    The titles are queried from source (the live English Wikipedia by default) batch_size at a
+    time, on up to workers threads at once, with at most rate requests per second (unlimited if
+    rate is None), counting the continuations of each batch. Failed requests are retried up to
+    retries times.
+
+    If cache is given, the counts are read from it when available, and stored in it otherwise. The
+    links of pages whose full link lists were cached by wiki_graph.create_digraph aren't fetched.
+
+    Preconditions:
+      - workers >= 1
+      - rate is None or rate > 0
+      - retries >= 0
+      - 0 < batch_size <= BATCH_SIZE
+
+    >>> source = page_source.StubSource({}, {'Prolog': ['Datalog', 'Logic'],
+    ...                                      'Datalog': ['Prolog']})
+    >>> fetch_link_counts(['Prolog', 'Datalog'], source=source)
+    {'Prolog': {'links': 2, 'backlinks': 1}, 'Datalog': {'links': 1, 'backlinks': 1}}
+    """
+    counts = {title: {} for title in titles}
+    if cache is not None:
+        for title in titles:
+            counts[title] = cache.get('link_counts', title, {})
+            links = cache.get('links', title) if not counts[title] else None
+            if links is not None:
+                counts[title]['links'] = len(links)
+
+    missing = {kind: [title for title in titles if kind not in counts[title]]
+               for kind in _QUERIES}
+    if cache is not None and cache.offline and any(missing.values()):
+        title = next(title for kind in _QUERIES for title in missing[kind])
+        raise wiki_cache.CacheMissError(f'link_counts of {title!r} is not cached')
+
+    # Split the missing titles of each kind into batches, and fetch them all, possibly concurrently
+    batches = [(kind, missing[kind][start:start + batch_size])
+               for kind in _QUERIES for start in range(0, len(missing[kind]), batch_size)]
+    source = source if source is not None else page_source.WikipediaSource()
+    source = source.limited(fetch.RateLimiter(rate) if rate is not None else None, retries)
+    with metrics.stage('link_stats.fetch_link_counts'):
+        results = fetch.fetch_all(lambda batch: _count_batch(source.query, *batch), batches,
+                                  source.host, workers, retries=0)
+
+    for (kind, batch), batch_counts in zip(batches, results):
+        for title, count in zip(batch, batch_counts):
+            counts[title][kind] = count
+
+    if cache is not None:
+        for title in set(missing['links'] + missing['backlinks']):
+            cache.put('link_counts', title, counts[title])
+
+    return counts
+
+
+def _count_batch(query: Callable[[dict], dict], kind: str, batch: list[str]) -> list[int]:
+    """Return the number of links of the given kind of each page in batch, following the API's
+    continuations until every link has been counted. As with PageSource.links, redirects aren't
+    followed, so the count of a redirect is that of the redirect page itself.
+
+    Preconditions:
+      - kind in _QUERIES
+      - 0 < len(batch) <= BATCH_SIZE
+    """
+    extra_params, key = _QUERIES[kind]
+    params = {'action': 'query', 'titles': '|'.join(batch), **extra_params}
+    normalized = {}
+    counts = {}
+
+    while True:
+        response = query(params)
+        result = response.get('query', {})
+
+        # Titles may be normalized, such as by capitalizing their first letter
+        for rename in result.get('normalized', []):
+            normalized[rename['from']] = rename['to']
+        for page in result.get('pages', {}).values():
+            counts[page['title']] = counts.get(page['title'], 0) + len(page.get(key, []))
+
+        if 'continue' not in response:
+            break
+        params = {**params, **response['continue']}
+
+    return [counts.get(normalized.get(title, title), 0) for title in batch]
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 100,
+        'extra-imports': ['fetch', 'metrics', 'page_source', 'wiki_cache'],
+        'max-nested-blocks': 4
+    })
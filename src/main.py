@@ -4,46 +4,110 @@ Module Description
 ==================
 This is the main module, which hosts the functionality of the program.
 
+Run without arguments, it starts an interactive menu. It can also be run non-interactively with
+one of the following subcommands, which print their results as JSON or CSV so that they can be
+used by scripts and other programs:
+
+  - build: create the graph of a category and save it to a file
+  - pagerank: list the pages of a saved category with the highest PageRanks
+  - recommend: list the recommendations for a page of a saved category
+  - stats: list the link statistics of every page of a saved category
+  - visualize: show one of the visualizations of a saved category
+  - serve: answer ranking and recommendation queries about saved categories over HTTP
+
+For example, `python main.py build "Logic programming languages" logic.graph --pagerank` followed
+by `python main.py pagerank logic.graph --n 5 --format csv`. Run `python main.py --help` or
+`python main.py <subcommand> --help` for all of the options. With `--fixture <path>`, Wikipedia API
+queries are answered from a fixture file saved by page_source.save_fixture instead of the live
+site, and the number of queries to each endpoint is printed when the program finishes. While a
+category is being fetched, the interactive menu prints its progress, as does build with
+`--progress <n>`, along with the page with the highest PageRank so far.
+
+Modules which import networkx, plotly or requests are imported by the functions that use them,
+rather than when the program starts, since they are slow to import and many commands don't need
+them.
+
 Copyright and Usage Information
 ===============================
 The usage of this program should follow the GNU General Public License.
 
 This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
 """
-from typing import Any, Callable, Union, Optional
-import networkx as nx
-import wiki_graph
-import visualize
-import algorithms
-import recommendations
+from __future__ import annotations
+import argparse
+import csv
+import heapq
+import json
+import sys
+from functools import partial
+from typing import Any, Callable, TextIO, TYPE_CHECKING, Union, Optional
+import numpy as np
+import compact_graph
+import metrics
+import wiki_cache
+
+if TYPE_CHECKING:
+    import networkx as nx
+    import page_source
+
+# The path of the persistent cache of Wikipedia API results
+CACHE_PATH = 'wiki_cache.sqlite3'
+
+# The cache used by the program, which is opened when the program starts
+CACHE: Optional[wiki_cache.WikiCache] = None
+
+# The source of the Wikipedia pages used by the program, which is the live site unless a fixture
+# file is given when the program starts
+SOURCE: Optional[page_source.PageSource] = None
 
+# The output formats of the subcommands
+OUTPUT_FORMATS = ('json', 'csv')
 
-def main_menu(graph: Optional[nx.DiGraph] = None) -> None:
+# The formats the metrics recorded while the program runs can be saved in
+METRICS_FORMATS = ('json', 'prometheus')
+
+# The visualizations that can be shown by the visualize subcommand
+VISUALIZATIONS = ('graph', 'pagerank', 'convergence', 'histograms')
+
+# The most pages suggested when the user enters a page that isn't in the category
+MAX_SUGGESTIONS = 10
+
+
+def run_menu() -> None:
+    """Run the interactive menu until the user exits."""
+    graph = None
+    while True:
+        graph = main_menu(graph)
+
+
+def main_menu(graph: Optional[nx.DiGraph] = None) -> Optional[nx.DiGraph]:
     """The main menu of the program. Prints a menu for the user and allows access to the different
-    parts of the program.
+    parts of the program, then returns the selected graph.
     """
     # Check if a graph has been chosen
     if graph is None:
-        choose({
-            "Select Category": (cat_select, graph),
+        return choose({
+            "Select Category": cat_select,
+            "Load Category From File": (cat_load, graph),
             "Category Visualizations (Please select a category first)": None,
             "Category Recommendations (Please select a category first)": None,
-            "Exit": exit})
+            "Exit": sys.exit})
 
     else:
-        choose({
-            f"Select Category (Currently selected \"{graph.graph['category']}\")": (cat_select,
-                                                                                    graph),
+        return choose({
+            f"Select Category (Currently selected \"{graph.graph['category']}\")": cat_select,
+            "Load Category From File": (cat_load, graph),
+            "Save Category To File": (cat_save, graph),
             "Category Visualizations": (cat_visualize, graph),
             "Category Recommendations": (cat_recommend, graph),
-            "Exit": exit})
+            "Exit": sys.exit})
 
 
 def choose(choices: dict[str, Union[None, Callable[[], Any], tuple[Callable[..., Any], Any],
                                     list[Union[Callable[[], Any],
-                                               tuple[Callable[..., Any], Any]]]]]) -> None:
+                                               tuple[Callable[..., Any], Any]]]]]) -> Any:
     """Helper function that asks for valid user input, then calls the corresponding function,
-    unless that function is None.
+    unless that function is None, and returns what it returns.
     """
     # Print the first header
     print("\nSelect an Option:\n")
@@ -57,7 +121,7 @@ def choose(choices: dict[str, Union[None, Callable[[], Any], tuple[Callable[...,
         else:
             print(f'X - {option}')
 
-    valid = [str(i) for i in range(index)]
+    valid = [str(i) for i in range(1, index)]
 
     # Ensuring the user enters valid input
     while True:
@@ -68,91 +132,149 @@ def choose(choices: dict[str, Union[None, Callable[[], Any], tuple[Callable[...,
         else:
             break
 
-    run_action([value for value in choices.values() if value is not None][int(choice) - 1])
+    return run_action([value for value in choices.values() if value is not None][int(choice) - 1])
 
 
-def run_action(action: Union[None, Callable[[], Any], tuple[Callable[..., Any], Any],
+def run_action(action: Union[Callable[[], Any], tuple[Callable[..., Any], Any],
                              list[Union[Callable[[], Any],
-                                        tuple[Callable[..., Any], Any]]]]) -> None:
-    """Run the provided argument, which is an action selected in `choose`."""
+                                        tuple[Callable[..., Any], Any]]]]) -> Any:
+    """Run the provided argument, which is an action selected in `choose`, and return the result
+    of its last step.
+    """
     # Parse the different combinations of data structures, calling the appropriate functions with
     # the provided arguments
     if isinstance(action, list):
+        result = None
         for step in action:
-            if isinstance(step, tuple):
-                if isinstance(step[1], list):
-                    step[0](*step[1])
-                else:
-                    step[0](step[1])
-            else:
-                step()
+            result = run_action(step)
+        return result
     elif isinstance(action, tuple):
         if isinstance(action[1], list):
-            action[0](*action[1])
+            return action[0](*action[1])
         else:
-            action[0](action[1])
+            return action[0](action[1])
     else:
-        action()
+        return action()
+
+
+def cat_select() -> nx.DiGraph:
+    """Allow the user to select a category, and return its graph."""
+    # Prompt the user for input until the graph is created without issue
+    while True:
+        print("\nPlease select a category.\n")
+        choice = input("Category Name: ")
+
+        try:
+            return build_with_progress(choice, sys.stdout, cache=CACHE, source=SOURCE)
+        except ValueError:
+            print(
+                "This category wasn't found on Wikipedia, please"
+                " ensure that you are entering the title without "
+                "the category prefix, ex.: \"Logic programming languages\"")
+
+
+def build_with_progress(category: str, file: TextIO, pagerank: bool = False,
+                        **kwargs: Any) -> nx.DiGraph:
+    """Return the graph of the given category, printing the number of pages and links fetched so
+    far to file after every few pages, as well as the page with the highest PageRank so far if
+    pagerank is True. This takes the same keyword arguments as wiki_graph.stream_digraph.
+    """
+    import recommendations
+    import wiki_graph
+
+    updates = wiki_graph.stream_digraph(category, **kwargs)
+    progress = recommendations.progressive_pagerank_pages(updates, 1) if pagerank else \
+        ((update, None) for update in updates)
 
+    update = None
+    for update, top in progress:
+        line = f'Fetched {update.fetched}/{update.total} pages, ' \
+               f'{update.graph.number_of_edges()} links'
+        if top:
+            line += f', highest PageRank: {top[0][1]}'
+        print(line, file=file, flush=True)
 
-def cat_select(graph: Optional[nx.DiGraph] = None) -> None:
-    """Allow the user to select a category."""
-    # Prompt the user for input and collect that input
-    print("\nPlease select a category.\n")
-    choice = input("Category Name: ")
+    return update.graph
+
+
+def cat_load(graph: Optional[nx.DiGraph] = None) -> Optional[nx.DiGraph]:
+    """Allow the user to load a category saved by cat_save, and return its graph, or the given
+    graph if it couldn't be loaded.
+    """
+    print("\nPlease enter the path of a saved category.\n")
+    path = input("Path: ")
 
-    # Ensure the graph is created without issue before returning to the main menu.
     try:
-        # Get the global graph variable
-        graph = wiki_graph.create_digraph(choice)
-    except ValueError:
-        print(
-            "This category wasn't found on Wikipedia, please"
-            " ensure that you are entering the title without "
-            "the category prefix, ex.: \"Logic programming languages\"")
-        cat_select(graph)
-
-    # Return to the main menu
-    main_menu(graph)
-
-
-def cat_visualize(graph: Optional[nx.DiGraph] = None) -> None:
-    """Allow the user to visualize the selected category."""
-    # Prompt the user to choose a visualization or return to the main menu
-    choose({"Visualize Graph": [(visualize.visualize_digraph, graph), (cat_visualize, graph)],
+        return compact_graph.load(path).to_digraph()
+    except (OSError, ValueError) as error:
+        print(f"This category couldn't be loaded: {error}")
+        return graph
+
+
+def cat_save(graph: nx.DiGraph) -> nx.DiGraph:
+    """Allow the user to save the selected category, along with any PageRanks and link statistics
+    that have been calculated, so that it can be loaded without using the Wikipedia API.
+    """
+    print("\nPlease enter the path to save the category to.\n")
+    path = input("Path: ")
+
+    try:
+        compact_graph.save(compact_graph.from_digraph(graph), path)
+        print(f"Saved \"{graph.graph['category']}\" to {path}.")
+    except OSError as error:
+        print(f"This category couldn't be saved: {error}")
+
+    return graph
+
+
+def cat_visualize(graph: nx.DiGraph) -> nx.DiGraph:
+    """Allow the user to visualize the selected category, until they return to the main menu."""
+    import algorithms
+    import visualize
+
+    # Prompt the user to choose a visualization until they choose the main menu, which is the only
+    # choice that returns True
+    while not choose({
+            "Visualize Graph": (visualize.visualize_digraph, graph),
             "Visualize PageRank Graph": [(algorithms.assign_pagerank, graph),
-                                         (visualize.visualize_pagerank, graph),
-                                         (cat_visualize, graph)],
-            "Visualize PageRank Convergence": [(visualize.visualize_convergence, graph),
-                                               (cat_visualize, graph)],
-            "Visualize Link Histograms": [(algorithms.assign_link_stats, graph),
-                                          (visualize.visualize_histograms, graph),
-                                          (cat_visualize, graph)],
-            "Main Menu": (main_menu, graph)})
-
-
-def cat_recommend(graph: Optional[nx.DiGraph] = None) -> None:
-    """ Allows the user to access the recommendation systems and visualizations.
+                                         partial(visualize.visualize_pagerank, graph,
+                                                 cache=CACHE, source=SOURCE)],
+            "Visualize PageRank Convergence": (visualize.visualize_convergence, graph),
+            "Visualize Link Histograms": [partial(algorithms.assign_link_stats, graph, CACHE,
+                                                  source=SOURCE),
+                                          (visualize.visualize_histograms, graph)],
+            "Main Menu": lambda: True}):
+        pass
+
+    return graph
+
+
+def cat_recommend(graph: nx.DiGraph) -> nx.DiGraph:
+    """ Allows the user to access the recommendation systems and visualizations, until they
+    return to the main menu.
     """
-    # Assigning our variables, these variables get reassigned each time the function is called
-    n = list_input(graph)
-    page = list_input(graph, True)
-
-    # Our dictionary to list mapping our functions to their function calls
-    choose({"List of Top Ranked Wikipedia Pages (Basic)":
-            [(recommendations.print_lst, [1, graph, n]),
-             (cat_recommend, graph)],
-            "List of Top Ranked Wikipedia Pages (PageRank Importance)":
-                [(recommendations.print_lst, [2, graph, n]),
-                 (cat_recommend, graph)],
-            "List of Top Page Recommendations for " + page + ", based on Similarity Scores":
-                [(recommendations.print_lst, [3, graph, n, page]), (cat_recommend, graph)],
-            "Comparison Visual of Top Ranked Pages":
-                [(recommendations.visualize_rankings, [graph, n]), (cat_recommend, graph)],
-            f"Chart Visual of Top  Page Recommendations for {page}, based on Similarity Scores":
-                [(recommendations.visualize_recommendation,
-                  [page, n, graph]), (cat_recommend, graph)],
-            "Main Menu": (main_menu, graph)})
+    import recommendations
+
+    while True:
+        # Assigning our variables, these variables get reassigned after each choice
+        n = list_input(graph)
+        page = list_input(graph, True)
+
+        # Our dictionary mapping our functions to their function calls, where the main menu is
+        # the only choice that returns True
+        if choose({"List of Top Ranked Wikipedia Pages (Basic)":
+                   (recommendations.print_lst, [1, graph, n]),
+                   "List of Top Ranked Wikipedia Pages (PageRank Importance)":
+                       (recommendations.print_lst, [2, graph, n]),
+                   "List of Top Page Recommendations for " + page + ", based on Similarity Scores":
+                       (recommendations.print_lst, [3, graph, n, page]),
+                   "Comparison Visual of Top Ranked Pages":
+                       (recommendations.visualize_rankings, [graph, n]),
+                   f"Chart Visual of Top  Page Recommendations for {page}, based on Similarity "
+                   "Scores": (recommendations.visualize_recommendation,
+                                        [page, n, graph, CACHE, SOURCE]),
+                   "Main Menu": lambda: True}):
+            return graph
 
 
 def list_input(graph: Optional[nx.DiGraph] = None, page: bool = False) -> Union[int, str]:
@@ -161,19 +283,20 @@ def list_input(graph: Optional[nx.DiGraph] = None, page: bool = False) -> Union[
     # Checks for whether the return value is a string
     if page:
         # Asks the user to choose a valid node within our graph
-        print('\nHere is a list of all the pages within your category:')
-        print(graph.nodes)
-        n = input('\nEnter a page from this list you\'d like recommendations for'
+        print(f'\nThere are {graph.number_of_nodes()} pages in your category.')
+        n = input('\nEnter a page from your category you\'d like recommendations for'
                   ' (Spelling counts!): ')
 
-        # Loops until user chooses a node that exists in the Graph
-        while True:
-            if n in graph.nodes:
-                break
+        # Loops until user chooses a node that exists in the Graph, suggesting pages whose titles
+        # contain what they entered
+        while n not in graph.nodes:
+            suggestions = [node for node in graph.nodes if n.lower() in node.lower()]
+            if suggestions:
+                print('\nThat page is not in this category, did you mean one of these?')
+                for suggestion in sorted(suggestions)[:MAX_SUGGESTIONS]:
+                    print(f'  {suggestion}')
             else:
-                print(
-                    '\nThat page is not in this category, choose one from this list and try again:')
-                print(graph.nodes)
+                print('\nThat page is not in this category, please try again.')
 
             n = input('\nPage: ')
 
@@ -193,19 +316,310 @@ def list_input(graph: Optional[nx.DiGraph] = None, page: bool = False) -> Union[
     return n
 
 
+def main(argv: Optional[list[str]] = None) -> None:
+    """Run the program with the given command line arguments, or the arguments the program was
+    started with if argv is None. Without a subcommand, the interactive menu is started.
+    """
+    global CACHE, SOURCE
+    args = _parser().parse_args(argv)
+    if args.fixture is None:
+        CACHE = wiki_cache.WikiCache(args.cache, offline=args.offline)
+    else:
+        import page_source
+
+        # The persistent cache isn't used, so that every query is answered by the fixture
+        SOURCE = page_source.load_fixture(args.fixture, args.latency)
+        CACHE = wiki_cache.WikiCache(':memory:', offline=args.offline)
+
+    try:
+        with metrics.profiled(args.profile, args.trace_memory):
+            if args.command is None:
+                # Print the initial welcome message and start the main menu
+                print('\n~Comparing & Mapping Wikipedia Articles: A Simulation~')
+                print('A program by: Gabe Guralnick, Matthew Toohey, Nathan Hansen & Azka Azmi')
+                run_menu()
+            else:
+                rows = args.run(args)
+                if rows is not None:
+                    with _open_output(args.output) as file:
+                        write_rows(rows, args.format, file)
+    except (ValueError, OSError) as error:
+        sys.exit(f'error: {error}')
+    finally:
+        CACHE.close()
+        if SOURCE is not None:
+            print('Queries:', ', '.join(f'{endpoint}={count}'
+                                        for endpoint, count in sorted(SOURCE.calls.items())),
+                  file=sys.stderr)
+        if args.metrics is not None:
+            write_metrics(args.metrics, args.metrics_format)
+
+
+def write_metrics(path: str, metrics_format: str) -> None:
+    """Save the metrics recorded while the program ran to path, in the given format.
+
+    Preconditions:
+      - metrics_format in METRICS_FORMATS
+    """
+    with open(path, 'w') as file:
+        if metrics_format == 'json':
+            json.dump(metrics.METRICS.report(), file, indent=2)
+        else:
+            file.write(metrics.METRICS.prometheus())
+
+
+def write_rows(rows: list[dict[str, Any]], output_format: str, file: TextIO) -> None:
+    """Write rows to file as a JSON list of objects or as CSV with a header row.
+
+    Preconditions:
+      - output_format in OUTPUT_FORMATS
+      - all(list(row) == list(rows[0]) for row in rows)
+
+    >>> write_rows([{'page': 'Prolog', 'pagerank': 0.5}], 'csv', sys.stdout)
+    page,pagerank
+    Prolog,0.5
+    >>> write_rows([{'page': 'Prolog', 'pagerank': 0.5}], 'json', sys.stdout)
+    [{"page": "Prolog", "pagerank": 0.5}]
+    """
+    if output_format == 'json':
+        json.dump(rows, file)
+        file.write('\n')
+    elif rows:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]), lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _open_output(path: Optional[str]) -> TextIO:
+    """Return the file to write output to: the file at path, or standard output if path is None
+    or '-'. Standard output is not closed when the returned file is closed.
+    """
+    if path is None or path == '-':
+        return open(sys.stdout.fileno(), 'w', encoding='utf-8', closefd=False)
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+def _build(args: argparse.Namespace) -> list[dict[str, Any]]:
+    """Create the graph of args.category, assign the requested statistics, and save it."""
+    import algorithms
+    import wiki_graph
+
+    options = {'workers': args.workers, 'rate': args.rate, 'cache': CACHE, 'depth': args.depth,
+               'max_nodes': args.max_nodes, 'source': SOURCE}
+    if args.progress is None:
+        graph = wiki_graph.create_digraph(args.category, **options)
+    else:
+        graph = build_with_progress(args.category, sys.stderr, True, every=args.progress,
+                                    **options)
+    if args.pagerank:
+        algorithms.assign_pagerank(graph)
+    if args.link_stats:
+        algorithms.assign_link_stats(graph, CACHE, args.workers, SOURCE)
+
+    compact_graph.save(compact_graph.from_digraph(graph), args.path)
+    return [{'category': args.category, 'path': args.path, 'pages': graph.number_of_nodes(),
+             'links': graph.number_of_edges()}]
+
+
+def _pagerank(args: argparse.Namespace) -> list[dict[str, Any]]:
+    """List the pages of the saved category with the highest PageRanks. Saved PageRanks are
+    used unless args.manual is set.
+    """
+    graph = compact_graph.load(args.path)
+    if args.manual or np.isnan(graph.pagerank).any():
+        import algorithms
+        digraph = graph.to_digraph()
+        algorithms.assign_pagerank(digraph, args.manual)
+        ranks = digraph.nodes(data='pagerank')
+    else:
+        ranks = zip(graph.titles, graph.pagerank.tolist())
+
+    # The same as recommendations.top_n, which isn't used since it would import networkx
+    top = heapq.nlargest(args.n, ((rank, page) for page, rank in ranks))
+    return [{'rank': i + 1, 'page': page, 'pagerank': rank} for i, (rank, page) in enumerate(top)]
+
+
+def _recommend(args: argparse.Namespace) -> list[dict[str, Any]]:
+    """List the recommendations for args.page in the saved category. Only the scores of args.page
+    are calculated, in the same way as recommendations.top_wiki_page_recommendations.
+    """
+    import similarity
+
+    graph = compact_graph.load(args.path)
+    if args.page not in graph:
+        raise ValueError(f'{args.page!r} is not in the category {graph.category!r}')
+
+    i = graph.id_of(args.page)
+    adjacency = graph.adjacency_matrix()
+    top = similarity.block_top_k(adjacency, adjacency.T, graph.out_degrees(),
+                                 similarity.title_ranks(graph.titles), graph.titles, i, i + 1,
+                                 args.n)[0]
+    return [{'rank': i + 1, 'page': page, 'score': score} for i, (score, page) in enumerate(top)]
+
+
+def _stats(args: argparse.Namespace) -> list[dict[str, Any]]:
+    """List the link statistics and PageRank of every page of the saved category. Total link
+    counts are fetched if args.fetch is set, and are otherwise only listed if they were saved.
+    """
+    graph = compact_graph.load(args.path)
+    if args.fetch:
+        import algorithms
+        digraph = graph.to_digraph()
+        algorithms.assign_link_stats(digraph, CACHE, args.workers, SOURCE)
+        graph = compact_graph.from_digraph(digraph)
+
+    local_links = graph.out_degrees().tolist()
+    local_backlinks = graph.in_degrees().tolist()
+    return [{'page': title, 'local_links': local_links[i], 'local_backlinks': local_backlinks[i],
+             'links': int(graph.links[i]) if graph.links[i] >= 0 else None,
+             'backlinks': int(graph.backlinks[i]) if graph.backlinks[i] >= 0 else None,
+             'pagerank': None if np.isnan(graph.pagerank[i]) else float(graph.pagerank[i])}
+            for i, title in enumerate(graph.titles)]
+
+
+def _visualize(args: argparse.Namespace) -> None:
+    """Show the chosen visualization of the saved category."""
+    import algorithms
+    import visualize
+
+    graph = compact_graph.load(args.path).to_digraph()
+    if args.visualization == 'graph':
+        visualize.visualize_digraph(graph, seed=args.seed, layout_method=args.layout)
+    elif args.visualization == 'pagerank':
+        algorithms.assign_pagerank(graph)
+        visualize.visualize_pagerank(graph, cache=CACHE, seed=args.seed,
+                                     layout_method=args.layout, source=SOURCE)
+    elif args.visualization == 'convergence':
+        visualize.visualize_convergence(graph)
+    else:
+        algorithms.assign_link_stats(graph, CACHE, source=SOURCE)
+        visualize.visualize_histograms(graph)
+
+
+def _serve(args: argparse.Namespace) -> None:
+    """Serve queries about the saved categories until the program is interrupted."""
+    import service
+
+    ranking_service = service.RankingService(
+        [compact_graph.load(path).to_digraph() for path in args.paths], args.workers)
+    if not args.no_warm:
+        ranking_service.warm()
+
+    print(f'Serving {len(ranking_service.graphs)} categories on http://{args.host}:{args.port}',
+          file=sys.stderr)
+    service.run(ranking_service, args.host, args.port)
+
+
+def _parser() -> argparse.ArgumentParser:
+    """Return the parser of the program's command line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Compare and map the pages of Wikipedia categories. Without a subcommand, '
+                    'an interactive menu is started.')
+    parser.add_argument('--cache', default=CACHE_PATH,
+                        help='the path of the cache of Wikipedia API results')
+    parser.add_argument('--offline', action='store_true',
+                        help="fail instead of using the Wikipedia API when the cache doesn't "
+                             "have a result")
+    parser.add_argument('--fixture',
+                        help='the path of a fixture file saved by page_source.save_fixture to '
+                             'answer Wikipedia API queries from instead of the live site')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='the number of seconds to delay each query to the fixture by')
+    parser.add_argument('--metrics',
+                        help='the path to save the timings of each stage, API queries, cache hit '
+                             'rates and peak memory to when the program finishes')
+    parser.add_argument('--metrics-format', choices=METRICS_FORMATS, default='json',
+                        help='the format of the metrics (default: json)')
+    parser.add_argument('--profile', help='the path to save a cProfile profile of the program to')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='trace memory allocations with tracemalloc, to record the peak memory '
+                             'of each stage in the metrics')
+    subparsers = parser.add_subparsers(dest='command', metavar='subcommand')
+
+    # Options shared by the subcommands which output results, and which use the API
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('--format', choices=OUTPUT_FORMATS, default='json',
+                        help='the output format (default: json)')
+    output.add_argument('--output', '-o', help='the path of the output file (default: stdout)')
+    api = argparse.ArgumentParser(add_help=False)
+    api.add_argument('--workers', type=int, default=4,
+                     help='the number of concurrent requests to the Wikipedia API')
+
+    build = subparsers.add_parser('build', parents=[output, api],
+                                  help='create the graph of a category and save it to a file')
+    build.add_argument('category', help='the title of the category, without the prefix')
+    build.add_argument('path', help='the path to save the graph to')
+    build.add_argument('--rate', type=float, help='the most requests per second')
+    build.add_argument('--depth', type=int, default=0,
+                       help='the number of levels of subcategories to include')
+    build.add_argument('--max-nodes', type=int, help='the most pages to include')
+    build.add_argument('--pagerank', action='store_true', help='calculate and save PageRanks')
+    build.add_argument('--link-stats', action='store_true',
+                       help='fetch and save the total link counts of each page')
+    build.add_argument('--progress', type=int, metavar='N',
+                       help='print the progress and the page with the highest PageRank so far to '
+                            'standard error after the links of every N pages are fetched')
+    build.set_defaults(run=_build)
+
+    pagerank = subparsers.add_parser('pagerank', parents=[output],
+                                     help='list the pages with the highest PageRanks')
+    pagerank.add_argument('path', help='the path of a saved graph')
+    pagerank.add_argument('--n', type=int, default=10, help='the number of pages to list')
+    pagerank.add_argument('--manual', action='store_true',
+                          help="recalculate with this project's PageRank implementation")
+    pagerank.set_defaults(run=_pagerank)
+
+    recommend = subparsers.add_parser('recommend', parents=[output],
+                                      help='list the recommendations for a page')
+    recommend.add_argument('path', help='the path of a saved graph')
+    recommend.add_argument('page', help='the title of the page')
+    recommend.add_argument('--n', type=int, default=10,
+                           help='the number of recommendations to list')
+    recommend.set_defaults(run=_recommend)
+
+    stats = subparsers.add_parser('stats', parents=[output, api],
+                                  help='list the link statistics of every page')
+    stats.add_argument('path', help='the path of a saved graph')
+    stats.add_argument('--fetch', action='store_true',
+                       help="fetch total link counts which weren't saved")
+    stats.set_defaults(run=_stats)
+
+    visualization = subparsers.add_parser('visualize', help='show a visualization of a category')
+    visualization.add_argument('path', help='the path of a saved graph')
+    visualization.add_argument('visualization', choices=VISUALIZATIONS,
+                               help='the visualization to show')
+    visualization.add_argument('--seed', type=int, default=0,
+                               help='the seed of the layout of the graph visualizations')
+    visualization.add_argument('--layout', choices=('auto', 'spring', 'mesh'), default='auto',
+                               help='the layout method of the graph visualizations, where mesh '
+                                    'is faster for large graphs (default: auto)')
+    visualization.set_defaults(run=_visualize, format=None, output=None)
+
+    serve = subparsers.add_parser('serve', help='answer queries about categories over HTTP')
+    serve.add_argument('paths', nargs='+', metavar='path', help='the paths of saved graphs')
+    serve.add_argument('--host', default='127.0.0.1', help='the address to listen on')
+    serve.add_argument('--port', type=int, default=8111, help='the port to listen on')
+    serve.add_argument('--workers', type=int, default=4,
+                       help='the number of queries calculated at once')
+    serve.add_argument('--no-warm', action='store_true',
+                       help="don't calculate PageRanks and similarity indexes until needed")
+    serve.set_defaults(run=_serve, format=None, output=None)
+
+    return parser
+
+
 if __name__ == '__main__':
     # import python_ta
     # python_ta.check_all(config={
     #     'max-line-length': 100,
-    #     'extra-imports': ['wiki_graph', 'visualize', 'algorithms', 'recommendations', 'networkx'],
+    #     'extra-imports': ['argparse', 'csv', 'heapq', 'json', 'sys', 'compact_graph',
+    #                       'wiki_graph', 'visualize', 'algorithms', 'recommendations',
+    #                       'similarity', 'networkx', 'numpy', 'wiki_cache', 'functools',
+    #                       'page_source', 'metrics'],
     #     'max-nested-blocks': 4,
-    #     'allowed-io': ['main_menu', 'choose', 'cat_select', 'cat_visualize', 'cat_recommend',
-    #                    'list_input']
+    #     'allowed-io': ['main_menu', 'choose', 'cat_select', 'cat_load', 'cat_save',
+    #                    'cat_visualize', 'cat_recommend', 'list_input', 'main', '_open_output',
+    #                    '_serve']
     # })
 
-    # Print the initial welcome message
-    print('\n~Comparing & Mapping Wikipedia Articles: A Simulation~')
-    print('A program by: Gabe Guralnick, Matthew Toohey, Nathan Hansen & Azka Azmi')
-
-    # Start the main menu
-    main_menu()
+    main()
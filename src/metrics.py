@@ -0,0 +1,298 @@
+"""CSC111 Winter 2021: Project Phase 2
+
+Module Description
+==================
+This module records where the program spends its time and resources, so that slow category builds
+and visualizations can be diagnosed. The other modules record:
+
+  - the wall time and number of calls of each stage, such as fetching the members of a category,
+    fetching the links of its pages, or calculating PageRanks
+  - the number of queries sent to each endpoint of the Wikipedia API, the bytes received from it,
+    and the number of failed requests that were retried
+  - the hits and misses of the cache of Wikipedia API results, by kind of result
+  - the peak memory used by the process, and by each stage while memory is being traced
+
+Everything is recorded in METRICS, and can be exported with report() as a dictionary which can be
+saved as JSON, or with prometheus() in the Prometheus text format. profiled() additionally runs
+cProfile and tracemalloc on a block of code.
+
+Copyright and Usage Information
+===============================
+The usage of this program should follow the GNU General Public License.
+
+This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
+"""
+import cProfile
+import functools
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+try:
+    import resource
+except ImportError:
+    # The resource module is only available on Unix, so the peak memory of the process isn't
+    # reported on other platforms
+    resource = None
+
+# The prefix of the names of the metrics exported by prometheus()
+PROMETHEUS_PREFIX = 'wiki_'
+
+# The help text of each counter, which is also used by prometheus()
+COUNTERS = {'api_queries': 'Queries sent to the Wikipedia API, by endpoint.',
+            'api_bytes': 'Bytes received from the Wikipedia API.',
+            'api_retries': 'Failed requests that were retried, by host.',
+            'cache_requests': 'Lookups in the cache of Wikipedia API results, by kind and result.'}
+
+
+class Metrics:
+    """The timings and counters recorded by the program. Every method can be called from several
+    threads at once.
+
+    >>> m = Metrics()
+    >>> with m.stage('build'):
+    ...     m.count('api_queries', endpoint='links')
+    ...     m.count('api_queries', 2, endpoint='links')
+    >>> report = m.report()
+    >>> report['stages']['build']['calls']
+    1
+    >>> report['counters']['api_queries']
+    {'endpoint=links': 3}
+    """
+    # The number of calls, total seconds, longest call in seconds, and peak traced memory of each
+    # stage, keyed by stage name
+    _stages: dict[str, dict[str, Any]]
+    # The value of each counter, keyed by its name and sorted labels
+    _counters: dict[tuple[str, tuple[tuple[str, str], ...]], float]
+    # The peak traced memory of the stages being run, innermost last
+    _peaks: list[int]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self._stages = {}
+        self._counters = {}
+        self._peaks = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Record the wall time of the block of code run in this context as a call of the stage
+        with the given name. While tracemalloc is tracing, the peak memory allocated during the
+        block is also recorded. Stages can be nested, and each includes the stages run within it.
+        Memory is traced for the whole process, so the peak of a stage run at the same time as
+        another on a different thread includes the memory allocated by both.
+        """
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            with self._lock:
+                self._peaks.append(tracemalloc.get_traced_memory()[0])
+                tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                stage = self._stages.setdefault(name, {'calls': 0, 'seconds': 0.0,
+                                                       'max_seconds': 0.0})
+                stage['calls'] += 1
+                stage['seconds'] += seconds
+                stage['max_seconds'] = max(stage['max_seconds'], seconds)
+
+                if tracing and self._peaks and tracemalloc.is_tracing():
+                    peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                    stage['peak_traced_bytes'] = max(stage.get('peak_traced_bytes', 0), peak)
+
+                    # The peak of this stage is also a peak of the stage it was run within
+                    if self._peaks:
+                        self._peaks[-1] = max(self._peaks[-1], peak)
+
+    def timed(self, name: str) -> Callable[[Callable], Callable]:
+        """Return a decorator which records each call of the decorated function as a call of the
+        stage with the given name.
+        """
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+
+        return decorator
+
+    def count(self, name: str, amount: float = 1, **labels: str) -> None:
+        """Add amount to the counter with the given name and labels.
+
+        Preconditions:
+          - name in COUNTERS
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def reset(self) -> None:
+        """Discard everything recorded so far."""
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+    def report(self) -> dict[str, Any]:
+        """Return a dictionary of everything recorded so far, which can be saved as JSON.
+
+        The dictionary has the timings of each stage, the value of each counter by its labels, the
+        hit rate of the cache for each kind of result, and the peak memory used by the process in
+        bytes (or None if it isn't available on this platform).
+        """
+        stages, counters = self._snapshot()
+
+        values = {}
+        cache = {}
+        for (name, labels), value in counters:
+            values.setdefault(name, {})[','.join(f'{k}={v}' for k, v in labels)] = value
+            if name == 'cache_requests':
+                labels = dict(labels)
+                kind = cache.setdefault(labels['kind'], {'hits': 0, 'misses': 0})
+                kind['hits' if labels['result'] == 'hit' else 'misses'] += value
+        for kind in cache.values():
+            kind['hit_rate'] = kind['hits'] / (kind['hits'] + kind['misses'])
+
+        return {'stages': stages, 'counters': values, 'cache': dict(sorted(cache.items())),
+                'peak_rss_bytes': peak_rss_bytes()}
+
+    def prometheus(self) -> str:
+        """Return everything recorded so far in the Prometheus text exposition format.
+
+        >>> m = Metrics()
+        >>> m.count('api_queries', 3, endpoint='links')
+        >>> print(m.prometheus().split('\\n# HELP wiki_peak')[0])
+        # HELP wiki_api_queries_total Queries sent to the Wikipedia API, by endpoint.
+        # TYPE wiki_api_queries_total counter
+        wiki_api_queries_total{endpoint="links"} 3
+        """
+        stages, counters = self._snapshot()
+        samples = {}
+        for (name, labels), value in counters:
+            samples.setdefault((f'{name}_total', 'counter', COUNTERS.get(name, name)), []).append(
+                (labels, value))
+
+        stage_metrics = [('stage_calls_total', 'calls', 'counter', 'Calls of each stage.'),
+                         ('stage_seconds_total', 'seconds', 'counter',
+                          'Wall time spent in each stage.'),
+                         ('stage_peak_traced_bytes', 'peak_traced_bytes', 'gauge',
+                          'Peak memory traced by tracemalloc during each stage.')]
+        for metric, key, metric_type, description in stage_metrics:
+            for name, recorded in stages.items():
+                if key in recorded:
+                    samples.setdefault((metric, metric_type, description), []).append(
+                        ((('stage', name),), recorded[key]))
+
+        if peak_rss_bytes() is not None:
+            samples[('peak_rss_bytes', 'gauge', 'Peak memory of the process.')] = [
+                ((), peak_rss_bytes())]
+
+        lines = []
+        for (metric, metric_type, description), values in samples.items():
+            lines.extend([f'# HELP {PROMETHEUS_PREFIX}{metric} {description}',
+                          f'# TYPE {PROMETHEUS_PREFIX}{metric} {metric_type}'])
+            lines.extend(f'{PROMETHEUS_PREFIX}{metric}{_prometheus_labels(labels)} {_number(value)}'
+                         for labels, value in values)
+
+        return '\n'.join(lines) + '\n'
+
+    def _snapshot(self) -> tuple[dict[str, dict[str, Any]], list]:
+        """Return a copy of the timings of each stage, sorted by name, and a sorted list of the
+        keys and values of the counters.
+        """
+        with self._lock:
+            return ({name: dict(recorded) for name, recorded in sorted(self._stages.items())},
+                    sorted(self._counters.items()))
+
+
+# The metrics recorded by the program
+METRICS = Metrics()
+
+
+def stage(name: str) -> Any:
+    """Return METRICS.stage(name)."""
+    return METRICS.stage(name)
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """Return METRICS.timed(name)."""
+    return METRICS.timed(name)
+
+
+def count(name: str, amount: float = 1, **labels: str) -> None:
+    """Call METRICS.count(name, amount, **labels)."""
+    METRICS.count(name, amount, **labels)
+
+
+@contextmanager
+def profiled(profile_path: Optional[str] = None, trace_memory: bool = False) -> Iterator[None]:
+    """Run the block of code in this context with cProfile if profile_path is given, saving the
+    profile to profile_path for use with the pstats module, and with tracemalloc tracing memory if
+    trace_memory is True, so that the peak memory of each stage is recorded.
+    """
+    profiler = cProfile.Profile() if profile_path is not None else None
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        if started_tracing:
+            tracemalloc.stop()
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Return the peak resident memory used by this process so far in bytes, or None if it isn't
+    available on this platform.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # The peak is reported in bytes on macOS, and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _prometheus_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    """Return the given names and values of labels in the Prometheus format.
+
+    >>> _prometheus_labels((('kind', 'links'), ('result', 'hit')))
+    '{kind="links",result="hit"}'
+    >>> _prometheus_labels(())
+    ''
+    """
+    if not labels:
+        return ''
+    escaped = ((name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+               for name, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _number(value: float) -> str:
+    """Return value formatted as a Prometheus sample value."""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 100,
+        'extra-imports': ['cProfile', 'functools', 'sys', 'threading', 'time', 'tracemalloc',
+                          'contextlib', 'resource'],
+        'max-nested-blocks': 4
+    })
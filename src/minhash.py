@@ -0,0 +1,194 @@
+"""CSC111 Winter 2021: Project Phase 2
+
+Module Description
+==================
+This module contains an approximate version of the page recommendations in the recommendations
+module, for categories too large to compare every pair of pages.
+
+Each page's set of linked pages is summarized by a MinHash signature, and the signatures are split
+into bands which are hashed into buckets (locality-sensitive hashing). Pages which share a bucket in
+any band are likely to be similar, so only those candidates are given an exact similarity score.
+More bands find more of the similar pages (higher recall) but produce more candidates to score
+(higher latency), and more rows per band do the opposite.
+
+Copyright and Usage Information
+===============================
+The usage of this program should follow the GNU General Public License.
+
+This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
+"""
+from typing import Any
+import networkx as nx
+import numpy as np
+import algorithms
+import similarity
+import versioned_graph
+
+# The default number of bands of each signature, and of signature values in each band. More rows
+# per band find fewer false candidates, and more bands miss fewer similar pages
+DEFAULT_BANDS = 64
+DEFAULT_ROWS = 1
+
+# A Mersenne prime, used as the modulus of the MinHash hash functions
+_PRIME = (1 << 31) - 1
+
+# The number of hash functions whose values are calculated at once
+_CHUNK_SIZE = 16
+
+
+class MinHashIndex:
+    """A locality-sensitive hashing index of the MinHash signatures of each page's links.
+
+    Instance Attributes:
+      - bands: the number of bands each signature is split into
+      - rows: the number of signature values in each band
+
+    Representation Invariants:
+      - self.bands > 0
+      - self.rows > 0
+
+    >>> g = nx.DiGraph([('a', 'x'), ('a', 'y'), ('b', 'x'), ('b', 'y'), ('c', 'z')])
+    >>> index = MinHashIndex(g, bands=16, rows=2)
+    >>> index.recommendations('a', 5)
+    [(1.0, 'b')]
+    """
+    bands: int
+    rows: int
+    _nodes: list
+    _index: dict
+    _adjacency: Any
+    _ranks: np.ndarray
+    # For each band, the sorted bucket keys of the pages with links, and the pages in that order
+    _keys: list[np.ndarray]
+    _members: list[np.ndarray]
+    # The bucket key of each page in each band, with one row per band
+    _page_keys: np.ndarray
+
+    def __init__(self, graph: nx.DiGraph, bands: int = DEFAULT_BANDS, rows: int = DEFAULT_ROWS,
+                 seed: int = 0) -> None:
+        """Build the index for graph using signatures of bands * rows values, with the hash
+        functions chosen using the given seed.
+
+        Preconditions:
+          - bands > 0
+          - rows > 0
+        """
+        self.bands = bands
+        self.rows = rows
+        self._nodes = list(graph.nodes)
+        self._index = {node: i for i, node in enumerate(self._nodes)}
+        self._adjacency = algorithms.adjacency_matrix(graph, self._nodes)
+        self._ranks = similarity.title_ranks(self._nodes)
+
+        signatures = minhash_signatures(self._adjacency, bands * rows, seed)
+
+        # Combine each band of a signature into a single key, with random odd multipliers
+        multipliers = np.random.default_rng(seed).integers(1, 1 << 62, size=rows) | 1
+        self._page_keys = np.stack([signatures[band * rows:(band + 1) * rows].T @ multipliers
+                                    for band in range(bands)])
+
+        # Pages without links have no similar pages, so they are left out of the buckets
+        linked = np.flatnonzero(np.diff(self._adjacency.indptr))
+        self._keys = []
+        self._members = []
+        for band in range(bands):
+            order = linked[np.argsort(self._page_keys[band, linked], kind='stable')]
+            self._keys.append(self._page_keys[band, order])
+            self._members.append(order)
+
+    def candidates(self, page: Any) -> np.ndarray:
+        """Return an array of the indices of the pages which share a bucket with page in any band,
+        including page itself if it has any links.
+        """
+        i = self._index[page]
+        found = []
+        for band in range(self.bands):
+            key = self._page_keys[band, i]
+            left = np.searchsorted(self._keys[band], key, side='left')
+            right = np.searchsorted(self._keys[band], key, side='right')
+            found.append(self._members[band][left:right])
+        return np.unique(np.concatenate(found))
+
+    def recommendations(self, page: Any, n: int) -> list[tuple[float, Any]]:
+        """Return a list of at most n tuples of the similarity score of another page with page,
+        and that page, in the same order as recommendations.top_wiki_page_recommendations, but
+        only considering the candidates found by the index.
+
+        Preconditions:
+          - n > 0
+        """
+        i = self._index[page]
+        columns = self.candidates(page)
+        if len(columns) == 0:
+            return []
+
+        # Score the candidates exactly
+        degrees = np.diff(self._adjacency.indptr)
+        common = (self._adjacency[columns] @ self._adjacency[i].T).toarray().ravel()
+        keep = common > 0
+        columns, common = columns[keep], common[keep]
+        scores = common / (degrees[i] + degrees[columns] - common)
+
+        return similarity.top_k(i, columns, scores, self._ranks, self._nodes, n)
+
+
+def minhash_signatures(adjacency: Any, num_hashes: int, seed: int) -> np.ndarray:
+    """Return the MinHash signatures of the rows of the given sparse CSR adjacency matrix, as an
+    array with one row per hash function and one column per row of the matrix. Columns for empty
+    rows are filled with the largest possible hash value.
+
+    >>> from scipy import sparse
+    >>> adjacency = sparse.csr_matrix([[1, 1, 0], [1, 1, 0], [0, 0, 0]])
+    >>> signatures = minhash_signatures(adjacency, 4, 0)
+    >>> signatures.shape
+    (4, 3)
+    >>> signatures[:, 0].tolist() == signatures[:, 1].tolist()
+    True
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, size=num_hashes, dtype=np.int64)
+    b = rng.integers(0, _PRIME, size=num_hashes, dtype=np.int64)
+
+    size = adjacency.shape[0]
+    nonempty = np.flatnonzero(np.diff(adjacency.indptr))
+    signatures = np.full((num_hashes, size), _PRIME, dtype=np.int64)
+    if len(nonempty) == 0:
+        return signatures
+
+    columns = adjacency.indices.astype(np.int64)
+    for start in range(0, num_hashes, _CHUNK_SIZE):
+        end = min(start + _CHUNK_SIZE, num_hashes)
+        hashes = (a[start:end, None] * columns[None, :] + b[start:end, None]) % _PRIME
+        signatures[start:end, nonempty] = np.minimum.reduceat(
+            hashes, adjacency.indptr[nonempty], axis=1)
+
+    return signatures
+
+
+def top_similar_approx(graph: nx.DiGraph, page: Any, n: int, bands: int = DEFAULT_BANDS,
+                       rows: int = DEFAULT_ROWS) -> list[tuple[float, Any]]:
+    """Return the approximate top n most similar pages to page, as in
+    MinHashIndex.recommendations. If graph is a VersionedDiGraph, the index is reused until the
+    graph's nodes or edges change.
+
+    Preconditions:
+      - page in graph.nodes
+      - n > 0
+      - bands > 0
+      - rows > 0
+    """
+    index = versioned_graph.memoize(graph, ('minhash_index', bands, rows),
+                                    lambda: MinHashIndex(graph, bands, rows))
+    return index.recommendations(page, n)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 100,
+        'extra-imports': ['networkx', 'numpy', 'algorithms', 'similarity', 'versioned_graph'],
+        'max-nested-blocks': 4
+    })
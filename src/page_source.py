@@ -0,0 +1,457 @@
+"""CSC111 Winter 2021: Project Phase 2
+
+Module Description
+==================
+This module contains the sources of the Wikipedia pages used by the program. Every request for
+Wikipedia data, such as the members of a category, the links of a page or its URL, goes through a
+PageSource, which answers queries in the same form as the Wikipedia API.
+
+WikipediaSource sends the queries to the live Wikipedia API. StubSource answers them from a fixed
+set of categories and pages held in memory, which can be saved to and loaded from a JSON fixture
+file, so that graphs can be built and tested deterministically without network access.
+
+Every source counts the queries sent to each endpoint of the API, and can delay each query to
+simulate a slower network, so that the number of requests made by the program and its throughput
+can be measured. For example:
+
+    >>> source = StubSource({'Category:Logic': ['Prolog', 'Datalog']},
+    ...                     {'Prolog': ['Datalog', 'Logic'], 'Datalog': ['Prolog']})
+    >>> source.category_members('Category:Logic')
+    ['Prolog', 'Datalog']
+    >>> source.links('Prolog')
+    ['Datalog', 'Logic']
+    >>> dict(source.calls)
+    {'categorymembers': 1, 'links': 1}
+
+Copyright and Usage Information
+===============================
+The usage of this program should follow the GNU General Public License.
+
+This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
+"""
+import copy
+import json
+from abc import ABC, abstractmethod
+import threading
+import time
+from collections import Counter
+from typing import Callable, Iterator, Optional
+from urllib.parse import quote
+import fetch
+import metrics
+
+# The most items listed in one response, as requested by limit=max
+MAX_LIMIT = 500
+
+# The URL of each page of Wikipedia in each language, and the characters MediaWiki leaves unescaped
+# in the titles in its URLs
+PAGE_URL = 'https://{language}.wikipedia.org/wiki/{title}'
+_URL_SAFE = ';@$!*(),/~:'
+
+# The most titles which can be given to one query
+MAX_TITLES = 50
+
+# The namespaces of articles and of category pages
+_ARTICLE_NAMESPACE = 0
+_CATEGORY_NAMESPACE = 14
+
+# The prop queries which list items in each page of their response, and the prefix of the names of
+# their parameters
+_PROPS = {'links': 'pl', 'linkshere': 'lh'}
+
+
+class PageSource(ABC):
+    """A source of Wikipedia pages, which answers queries with the given parameters in the same
+    form as the Wikipedia API's query action. This is an abstract class: subclasses implement
+    _send.
+
+    Instance Attributes:
+      - language: the language of the Wikipedia the pages are from
+      - latency: the number of seconds each query is delayed by, to simulate a slower network
+      - calls: the number of queries sent to each endpoint, that is, each list or prop module of
+        the API, such as categorymembers or links, including those which failed
+      - limiter: the rate limiter each query waits on before it is sent, or None if queries are
+        not rate limited
+      - retries: the number of times each failed query is retried
+
+    Representation Invariants:
+      - self.latency >= 0
+      - self.retries >= 0
+    """
+    language: str
+    latency: float
+    calls: Counter
+    limiter: Optional[fetch.RateLimiter]
+    retries: int
+    _lock: threading.Lock
+
+    def __init__(self, language: str = 'en', latency: float = 0.0) -> None:
+        """Initialize a source of pages in the given language, which delays each query by latency
+        seconds.
+
+        Preconditions:
+          - latency >= 0
+        """
+        self.language = language
+        self.latency = latency
+        self.calls = Counter()
+        self.limiter = None
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    @property
+    def host(self) -> str:
+        """The host that queries to this source are rate limited by."""
+        return f'{self.language}.wikipedia.org'
+
+    def limited(self, limiter: Optional[fetch.RateLimiter], retries: int) -> 'PageSource':
+        """Return a copy of this source which waits on limiter before sending each query, including
+        each continuation of a list, and retries each failed query up to retries times with
+        exponential backoff, as in fetch.call_with_retries. The copy counts its queries in the
+        same calls as this source.
+
+        Preconditions:
+          - retries >= 0
+
+        >>> source = StubSource({}, {'Prolog': [f'Page {i}' for i in range(10)]}, page_size=2)
+        >>> limited = source.limited(fetch.RateLimiter(100), 3)
+        >>> start = time.monotonic()
+        >>> len(limited.links('Prolog'))
+        10
+        >>> source.calls['links'], time.monotonic() - start >= 4 / 100
+        (5, True)
+        """
+        source = copy.copy(self)
+        source.limiter = limiter
+        source.retries = retries
+        return source
+
+    def query(self, params: dict) -> dict:
+        """Send a query with the given parameters, and return the response. This can be called from
+        several threads at once. Raise a ValueError if the query still fails after being retried.
+        """
+        return fetch.call_with_retries(self._query_once, params, self.host, self.limiter,
+                                       self.retries)
+
+    def _query_once(self, params: dict) -> dict:
+        """Send a query with the given parameters once, and return the response."""
+        endpoint = params.get('list') or params.get('prop') or 'info'
+        with self._lock:
+            self.calls[endpoint] += 1
+        metrics.count('api_queries', endpoint=endpoint)
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return self._send(params)
+
+    def category_members(self, title: str) -> Optional[list[str]]:
+        """Return the titles of the members of the category page with the given title, such as
+        'Category:Logic', or None if it doesn't exist.
+        """
+        members = [member['title'] for result in self._continued(
+            {'list': 'categorymembers', 'cmtitle': title, 'cmlimit': MAX_LIMIT})
+            for member in result.get('categorymembers', [])]
+
+        # Only an empty category needs to be checked for existence
+        if not members and not self.exists(title):
+            return None
+        return members
+
+    def links(self, title: str) -> list[str]:
+        """Return the titles of the pages linked to by the page with the given title, in the
+        order listed by the API.
+        """
+        return [link['title'] for result in self._continued(
+            {'prop': 'links', 'titles': title, 'pllimit': 'max'})
+            for page in result.get('pages', {}).values() for link in page.get('links', [])]
+
+    def exists(self, title: str) -> bool:
+        """Return whether the page with the given title exists."""
+        pages = self.query({'action': 'query', 'prop': 'info', 'titles': title})['query']['pages']
+        return all('missing' not in page for page in pages.values())
+
+    def fullurl(self, title: str) -> str:
+        """Return the URL of the page with the given title."""
+        return self.fullurls([title])[title]
+
+    def fullurls(self, titles: list[str]) -> dict[str, str]:
+        """Return the URL of each page with the given titles, keyed by title. The URL of a redirect
+        is the URL of the page it redirects to. The URLs are fetched with one query for every
+        MAX_TITLES titles.
+
+        >>> source = StubSource({}, {'Prolog': [], 'Datalog': []}, redirects={'PROLOG': 'Prolog'})
+        >>> source.fullurls(['Datalog', 'PROLOG'])
+        {'Datalog': 'https://en.wikipedia.org/wiki/Datalog', \
+'PROLOG': 'https://en.wikipedia.org/wiki/Prolog'}
+        >>> source.calls['info']
+        1
+        """
+        urls = {}
+        for i in range(0, len(titles), MAX_TITLES):
+            batch = titles[i:i + MAX_TITLES]
+            result = self.query({'action': 'query', 'prop': 'info', 'inprop': 'url',
+                                 'redirects': 1, 'titles': '|'.join(batch)})['query']
+
+            # Follow each title through its normalization and redirect to the page it belongs to
+            renamed = {entry['from']: entry['to']
+                       for entry in result.get('normalized', []) + result.get('redirects', [])}
+            found = {page['title']: page['fullurl'] for page in result['pages'].values()
+                     if 'fullurl' in page}
+            for title in batch:
+                target = renamed.get(title, title)
+                target = renamed.get(target, target)
+                urls[title] = found.get(target, page_url(target, self.language))
+
+        return urls
+
+    def _continued(self, params: dict) -> Iterator[dict]:
+        """Yield the query result of each response to the query with the given parameters,
+        following the API's continuations until the results are complete.
+        """
+        params = {'action': 'query', **params}
+        while True:
+            response = self.query(params)
+            yield response.get('query', {})
+            if 'continue' not in response:
+                break
+            params = {**params, **response['continue']}
+
+    @abstractmethod
+    def _send(self, params: dict) -> dict:
+        """Return the response to a query with the given parameters."""
+
+
+class WikipediaSource(PageSource):
+    """A source of pages from the live Wikipedia API."""
+    _send_query: Callable[[dict], dict]
+
+    def __init__(self, language: str = 'en', latency: float = 0.0,
+                 timeout: float = 10.0) -> None:
+        """Initialize a source of pages from the Wikipedia in the given language, which waits up to
+        timeout seconds for each response.
+
+        Preconditions:
+          - latency >= 0
+          - timeout > 0
+        """
+        super().__init__(language, latency)
+        self._send_query = fetch.api_query(language, timeout)
+
+    def _send(self, params: dict) -> dict:
+        """Return the response of the Wikipedia API to a query with the given parameters."""
+        return self._send_query(params)
+
+
+class StubSource(PageSource):
+    """A source of pages answering queries from the given categories and pages, rather than from
+    Wikipedia. Only the queries sent by this program are supported. Lists are split into responses
+    of at most page_size items, which are continued as by the Wikipedia API.
+
+    Instance Attributes:
+      - categories: the titles of the members of each category, keyed by the category page title
+      - pages: the titles of the pages linked to by each page, keyed by title
+      - redirects: the title of the page each redirect redirects to, keyed by the redirect's title
+      - page_size: the most items listed in one response
+
+    Representation Invariants:
+      - self.page_size > 0
+
+    >>> source = StubSource({}, {'Prolog': ['Datalog'], 'Datalog': ['Prolog', 'Logic']},
+    ...                     page_size=1)
+    >>> source.links('Datalog')
+    ['Prolog', 'Logic']
+    >>> source.calls['links']
+    2
+    >>> source.fullurl('Datalog')
+    'https://en.wikipedia.org/wiki/Datalog'
+    >>> source.category_members('Category:Logic') is None
+    True
+    """
+    categories: dict[str, list[str]]
+    pages: dict[str, list[str]]
+    redirects: dict[str, str]
+    page_size: int
+    _ids: dict[str, int]
+    _backlinks: Optional[dict[str, list[str]]]
+
+    def __init__(self, categories: dict[str, list[str]], pages: dict[str, list[str]],
+                 language: str = 'en', latency: float = 0.0, page_size: int = MAX_LIMIT,
+                 redirects: Optional[dict[str, str]] = None) -> None:
+        """Initialize a source of the given categories and pages. Category pages are in pages if
+        they have any links. Redirects are only followed by info queries.
+
+        Preconditions:
+          - latency >= 0
+          - page_size > 0
+        """
+        super().__init__(language, latency)
+        self.categories = categories
+        self.pages = pages
+        self.redirects = redirects if redirects is not None else {}
+        self.page_size = page_size
+        self._ids = {title: i + 1 for i, title in enumerate({**pages, **categories})}
+        self._backlinks = None
+
+    def _send(self, params: dict) -> dict:
+        """Return the response to a query with the given parameters, as the Wikipedia API would
+        if it only had these pages. Raise a ValueError if the query isn't supported.
+        """
+        if params.get('list') == 'categorymembers':
+            members = [{'ns': self._namespace(title), 'title': title}
+                       for title in self.categories.get(params['cmtitle'], [])]
+            return self._paginate({}, 'categorymembers', members, params, 'cm')
+
+        if 'titles' not in params or params.get('prop') not in ('info', *_PROPS):
+            raise ValueError(f'The stub source does not support the query {params}.')
+
+        pages = {}
+        items = []
+        titles = params['titles'].split('|')
+        redirects = []
+        if params['prop'] == 'info' and params.get('redirects'):
+            redirects = [{'from': title, 'to': self.redirects[title]}
+                         for title in titles if title in self.redirects]
+            titles = list(dict.fromkeys(self.redirects.get(title, title) for title in titles))
+
+        for title in titles:
+            if title not in self._ids:
+                pages[str(-1 - len(pages))] = {'ns': self._namespace(title), 'title': title,
+                                               'missing': ''}
+                continue
+
+            page = {'pageid': self._ids[title], 'ns': self._namespace(title), 'title': title}
+            if 'url' in params.get('inprop', '').split('|'):
+                page['fullurl'] = page_url(title, self.language)
+            if params['prop'] == 'links':
+                items.extend((page, {'ns': self._namespace(link), 'title': link})
+                             for link in self.pages.get(title, []))
+            elif params['prop'] == 'linkshere':
+                items.extend((page, {'pageid': self._ids[other], 'ns': self._namespace(other),
+                                     'title': other})
+                             for other in self._get_backlinks().get(title, []))
+            pages[str(page['pageid'])] = page
+
+        if params['prop'] == 'info':
+            result = {'redirects': redirects, 'pages': pages} if redirects else {'pages': pages}
+            return {'batchcomplete': '', 'query': result}
+        return self._paginate(pages, params['prop'], items, params, _PROPS[params['prop']])
+
+    def _paginate(self, pages: dict, key: str, items: list, params: dict, prefix: str) -> dict:
+        """Return the response listing the part of items requested by the limit and continue
+        parameters with the given prefix. If pages is non-empty, items are tuples of the page they
+        belong to and the item, and are listed in those pages under key.
+        """
+        limit = params.get(prefix + 'limit', 'max')
+        limit = self.page_size if limit == 'max' else min(int(limit), self.page_size)
+        start = int(params.get(prefix + 'continue', 0))
+        end = start + limit
+
+        if pages:
+            for page, item in items[start:end]:
+                page.setdefault(key, []).append(item)
+            response = {'query': {'pages': pages}}
+        else:
+            response = {'query': {key: items[start:end]}}
+
+        if end < len(items):
+            response['continue'] = {prefix + 'continue': str(end), 'continue': '||'}
+        else:
+            response['batchcomplete'] = ''
+        return response
+
+    def _namespace(self, title: str) -> int:
+        """Return the namespace of the page with the given title."""
+        return _CATEGORY_NAMESPACE if title in self.categories else _ARTICLE_NAMESPACE
+
+    def _get_backlinks(self) -> dict[str, list[str]]:
+        """Return the titles of the pages linking to each page, which are found the first time
+        they are needed.
+        """
+        with self._lock:
+            if self._backlinks is None:
+                backlinks = {}
+                for title, links in self.pages.items():
+                    for link in links:
+                        backlinks.setdefault(link, []).append(title)
+                self._backlinks = backlinks
+        return self._backlinks
+
+
+def page_url(title: str, language: str = 'en') -> str:
+    """Return the URL of the page of the Wikipedia in the given language with the given title, which
+    is derived from the title as MediaWiki does, without a query. If the page is a redirect, this is
+    the URL of the redirect rather than of the page it redirects to.
+
+    >>> page_url('Prolog (programming language)')
+    'https://en.wikipedia.org/wiki/Prolog_(programming_language)'
+    >>> page_url('C++', 'fr')
+    'https://fr.wikipedia.org/wiki/C%2B%2B'
+    """
+    return PAGE_URL.format(language=language, title=quote(title.replace(' ', '_'), _URL_SAFE))
+
+
+def load_fixture(path: str, latency: float = 0.0) -> StubSource:
+    """Return a StubSource of the categories and pages in the fixture file at path, which was
+    written by save_fixture, which delays each query by latency seconds.
+
+    Preconditions:
+      - latency >= 0
+    """
+    with open(path, encoding='utf-8') as file:
+        fixture = json.load(file)
+    return StubSource(fixture['categories'], fixture['pages'], fixture['language'], latency,
+                      redirects=fixture.get('redirects'))
+
+
+def save_fixture(source: StubSource, path: str) -> None:
+    """Save the categories and pages of source to a fixture file at path.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'logic.json')
+    >>> save_fixture(StubSource({'Category:Logic': ['Prolog']}, {'Prolog': ['Logic']}), path)
+    >>> load_fixture(path).links('Prolog')
+    ['Logic']
+    """
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({'language': source.language, 'categories': source.categories,
+                   'pages': source.pages, 'redirects': source.redirects}, file, ensure_ascii=False)
+
+
+def record_fixture(source: PageSource, titles: list[str]) -> StubSource:
+    """Return a StubSource of the members and links of the category pages with the given titles,
+    and the links of their members, as fetched from source, so that they can be saved with
+    save_fixture and used later without network access. Since only the links of the recorded pages
+    are known to the stub, its backlinks of each page are only those from the recorded pages.
+
+    >>> live = StubSource({'Category:Logic': ['Prolog', 'Datalog'], 'Category:Prolog': ['Prolog']},
+    ...                   {'Prolog': ['Datalog', 'Logic'], 'Datalog': ['Prolog']})
+    >>> stub = record_fixture(live, ['Category:Logic', 'Category:Prolog'])
+    >>> stub.pages
+    {'Prolog': ['Datalog', 'Logic'], 'Datalog': ['Prolog']}
+    >>> live.calls['links']
+    2
+    """
+    categories = {}
+    pages = {}
+    for title in titles:
+        members = source.category_members(title)
+        if members is not None:
+            categories[title] = members
+            for member in members:
+                # Members of several of the categories are only fetched once
+                if member not in pages:
+                    pages[member] = source.links(member)
+
+    return StubSource(categories, pages, source.language)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 100,
+        'extra-imports': ['copy', 'json', 'abc', 'threading', 'time', 'collections',
+                          'urllib.parse', 'fetch', 'metrics'],
+        'max-nested-blocks': 4
+    })
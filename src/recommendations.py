@@ -11,13 +11,16 @@ The usage of this program should follow the GNU General Public License.
 
 This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
 """
-from typing import Any
+from typing import Any, Collection, Iterable, Iterator, Optional
+import heapq
 import pprint
 import networkx as nx
-import wikipediaapi as wa
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import algorithms
+import metrics
+import page_source
+import wiki_cache
+import similarity
+import minhash
 
 
 def print_lst(num: int, g: nx.DiGraph, n: int, page: str = None) -> None:
@@ -52,29 +55,56 @@ def print_lst(num: int, g: nx.DiGraph, n: int, page: str = None) -> None:
         pprint.pprint(lst)
 
 
-def wiki_link_pages(lst: list) -> list:
-    """ Takes a list of page names and similarity scores and returns a tuple with page names
-    and page urls.
+@metrics.timed('recommendations.wiki_link_pages')
+def wiki_link_pages(lst: list, cache: Optional[wiki_cache.WikiCache] = None,
+                    source: Optional[page_source.PageSource] = None,
+                    articles: Collection[str] = ()) -> list:
+    """ Takes a list of page names and similarity scores and returns a list of tuples with page
+    names and page urls, in the same order as lst.
+
+    The urls of the pages in articles, which are known not to be redirects, such as the pages of a
+    category graph, are derived from their names without any requests. The urls of the other
+    pages, which may be redirects, are read from cache if it is given, and the rest are fetched
+    from source, which is the live English Wikipedia by default, in as few batched requests as
+    possible, then stored in cache.
 
     Preconditions:
     - lst != []
-    """
-    wiki = wa.Wikipedia('en')
-    urls_so_far = []
-
-    # Retrieving the URL for each page and appending it to a list tuple.
-    if isinstance(lst[0], tuple):
-        for elem in lst:
-            page_py = wiki.page(elem[1])
-            urls_so_far.append((elem[1], page_py.fullurl))
-    else:
-        for elem in lst:
-            page_py = wiki.page(elem)
-            urls_so_far.append((elem, page_py.fullurl))
-
-    return urls_so_far
-
 
+    >>> source = page_source.StubSource({}, {'Prolog': [], 'Datalog': []},
+    ...                                 redirects={'PROLOG': 'Prolog'})
+    >>> wiki_link_pages([(0.5, 'PROLOG'), (0.25, 'Datalog')], source=source, articles={'Datalog'})
+    [('PROLOG', 'https://en.wikipedia.org/wiki/Prolog'), \
+('Datalog', 'https://en.wikipedia.org/wiki/Datalog')]
+    >>> dict(source.calls)
+    {'info': 1}
+    """
+    source = source if source is not None else page_source.WikipediaSource()
+    titles = [elem[1] for elem in lst] if isinstance(lst[0], tuple) else list(lst)
+
+    # Derive the URL of each article from its title, and look up the others in the cache
+    urls = {}
+    for title in titles:
+        url = page_source.page_url(title, source.language) if title in articles else \
+            cache.get('fullurl', title) if cache is not None else None
+        if url is not None:
+            urls[title] = url
+
+    # Fetch the URLs of the remaining pages all at once
+    missing = list(dict.fromkeys(title for title in titles if title not in urls))
+    if missing:
+        if cache is not None and cache.offline:
+            raise wiki_cache.CacheMissError(f'fullurl of {missing[0]!r} is not cached')
+        fetched = source.fullurls(missing)
+        for title in missing:
+            urls[title] = fetched[title]
+            if cache is not None:
+                cache.put('fullurl', title, fetched[title])
+
+    return [(title, urls[title]) for title in titles]
+
+
+@metrics.timed('recommendations.top_wiki_pages')
 def top_wiki_pages(g: nx.DiGraph, n: int) -> list:
     """ Returns a list of size n wiki pages within this category that hold the most connections
     to other pages, and the number of their connections, sorted in descending order. If there is
@@ -89,17 +119,11 @@ def top_wiki_pages(g: nx.DiGraph, n: int) -> list:
     >>> top_wiki_pages(test_graph, 3)
     [(15, 'Prolog'), (7, 'Logtalk'), (6, 'Comparison of Prolog implementations')]
     """
-    page_links_so_far = []
-
-    # Appending a tuple that consists of the number of links of a node and that node aswell.
-    for page in set(g.nodes):
-        page_links_so_far.append((len(g.adj[page]), page))
-
-    # Sorting the list accumulator and then taking the last n elements of that list to
-    # Obtain the top n wikipages
-    return reverse_list_sort(page_links_so_far, n)
+    # Selecting the top n tuples of the number of links of a node and that node aswell.
+    return top_n(((len(g.adj[page]), page) for page in g.nodes), n)
 
 
+@metrics.timed('recommendations.top_wiki_pagerank_pages')
 def top_wiki_pagerank_pages(g: nx.DiGraph, n: int) -> list:
     """Returns a list of size n of wiki pages within this category that hold the most importance,
     according to pagerank's numerical weighting algorithms. The list is sorted in descending order,
@@ -109,43 +133,69 @@ def top_wiki_pagerank_pages(g: nx.DiGraph, n: int) -> list:
     Preconditions:
     - n > 0
     """
-    page_links_so_far = []
     dict_pages = algorithms.calculate_pagerank(g)
 
-    # Appending each node and it's pagerank using the calculate_pagerank function from algorithms
-    for page in dict_pages:
-        page_links_so_far.append((dict_pages[page], page))
+    # Selecting the top n tuples of each node's pagerank, using the calculate_pagerank function
+    # from algorithms, and that node
+    return top_n(((dict_pages[page], page) for page in dict_pages), n)
+
+
+def progressive_pagerank_pages(updates: Iterable[Any], n: int) -> Iterator[tuple[Any, list]]:
+    """Yield each of the updates of a graph being built by wiki_graph.stream_digraph, with the top
+    n pages of the graph so far, as in top_wiki_pagerank_pages. The PageRanks of each update are
+    warm started from those of the previous update, so they usually take only a few iterations.
+    The pages yielded with the last update, whose complete attribute is True, are the top pages of
+    the whole category.
+
+    Preconditions:
+    - n > 0
 
-    # Sorting the list accumulator and then taking the last n elements of that list to
-    # Obtain the top n wikipages
-    return reverse_list_sort(page_links_so_far, n)
+    >>> import page_source, wiki_graph
+    >>> source = page_source.StubSource({'Category:Logic': ['Prolog', 'Datalog', 'Mercury']},
+    ...                                 {'Prolog': ['Datalog'], 'Datalog': ['Mercury'],
+    ...                                  'Mercury': ['Datalog']})
+    >>> updates = wiki_graph.stream_digraph('Logic', every=2, source=source)
+    >>> [(update.complete, top[0][1]) for update, top in progressive_pagerank_pages(updates, 1)]
+    [(False, 'Prolog'), (False, 'Mercury'), (True, 'Datalog')]
+    """
+    page_ranks = None
+    for update in updates:
+        if page_ranks is None or update.edges:
+            page_ranks = algorithms.calculate_pagerank_manual(update.graph, start=page_ranks)
+        yield update, top_n(((page_ranks[page], page) for page in page_ranks), n)
 
 
-def top_wiki_page_recommendations(page: str, n: int, g: nx.DiGraph) -> list:
+@metrics.timed('recommendations.top_wiki_page_recommendations')
+def top_wiki_page_recommendations(page: str, n: int, g: nx.DiGraph, approximate: bool = False,
+                                  bands: int = minhash.DEFAULT_BANDS,
+                                  rows: int = minhash.DEFAULT_ROWS) -> list:
     """Returns a list of n wikipage recommendations and their score of how similar they are to all
     other nodes within the graph. Sorted in descending order, pages with a similarity score of 0
     will not be included in this list. The list may be less than size n if there are fewer
-    recommendations that meet the criteria.
+    recommendations that meet the criteria. The similarity scores are calculated with
+    sparse matrix operations by the similarity module, and if g is a VersionedDiGraph, they are
+    precomputed for every page and reused until g's nodes or edges change.
+
+    If approximate is True, only the candidates found by a MinHash index with the given number of
+    bands and rows per band are scored, which scales to much larger categories but may miss some
+    recommendations. More bands find more of the recommendations, and more rows per band score
+    fewer pages which aren't recommended. See the minhash module.
 
     Preconditions:
       - n > 0
       - set(g.nodes) != set()
       - page in g.nodes
-    """
-    # Turns the networkx node objects into a readable set
-    pages = set(g.nodes)
-    pages.remove(page)
-    scores_so_far = []
-
-    # Calculate the similarity score between page and each elem in pages
-    for elem in pages:
-        if elem not in scores_so_far:
-            score = similarity_score(page, elem, g)
-            if score > 0:
-                scores_so_far.append((score, elem))
+      - bands > 0
+      - rows > 0
 
+    >>> g = nx.DiGraph([('a', 'x'), ('a', 'y'), ('b', 'x'), ('b', 'y'), ('c', 'x'), ('c', 'z')])
+    >>> top_wiki_page_recommendations('a', 2, g, approximate=True, bands=128, rows=1)
+    [(1.0, 'b'), (0.3333333333333333, 'c')]
+    """
     # Returns n pages with the greatest similarity scores.
-    return reverse_list_sort(scores_so_far, n)
+    if approximate:
+        return minhash.top_similar_approx(g, page, n, bands, rows)
+    return similarity.top_similar(g, page, n)
 
 
 def similarity_score(self: Any, other: Any, g: nx.DiGraph) -> float:
@@ -169,27 +219,18 @@ def similarity_score(self: Any, other: Any, g: nx.DiGraph) -> float:
         return num_adjacent_both / num_adjacent_either
 
 
-def reverse_list_sort(lst: list, n: int) -> list:
-    """ Helper function that takes a list and returns the n greatest elements from it.
+def top_n(items: Iterable[tuple], n: int) -> list:
+    """ Helper function that returns the n greatest (score, page) tuples from items, in descending
+    order. Tuples with the same score are ordered by page, also in descending order. The items are
+    consumed one at a time using a heap of size n, so they don't need to be put in a list first.
 
     Preconditions:
       - n > 0
-      - lst != []
-    """
-    # Sort the list using pythons built in sort function, and creates accumulator for the
-    # reversed version of this list
-    lst.sort()
-    reversed_lst = []
 
-    if n > len(lst):
-        n = len(lst)
-
-    count = -1
-    while count != -n - 1:
-        reversed_lst.append((lst[count][0], lst[count][1]))
-        count -= 1
-
-    return reversed_lst
+    >>> top_n(((len(page), page) for page in ['Prolog', 'Datalog', 'Mercury', 'Lisp']), 3)
+    [(7, 'Mercury'), (7, 'Datalog'), (6, 'Prolog')]
+    """
+    return heapq.nlargest(n, items)
 
 
 def visualize_rankings(g: nx.DiGraph, n: int) -> None:
@@ -197,6 +238,10 @@ def visualize_rankings(g: nx.DiGraph, n: int) -> None:
     ranked pages within that category using two different ranking approaches. The resulting figure
     consists of a comparison chart and a bar graph for each ranked list.
     """
+    # plotly is only imported when a chart is drawn, since it is slow to import
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
     # Ensuring that we avoid a lengthy exception block if the user enters a category that does
     # not exist
     # Catching for user input errors
@@ -275,15 +320,20 @@ def visualize_rankings(g: nx.DiGraph, n: int) -> None:
         fig.show()
 
 
-def visualize_recommendation(page: str, n: int, g: nx.DiGraph) -> None:
+def visualize_recommendation(page: str, n: int, g: nx.DiGraph,
+                             cache: Optional[wiki_cache.WikiCache] = None,
+                             source: Optional[page_source.PageSource] = None) -> None:
     """A chart visualization that takes in a page that exists in a networkx graph and returns a
     chart visual that displays at most n other wikipedia page recommendations in the same category
     the graph is based on. Recommendations are generated from top_wiki_page_recommendations() using
-    a similarity score based upon the weightless version from A3.
+    a similarity score based upon the weightless version from A3. The pages' urls are derived from
+    their names, as in wiki_link_pages.
 
     Preconditions:
     - n > 0
     """
+    import plotly.graph_objects as go
+
     # Error Catching
     if page not in g.nodes:
         print('That page doesn\'t seem to exist in this category!\n'
@@ -295,7 +345,7 @@ def visualize_recommendation(page: str, n: int, g: nx.DiGraph) -> None:
 
         # Obtaining list of recommendations and their successive URLs
         lst = top_wiki_page_recommendations(page, n, g)
-        lst_urls = wiki_link_pages(lst)
+        lst_urls = wiki_link_pages(lst, cache, source, g.nodes)
 
         n = len(lst)
 
@@ -346,8 +396,9 @@ if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'max-line-length': 100,
-        'extra-imports': ['networkx', 'pprint', 'plotly.graph_objects', 'plotly.subplots',
-                          'algorithms', 'wikipediaapi'],
+        'extra-imports': ['networkx', 'heapq', 'pprint', 'plotly.graph_objects', 'plotly.subplots',
+                          'algorithms', 'metrics', 'page_source', 'wiki_cache', 'similarity',
+                          'minhash'],
         'max-nested-blocks': 4,
         'allowed-io': ['print_lst', 'visualize_rankings', 'visualize_recommendation']
     })
@@ -0,0 +1,344 @@
+"""CSC111 Winter 2021: Project Phase 2
+
+Module Description
+==================
+This module contains a long-running HTTP service which answers ranking and recommendation queries
+about category graphs with JSON, so that other programs can use them without starting this program
+for every query. It can be started with `python main.py serve <saved graphs...>`.
+
+The graphs are loaded once, and the PageRanks and similarity indexes calculated for them are kept
+in memory until the service stops, so repeated queries are fast. Queries are calculated on a pool
+of threads, so that the service keeps accepting requests while they run. Identical queries which
+arrive while one is being calculated wait for its result rather than calculating it again.
+
+The service has the following endpoints, which take their arguments as query parameters and
+respond with a JSON list of objects with page and score keys, sorted in descending order of score:
+
+  - GET /top_wiki_pages?category=...&n=10
+  - GET /top_wiki_pagerank_pages?category=...&n=10
+  - GET /top_wiki_page_recommendations?category=...&page=...&n=10&approximate=false
+
+GET /categories responds with a list of the categories being served, and GET /metrics with the
+metrics recorded by the metrics module, in the Prometheus text format. Invalid queries get a 400 or
+404 response, with a JSON object whose error key describes the problem.
+
+Copyright and Usage Information
+===============================
+The usage of this program should follow the GNU General Public License.
+
+This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
+"""
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from urllib.parse import parse_qs, urlsplit
+import networkx as nx
+import algorithms
+import metrics
+import recommendations
+import similarity
+
+# The default address the service listens on
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8111
+
+# The default and largest number of results of a query
+DEFAULT_N = 10
+MAX_N = 1000
+
+# The content type of the Prometheus text format
+_PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# The reason phrases of the HTTP status codes sent by the service
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            500: 'Internal Server Error'}
+
+
+class QueryError(ValueError):
+    """Raised when a query to the service is invalid.
+
+    Instance Attributes:
+      - status: the HTTP status code of the response to the query
+    """
+    status: int
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class RankingService:
+    """A service which answers queries about the graphs of some categories.
+
+    Instance Attributes:
+      - graphs: the graph of each category being served, keyed by category
+
+    >>> import compact_graph
+    >>> g = compact_graph.CompactGraph('Logic', ['a', 'b', 'c', 'x', 'y'],
+    ...                                [0, 0, 1, 1, 2], [3, 4, 3, 4, 3]).to_digraph()
+    >>> service = RankingService([g])
+    >>> asyncio.run(service.query('/top_wiki_page_recommendations?category=Logic&page=a&n=2'))
+    (200, [{'page': 'b', 'score': 1.0}, {'page': 'c', 'score': 0.5}])
+    >>> asyncio.run(service.query('/top_wiki_pages?category=Physics'))
+    (404, {'error': "The category 'Physics' is not being served."})
+    >>> service.close()
+    """
+    graphs: dict[str, nx.DiGraph]
+    _executor: ThreadPoolExecutor
+    # The futures of the queries being calculated, keyed by their endpoints and arguments
+    _pending: dict[tuple, asyncio.Future]
+
+    def __init__(self, graphs: list[nx.DiGraph], workers: int = 4) -> None:
+        """Initialize a service for the given graphs, which calculates up to workers queries at
+        once. Each graph must have a category graph attribute, and should be a VersionedDiGraph so
+        that its PageRanks and similarity index are kept between queries.
+
+        Preconditions:
+          - workers >= 1
+        """
+        self.graphs = {graph.graph['category']: graph for graph in graphs}
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._pending = {}
+
+    def warm(self) -> None:
+        """Calculate the PageRanks and similarity index of every graph now, rather than on the
+        first query which needs them.
+        """
+        for graph in self.graphs.values():
+            algorithms.calculate_pagerank(graph)
+            if graph.number_of_nodes() > 0:
+                similarity.top_similar(graph, next(iter(graph.nodes)), DEFAULT_N)
+
+    def close(self) -> None:
+        """Stop the threads used to calculate queries."""
+        self._executor.shutdown()
+
+    async def query(self, target: str) -> tuple[int, Any]:
+        """Return the HTTP status code and JSON response of a GET request for the given target,
+        which is a path followed by query parameters. The response is a string of text instead for
+        the metrics endpoint.
+        """
+        url = urlsplit(target)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        endpoint = url.path.strip('/')
+
+        try:
+            if endpoint == 'categories':
+                return 200, sorted(self.graphs)
+            elif endpoint == 'metrics':
+                return 200, metrics.METRICS.prometheus()
+            elif endpoint not in _ENDPOINTS:
+                raise QueryError(404, f'There is no endpoint at {url.path}.')
+
+            func, names = _ENDPOINTS[endpoint]
+            args = self._parse_args(params, names)
+            return 200, await self._coalesce((endpoint, *args), lambda: func(*args))
+        except QueryError as error:
+            return error.status, {'error': str(error)}
+
+    async def handle_connection(self, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter) -> None:
+        """Respond to the HTTP/1.1 requests sent over a connection, until the client closes it or
+        asks for it to be closed.
+        """
+        try:
+            keep_alive = True
+            while keep_alive:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = await _read_headers(reader)
+                parts = request_line.decode('latin-1').split()
+                keep_alive = (len(parts) == 3 and parts[2] == 'HTTP/1.1'
+                              and headers.get('connection', '').lower() != 'close')
+
+                if len(parts) != 3:
+                    status, payload = 400, {'error': 'The request line is malformed.'}
+                elif parts[0] != 'GET':
+                    status, payload = 405, {'error': 'Only GET requests are supported.'}
+                else:
+                    status, payload = await self._safe_query(parts[1])
+
+                if isinstance(payload, str):
+                    body, content_type = payload.encode('utf-8'), _PROMETHEUS_CONTENT_TYPE
+                else:
+                    body, content_type = json.dumps(payload).encode('utf-8'), 'application/json'
+                writer.write(f'HTTP/1.1 {status} {_REASONS[status]}\r\n'
+                             f'Content-Type: {content_type}\r\n'
+                             f'Content-Length: {len(body)}\r\n'
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                             '\r\n'.encode('latin-1') + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # The client disconnected or sent a malformed request, so the connection is dropped
+            pass
+        finally:
+            writer.close()
+
+    async def _safe_query(self, target: str) -> tuple[int, Any]:
+        """Return self.query(target), or a 500 response if calculating it failed, so that one bad
+        query doesn't stop the service.
+        """
+        try:
+            return await self.query(target)
+        except Exception as error:  # pylint: disable=broad-except
+            return 500, {'error': f'{type(error).__name__}: {error}'}
+
+    async def _coalesce(self, key: tuple, func: Callable[[], Any]) -> Any:
+        """Return the result of func(), calculated on the thread pool, unless a query with the same
+        key is already being calculated, in which case return its result instead.
+        """
+        if key not in self._pending:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, func)
+            self._pending[key] = future
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+
+        # Shield the shared future, so that a client disconnecting doesn't cancel it for the
+        # other clients waiting on it
+        return await asyncio.shield(self._pending[key])
+
+    def _parse_args(self, params: dict[str, str], names: tuple[str, ...]) -> tuple:
+        """Return the arguments with the given names, parsed from the query parameters. Raise a
+        QueryError if any are missing or invalid.
+        """
+        category = params.get('category')
+        if category is None:
+            raise QueryError(400, 'The category parameter is required.')
+        if category not in self.graphs:
+            raise QueryError(404, f'The category {category!r} is not being served.')
+        graph = self.graphs[category]
+
+        try:
+            n = int(params.get('n', DEFAULT_N))
+        except ValueError:
+            raise QueryError(400, 'The n parameter must be an integer.') from None
+        if not 0 < n <= MAX_N:
+            raise QueryError(400, f'The n parameter must be between 1 and {MAX_N}.')
+
+        args = {'graph': graph, 'n': n,
+                'approximate': params.get('approximate', 'false').lower() in ('true', '1')}
+        if 'page' in names:
+            args['page'] = params.get('page')
+            if args['page'] is None:
+                raise QueryError(400, 'The page parameter is required.')
+            if args['page'] not in graph:
+                raise QueryError(404, f'The page {args["page"]!r} is not in {category!r}.')
+
+        return tuple(args[name] for name in names)
+
+
+def _top_wiki_pages(graph: nx.DiGraph, n: int) -> list[dict[str, Any]]:
+    """Return the response to a /top_wiki_pages query."""
+    return _results(recommendations.top_wiki_pages(graph, n))
+
+
+def _top_wiki_pagerank_pages(graph: nx.DiGraph, n: int) -> list[dict[str, Any]]:
+    """Return the response to a /top_wiki_pagerank_pages query."""
+    return _results(recommendations.top_wiki_pagerank_pages(graph, n))
+
+
+def _top_wiki_page_recommendations(graph: nx.DiGraph, page: str, n: int,
+                                   approximate: bool) -> list[dict[str, Any]]:
+    """Return the response to a /top_wiki_page_recommendations query."""
+    return _results(recommendations.top_wiki_page_recommendations(page, n, graph, approximate))
+
+
+def _results(results: list[tuple[Any, str]]) -> list[dict[str, Any]]:
+    """Return the given (score, page) tuples as JSON objects."""
+    return [{'page': page, 'score': score} for score, page in results]
+
+
+# The function which answers each endpoint's queries, and the names of its arguments
+_ENDPOINTS = {'top_wiki_pages': (_top_wiki_pages, ('graph', 'n')),
+              'top_wiki_pagerank_pages': (_top_wiki_pagerank_pages, ('graph', 'n')),
+              'top_wiki_page_recommendations': (_top_wiki_page_recommendations,
+                                                ('graph', 'page', 'n', 'approximate'))}
+
+
+async def _read_headers(reader: asyncio.StreamReader) -> dict[str, str]:
+    """Read the headers of an HTTP request from reader, and discard its body, if it has one.
+    Return the headers, with lowercase names.
+    """
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1')
+        if line.strip() == '':
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if int(headers.get('content-length', 0)) > 0:
+        await reader.readexactly(int(headers['content-length']))
+    return headers
+
+
+async def serve(service: RankingService, host: str = DEFAULT_HOST,
+                port: int = DEFAULT_PORT) -> asyncio.AbstractServer:
+    """Start serving service on the given host and port, and return the server. A port of 0
+    chooses any free port.
+
+    >>> import compact_graph
+    >>> g = compact_graph.CompactGraph('Logic', ['a', 'b', 'x'], [0, 1], [2, 2]).to_digraph()
+    >>> async def send(requests: list[str]) -> None:
+    ...     service = RankingService([g])
+    ...     server = await serve(service, port=0)
+    ...     reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+    ...     for request in requests:
+    ...         writer.write(request.encode('latin-1'))
+    ...         print((await reader.readline()).decode('latin-1').strip())
+    ...         headers = {}
+    ...         line = await reader.readline()
+    ...         while line.strip():
+    ...             name, _, value = line.decode('latin-1').partition(':')
+    ...             headers[name.lower()] = value.strip()
+    ...             line = await reader.readline()
+    ...         body = await reader.readexactly(int(headers['content-length']))
+    ...         print(headers['content-type'], body.decode('utf-8'))
+    ...     print('closed:', await reader.read() == b'')
+    ...     writer.close()
+    ...     server.close()
+    ...     await server.wait_closed()
+    ...     service.close()
+    >>> asyncio.run(send([
+    ...     'GET /top_wiki_page_recommendations?category=Logic&page=a&n=1 HTTP/1.1\\r\\n\\r\\n',
+    ...     'POST /categories HTTP/1.1\\r\\nContent-Length: 2\\r\\n\\r\\n{}',
+    ...     'GET /categories HTTP/1.1\\r\\nConnection: close\\r\\n\\r\\n']))
+    HTTP/1.1 200 OK
+    application/json [{"page": "b", "score": 1.0}]
+    HTTP/1.1 405 Method Not Allowed
+    application/json {"error": "Only GET requests are supported."}
+    HTTP/1.1 200 OK
+    application/json ["Logic"]
+    closed: True
+    """
+    return await asyncio.start_server(service.handle_connection, host, port)
+
+
+def run(service: RankingService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+    """Serve service on the given host and port until the process is interrupted."""
+    async def serve_forever() -> None:
+        server = await serve(service, host, port)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 100,
+        'extra-imports': ['asyncio', 'json', 'concurrent.futures', 'urllib.parse', 'networkx',
+                          'algorithms', 'metrics', 'recommendations', 'similarity'],
+        'max-nested-blocks': 4
+    })
@@ -0,0 +1,224 @@
+"""CSC111 Winter 2021: Project Phase 2
+
+Module Description
+==================
+This module contains a precomputed index of the most similar pages to each page in a category, using
+the same similarity score as recommendations.similarity_score. The similarity scores of all pairs of
+pages are calculated in batches using sparse matrix multiplication, and only the top k most similar
+pages to each page are kept, so that looking up recommendations for a page is fast.
+
+Copyright and Usage Information
+===============================
+The usage of this program should follow the GNU General Public License.
+
+This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
+"""
+from typing import Any
+import networkx as nx
+import numpy as np
+import algorithms
+import versioned_graph
+
+# The default number of most similar pages kept for each page
+DEFAULT_K = 50
+
+
+class SimilarityIndex:
+    """The top k most similar pages to each page in a graph.
+
+    Instance Attributes:
+      - k: the maximum number of similar pages kept for each page
+
+    Representation Invariants:
+      - self.k > 0
+
+    >>> g = nx.DiGraph([('a', 'x'), ('a', 'y'), ('b', 'x'), ('b', 'y'), ('c', 'x'), ('c', 'z')])
+    >>> index = SimilarityIndex(g, 2)
+    >>> index.recommendations('a', 5)
+    [(1.0, 'b'), (0.3333333333333333, 'c')]
+    >>> index.recommendations('x', 5)
+    []
+    """
+    k: int
+    # The nodes, the position of each node in nodes, and the columns (positions in nodes) and
+    # scores of the top k most similar pages to the ith node, which are at
+    # _columns[_indptr[i]:_indptr[i + 1]] and _scores[_indptr[i]:_indptr[i + 1]]
+    _nodes: list
+    _positions: dict[Any, int]
+    _indptr: np.ndarray
+    _columns: np.ndarray
+    _scores: np.ndarray
+
+    def __init__(self, graph: nx.DiGraph, k: int = DEFAULT_K, block_size: int = 1024) -> None:
+        """Calculate the top k most similar pages to each page in graph, multiplying block_size
+        rows of the adjacency matrix at a time.
+
+        Preconditions:
+          - k > 0
+          - block_size > 0
+        """
+        self.k = k
+        self._nodes = list(graph.nodes)
+        self._positions = {node: i for i, node in enumerate(self._nodes)}
+
+        adjacency = algorithms.adjacency_matrix(graph, self._nodes)
+        transposed = adjacency.T.tocsc()
+        degrees = np.diff(adjacency.indptr)
+        ranks = title_ranks(self._nodes)
+
+        counts, columns, scores = [np.zeros(1, dtype=np.int64)], [], []
+        for start in range(0, len(self._nodes), block_size):
+            end = min(start + block_size, len(self._nodes))
+            indptr, block_columns, block_scores = block_top_k_arrays(
+                adjacency, transposed, degrees, ranks, start, end, k)
+            counts.append(np.diff(indptr))
+            columns.append(block_columns)
+            scores.append(block_scores)
+
+        self._indptr = np.cumsum(np.concatenate(counts))
+        self._columns = np.concatenate(columns) if columns else np.zeros(0, dtype=np.int64)
+        self._scores = np.concatenate(scores) if scores else np.zeros(0)
+
+    def recommendations(self, page: Any, n: int) -> list[tuple[float, Any]]:
+        """Return a list of at most n tuples of the similarity score of another page with page,
+        and that page, in the same order as recommendations.top_wiki_page_recommendations.
+
+        Preconditions:
+          - n <= self.k
+        """
+        i = self._positions[page]
+        start = self._indptr[i]
+        end = min(self._indptr[i + 1], start + n)
+        return [(score, self._nodes[column]) for column, score
+                in zip(self._columns[start:end].tolist(), self._scores[start:end].tolist())]
+
+
+def top_similar(graph: nx.DiGraph, page: Any, n: int) -> list[tuple[float, Any]]:
+    """Return a list of at most n tuples of the positive similarity score of another page with
+    page, and that page, sorted in descending order.
+
+    If graph is a VersionedDiGraph and n is at most DEFAULT_K, the results are read from a
+    SimilarityIndex of the whole graph with k = DEFAULT_K, which is built once and reused for every
+    n until the graph's nodes or edges change. Otherwise, only the scores of page are calculated.
+
+    Preconditions:
+      - page in graph.nodes
+      - n > 0
+
+    >>> g = nx.DiGraph([('a', 'x'), ('a', 'y'), ('b', 'x'), ('b', 'y'), ('c', 'x'), ('c', 'z')])
+    >>> top_similar(g, 'c', 5)
+    [(0.3333333333333333, 'b'), (0.3333333333333333, 'a')]
+    >>> v = versioned_graph.VersionedDiGraph(g)
+    >>> top_similar(v, 'c', 5) == top_similar(v, 'c', DEFAULT_K + 1) == top_similar(g, 'c', 5)
+    True
+    """
+    if isinstance(graph, versioned_graph.VersionedDiGraph) and n <= DEFAULT_K:
+        index = graph.memoize('similarity_index', lambda: SimilarityIndex(graph, DEFAULT_K))
+        return index.recommendations(page, n)
+
+    nodes = list(graph.nodes)
+    i = nodes.index(page)
+    adjacency = algorithms.adjacency_matrix(graph, nodes)
+    degrees = np.diff(adjacency.indptr)
+    row = (adjacency[i] @ adjacency.T).tocsr()
+    scores = row.data / (degrees[i] + degrees[row.indices] - row.data)
+    return top_k(i, row.indices, scores, title_ranks(nodes), nodes, n)
+
+
+def block_top_k(adjacency: Any, transposed: Any, degrees: np.ndarray, ranks: np.ndarray,
+                nodes: list, start: int, end: int, k: int) -> list[list[tuple[float, Any]]]:
+    """Return the top k most similar pages to each of nodes[start:end], as in
+    SimilarityIndex.recommendations, given the sparse CSR adjacency matrix of the graph, its
+    transpose as a CSC matrix, the number of links of each node and the title_ranks of the nodes.
+
+    Preconditions:
+      - 0 <= start <= end <= len(nodes)
+      - k > 0
+
+    >>> g = nx.DiGraph([('a', 'x'), ('a', 'y'), ('b', 'x'), ('b', 'y'), ('c', 'x'), ('c', 'z')])
+    >>> nodes = list(g.nodes)
+    >>> adjacency = algorithms.adjacency_matrix(g, nodes)
+    >>> block_top_k(adjacency, adjacency.T.tocsc(), np.diff(adjacency.indptr),
+    ...             title_ranks(nodes), nodes, 0, 4, 5)
+    [[(1.0, 'b'), (0.3333333333333333, 'c')], [], [], [(1.0, 'a'), (0.3333333333333333, 'c')]]
+    """
+    indptr, columns, scores = block_top_k_arrays(adjacency, transposed, degrees, ranks, start,
+                                                 end, k)
+    columns, scores = columns.tolist(), scores.tolist()
+    return [[(scores[j], nodes[columns[j]]) for j in range(indptr[row], indptr[row + 1])]
+            for row in range(end - start)]
+
+
+def block_top_k_arrays(adjacency: Any, transposed: Any, degrees: np.ndarray, ranks: np.ndarray,
+                       start: int, end: int,
+                       k: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return the top k most similar pages to each of the nodes at positions start to end - 1, as
+    in block_top_k, as the indptr, columns and scores arrays of a sparse CSR matrix: the positions
+    of the most similar pages to the node at position start + row, and their scores, are
+    columns[indptr[row]:indptr[row + 1]] and scores[indptr[row]:indptr[row + 1]].
+
+    Preconditions:
+      - 0 <= start <= end <= adjacency.shape[0]
+      - k > 0
+    """
+    block = (adjacency[start:end] @ transposed).tocsr()
+    rows = np.repeat(np.arange(end - start), np.diff(block.indptr))
+    columns, common = block.indices, block.data
+
+    keep = columns != rows + start
+    rows, columns, common = rows[keep], columns[keep], common[keep]
+    scores = common / (degrees[rows + start] + degrees[columns] - common)
+
+    # Sort each row's scores in descending order, breaking ties in the same way as top_k, and keep
+    # the first k of each row. There are few distinct scores, so replacing each score with its
+    # position among them lets the three sort keys be combined into one integer, which sorts much
+    # faster than np.lexsort, as long as it fits in 64 bits
+    values, positions = np.unique(scores, return_inverse=True)
+    if (end - start) * len(values) * len(ranks) < 2 ** 63:
+        keys = rows * len(values) + (len(values) - 1 - positions.reshape(-1))
+        order = np.argsort(keys * len(ranks) + (len(ranks) - 1 - ranks[columns]))
+    else:
+        order = np.lexsort((-ranks[columns], -scores, rows))
+    rows, columns, scores = rows[order], columns[order], scores[order]
+    counts = np.bincount(rows, minlength=end - start)
+    row_starts = np.cumsum(counts) - counts
+    keep = np.arange(len(rows)) - row_starts[rows] < k
+
+    indptr = np.concatenate(([0], np.cumsum(np.minimum(counts, k))))
+    return indptr, columns[keep], scores[keep]
+
+
+def top_k(i: int, columns: np.ndarray, scores: np.ndarray, ranks: np.ndarray, nodes: list,
+           k: int) -> list[tuple[float, Any]]:
+    """Return the k greatest (score, node) tuples for the given columns and scores, excluding the
+    ith node itself. Ties are broken in the same way as sorting the tuples in descending order.
+    """
+    keep = columns != i
+    columns, scores = columns[keep], scores[keep]
+
+    if len(scores) > k:
+        # Only sort the scores at least as great as the kth greatest score
+        keep = scores >= np.partition(scores, len(scores) - k)[len(scores) - k]
+        columns, scores = columns[keep], scores[keep]
+
+    order = np.lexsort((ranks[columns], scores))[::-1][:k]
+    return [(float(scores[j]), nodes[columns[j]]) for j in order]
+
+
+def title_ranks(nodes: list) -> np.ndarray:
+    """Return an array of the position of each node in sorted(nodes)."""
+    ranks = np.empty(len(nodes), dtype=np.int64)
+    ranks[sorted(range(len(nodes)), key=nodes.__getitem__)] = np.arange(len(nodes))
+    return ranks
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 100,
+        'extra-imports': ['networkx', 'numpy', 'algorithms', 'versioned_graph'],
+        'max-nested-blocks': 4
+    })
@@ -0,0 +1,155 @@
+"""CSC111 Winter 2021: Project Phase 2
+
+Module Description
+==================
+This module contains a NetworkX DiGraph which keeps track of changes to its nodes and edges, so that
+results computed from the graph, such as PageRanks, can be memoized until the graph changes.
+
+Copyright and Usage Information
+===============================
+The usage of this program should follow the GNU General Public License.
+
+This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
+"""
+from typing import Any, Callable, Hashable
+import networkx as nx
+
+
+class VersionedDiGraph(nx.DiGraph):
+    """A NetworkX DiGraph with a version number, which is incremented whenever nodes or edges are
+    added or removed. Changing the attributes of existing nodes and edges does not change the
+    version.
+
+    Instance Attributes:
+      - version: the number of times the graph's nodes or edges have been changed
+
+    >>> g = VersionedDiGraph([('a', 'b')])
+    >>> version = g.version
+    >>> g.add_node('a', pagerank=0.5)
+    >>> g.version == version
+    True
+    >>> g.add_edge('b', 'a')
+    >>> g.version == version
+    False
+    """
+    version: int
+    _memo: dict[Hashable, tuple[int, Any]]
+
+    def __init__(self, incoming_graph_data: Any = None, **attr: Any) -> None:
+        self.version = 0
+        self._memo = {}
+        super().__init__(incoming_graph_data, **attr)
+
+    def add_node(self, node_for_adding: Hashable, **attr: Any) -> None:
+        if node_for_adding not in self._node:
+            self.version += 1
+        super().add_node(node_for_adding, **attr)
+
+    def add_nodes_from(self, nodes_for_adding: Any, **attr: Any) -> None:
+        self.version += 1
+        super().add_nodes_from(nodes_for_adding, **attr)
+
+    def remove_node(self, n: Hashable) -> None:
+        self.version += 1
+        super().remove_node(n)
+
+    def remove_nodes_from(self, nodes: Any) -> None:
+        self.version += 1
+        super().remove_nodes_from(nodes)
+
+    def add_edge(self, u_of_edge: Hashable, v_of_edge: Hashable, **attr: Any) -> None:
+        if v_of_edge not in self._succ.get(u_of_edge, {}):
+            self.version += 1
+        super().add_edge(u_of_edge, v_of_edge, **attr)
+
+    def add_edges_from(self, ebunch_to_add: Any, **attr: Any) -> None:
+        self.version += 1
+        super().add_edges_from(ebunch_to_add, **attr)
+
+    def remove_edge(self, u: Hashable, v: Hashable) -> None:
+        self.version += 1
+        super().remove_edge(u, v)
+
+    def remove_edges_from(self, ebunch: Any) -> None:
+        self.version += 1
+        super().remove_edges_from(ebunch)
+
+    def clear(self) -> None:
+        self.version += 1
+        super().clear()
+
+    def clear_edges(self) -> None:
+        self.version += 1
+        super().clear_edges()
+
+    def memoize(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """Return func(), reusing the value returned by the last call with the same key if the
+        graph's nodes and edges haven't changed since then.
+
+        The returned value is shared between calls, so it should not be mutated.
+        """
+        if key in self._memo and self._memo[key][0] == self.version:
+            return self._memo[key][1]
+
+        value = func()
+        self._memo[key] = (self.version, value)
+        return value
+
+    def last_value(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value last memoized under the given key, even if the graph's nodes or edges
+        have changed since it was calculated, or default if there is no such value. This is useful
+        for warm-starting a calculation from its previous result.
+
+        >>> g = VersionedDiGraph([('a', 'b')])
+        >>> g.memoize('size', lambda: len(g))
+        2
+        >>> g.add_edge('b', 'c')
+        >>> g.last_value('size')
+        2
+        """
+        return self._memo[key][1] if key in self._memo else default
+
+    def clear_memo(self) -> None:
+        """Discard every memoized value, so that each is calculated again by its next call, as if
+        the graph had just been created. This is useful for benchmarking.
+
+        >>> g = VersionedDiGraph([('a', 'b')])
+        >>> g.memoize('size', lambda: len(g))
+        2
+        >>> g.clear_memo()
+        >>> g.last_value('size') is None
+        True
+        """
+        self._memo.clear()
+
+
+def memoize(graph: nx.DiGraph, key: Hashable, func: Callable[[], Any]) -> Any:
+    """Return func(), memoized on graph under the given key if graph is a VersionedDiGraph.
+
+    >>> g = VersionedDiGraph([('a', 'b')])
+    >>> calls = []
+    >>> memoize(g, 'size', lambda: calls.append(1) or len(g))
+    2
+    >>> memoize(g, 'size', lambda: calls.append(1) or len(g))
+    2
+    >>> g.add_edge('b', 'c')
+    >>> memoize(g, 'size', lambda: calls.append(1) or len(g))
+    3
+    >>> len(calls)
+    2
+    """
+    if isinstance(graph, VersionedDiGraph):
+        return graph.memoize(key, func)
+    return func()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 100,
+        'extra-imports': ['networkx'],
+        'max-nested-blocks': 4
+    })
@@ -12,62 +12,69 @@ The usage of this program should follow the GNU General Public License.
 This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
 """
 from decimal import Decimal
-from typing import Any, Union
+from typing import Any, Optional, Union
 import networkx as nx
-from plotly.graph_objs import Scatter, Figure, Histogram
+import numpy as np
+from plotly.graph_objs import Scatter, Scattergl, Figure, Histogram
 import algorithms
+import layout
+import metrics
+import page_source
+import wiki_cache
 
+# Graphs with more than this many links are drawn with WebGL
+WEBGL_THRESHOLD = 5000
 
+# The most links drawn by default, beyond which the links between nearby pages are grouped, and the
+# number of cells along each side of the finest grid used to group pages
+MAX_EDGES = 200000
+_MAX_AGGREGATION_GRID = 512
+
+# The size of each arrowhead, and how far along its link it is drawn
+ARROW_SIZE = 8
+ARROW_POSITION = 0.8
+
+
+@metrics.timed('visualize.render')
 def visualize(values: tuple[list, list, Any], sizes: Union[list, int], labels: list,
-              graph: nx.DiGraph, arrows: bool = False) -> None:
+              graph: nx.DiGraph, arrows: bool = False, webgl: Optional[bool] = None,
+              max_edges: int = MAX_EDGES) -> None:
     """Generate the visualization of the given graph, with the given node coordinates, labels, and
     sizes.
 
+    The figure is drawn with WebGL if webgl is True, or if it is None and the graph has more than
+    WEBGL_THRESHOLD links. If the graph has more than max_edges links, nearby pages are grouped
+    and the links between groups are drawn instead of the links between pages.
+
     Preconditions:
       - all(size > 0 for size in sizes)
+      - max_edges > 0
     """
     x_values, y_values, pos = values
+    nodes = list(graph.nodes)
+    positions = np.array([pos[node] for node in nodes], dtype=float).reshape(-1, 2)
+    edges = algorithms.adjacency_matrix(graph, nodes).tocoo()
+    if webgl is None:
+        webgl = graph.number_of_edges() > WEBGL_THRESHOLD
+    scatter = Scattergl if webgl else Scatter
 
     fig = Figure()
 
-    if arrows:
-        # If arrows, add multiple arrow annotations to the figure for each link and backlink
-        for edge in graph.edges():
-            fig.add_annotation(
-                x=pos[edge[0]][0],
-                y=pos[edge[0]][1],
-                ax=pos[edge[1]][0],
-                ay=pos[edge[1]][1],
-                xref='x',
-                yref='y',
-                axref='x',
-                ayref='y',
-                text='',
-                showarrow=True,
-                arrowhead=5,
-                arrowsize=1,
-                arrowwidth=1,
-                opacity=0.25
-            )
-    else:
-        # If not arrows, add a single trace with multiple lines for all the links and backlinks
-        x_edges = []
-        y_edges = []
-        for edge in graph.edges():
-            x_edges += [pos[edge[0]][0], pos[edge[1]][0], None]
-            y_edges += [pos[edge[0]][1], pos[edge[1]][1], None]
-
-        fig.add_trace(Scatter(x=x_edges,
-                              y=y_edges,
-                              mode='lines',
-                              name='edges',
-                              line=dict(width=1),
-                              opacity=0.25,
-                              hoverinfo='none'
-                              ))
+    # Add a single trace with all of the links and backlinks, and their arrowheads if arrows
+    starts, ends = _aggregate_edges(positions, edges.row, edges.col, max_edges)
+    x_edges, y_edges, arrowheads = _edge_coordinates(starts, ends, arrows)
+    fig.add_trace(scatter(x=x_edges,
+                          y=y_edges,
+                          mode='lines+markers' if arrows else 'lines',
+                          name='edges',
+                          line=dict(width=1),
+                          marker=arrowheads,
+                          opacity=0.25,
+                          hoverinfo='none'
+                          ))
 
     # Add the nodes to the figure
-    fig.add_trace(Scatter(x=x_values,
+    fig.add_trace(scatter(x=x_values,
                           y=y_values,
                           mode='markers',
                           name='nodes',
@@ -87,24 +94,96 @@ def visualize(values: tuple[list, list, Any], sizes: Union[list, int], labels: l
     fig.show()
 
 
+def _aggregate_edges(positions: np.ndarray, sources: np.ndarray, targets: np.ndarray,
+                     max_edges: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return arrays of the start and end positions of the edges from nodes sources[i] to
+    targets[i], where the position of node j is positions[j].
+
+    If there are more than max_edges edges, the nodes are grouped by the cells of a grid, and an
+    edge is returned between the centres of two cells if any node in one links to any node in the
+    other, using the finest grid with at most max_edges such edges.
+
+    >>> positions = np.array([[0.0, 0.0], [0.1, 0.0], [1.0, 1.0]])
+    >>> starts, ends = _aggregate_edges(positions, np.array([0, 1]), np.array([2, 2]), 1)
+    >>> starts.tolist(), ends.tolist()
+    ([[0.05, 0.0]], [[1.0, 1.0]])
+    """
+    starts, ends = positions[sources], positions[targets]
+    grid = _MAX_AGGREGATION_GRID
+
+    while len(starts) > max_edges and grid >= 1:
+        low = positions.min(axis=0)
+        cell_size = max(float((positions.max(axis=0) - low).max()), 1e-9) / grid * (1 + 1e-9)
+        cells = ((positions - low) / cell_size).astype(np.int64)
+        occupied, groups = np.unique(cells[:, 0] * grid + cells[:, 1], return_inverse=True)
+
+        # Find the centre of the nodes in each cell, and the distinct links between cells
+        counts = np.bincount(groups)
+        centres = np.column_stack([np.bincount(groups, positions[:, axis]) / counts
+                                   for axis in range(2)])
+        pairs = np.unique(groups[sources] * len(occupied) + groups[targets])
+        pairs = pairs[pairs // len(occupied) != pairs % len(occupied)]
+
+        starts, ends = centres[pairs // len(occupied)], centres[pairs % len(occupied)]
+        grid //= 2
+
+    return starts, ends
+
+
+def _edge_coordinates(starts: np.ndarray, ends: np.ndarray,
+                      arrows: bool) -> tuple[np.ndarray, np.ndarray, dict[str, Any]]:
+    """Return the x and y coordinates of a single line trace of the edges with the given start and
+    end positions, where each edge is separated from the next by NaN, and the marker properties of
+    the trace.
+
+    If arrows, each edge also has a point ARROW_POSITION of the way along it, which has a
+    triangular marker pointing along the edge, and the other points have no marker.
+    """
+    # The points of each edge, followed by NaN, which starts a new line
+    if arrows:
+        points = [starts, starts + ARROW_POSITION * (ends - starts), ends]
+    else:
+        points = [starts, ends]
+    stride = len(points) + 1
+    x_edges = np.full(stride * len(starts), np.nan)
+    y_edges = np.full(stride * len(starts), np.nan)
+    for i, point in enumerate(points):
+        x_edges[i::stride] = point[:, 0]
+        y_edges[i::stride] = point[:, 1]
+
+    if not arrows:
+        return x_edges, y_edges, {}
+
+    # Only the middle point of each edge has a marker, rotated clockwise from pointing up
+    marker_sizes = np.zeros(stride * len(starts))
+    marker_sizes[1::stride] = ARROW_SIZE
+    angles = np.zeros(stride * len(starts))
+    angles[1::stride] = np.degrees(np.arctan2(ends[:, 0] - starts[:, 0],
+                                              ends[:, 1] - starts[:, 1]))
+    return x_edges, y_edges, {'symbol': 'triangle-up', 'size': marker_sizes, 'angle': angles}
+
+
 def visualize_pagerank(graph: nx.DiGraph, min_size: int = 10, max_size: int = 50,
-                       link_stats: bool = True, arrows: bool = False) -> None:
-    """Visualize the given NetworkX DiGraph and its PageRank properties.
+                       link_stats: bool = True, arrows: bool = False,
+                       cache: Optional[wiki_cache.WikiCache] = None,
+                       seed: int = layout.DEFAULT_SEED, layout_method: str = 'auto',
+                       source: Optional[page_source.PageSource] = None) -> None:
+    """Visualize the given NetworkX DiGraph and its PageRank properties. If cache or source are
+    given, they are used when calculating link statistics. The nodes are positioned by
+    layout.graph_layout with the given seed and layout method.
 
     Preconditions:
       - min_aize > 0
       - max_size > min_size
       - algorithms.assign_pagerank has been called on graph
+      - layout_method in layout.METHODS
     """
-    # Create a list of partitions using a spring layout
-    if graph.number_of_nodes() != 0:
-        pos = nx.spring_layout(graph, k=(1 / (graph.number_of_nodes() ** (1 / 4))))
-    else:
-        pos = nx.spring_layout(graph)
+    # Create a dictionary of positions using a (possibly memoized) force-directed layout
+    pos = layout.graph_layout(graph, seed, layout_method)
 
     # If link_stats, create labels using the link stats method, otherwise, use titles
     if link_stats:
-        algorithms.assign_link_stats(graph)
+        algorithms.assign_link_stats(graph, cache, source=source)
         labels = []
 
         for node in graph.nodes(data=True):
@@ -135,17 +214,17 @@ def visualize_pagerank(graph: nx.DiGraph, min_size: int = 10, max_size: int = 50
               sizes, labels, graph, arrows)
 
 
-def visualize_digraph(graph: nx.DiGraph, node_size: int = 20, arrows: bool = False) -> None:
-    """Visualize the given NetworkX DiGraph.
+def visualize_digraph(graph: nx.DiGraph, node_size: int = 20, arrows: bool = False,
+                      seed: int = layout.DEFAULT_SEED, layout_method: str = 'auto') -> None:
+    """Visualize the given NetworkX DiGraph. The nodes are positioned by layout.graph_layout with
+    the given seed and layout method.
 
     Preconditions:
       - node_size > 0
+      - layout_method in layout.METHODS
     """
-    # Create a list of positions using a spring layout
-    if graph.number_of_nodes() != 0:
-        pos = nx.spring_layout(graph, k=(1 / (graph.number_of_nodes() ** (1 / 4))))
-    else:
-        pos = nx.spring_layout(graph)
+    # Create a dictionary of positions using a (possibly memoized) force-directed layout
+    pos = layout.graph_layout(graph, seed, layout_method)
 
     # Create a list of x values based on the positions
     x_values = [pos[k][0] for k in graph.nodes]
@@ -158,6 +237,7 @@ def visualize_digraph(graph: nx.DiGraph, node_size: int = 20, arrows: bool = Fal
     visualize((x_values, y_values, pos), node_size, labels, graph, arrows)
 
 
+@metrics.timed('visualize.histograms')
 def visualize_histograms(graph: nx.DiGraph, local: bool = True) -> None:
     """This function graphs histograms of the inbound and outbound links per page.
 
@@ -198,21 +278,18 @@ def visualize_histograms(graph: nx.DiGraph, local: bool = True) -> None:
     fig.show()
 
 
+@metrics.timed('visualize.convergence')
 def visualize_convergence(graph: nx.DiGraph, log_yaxis: bool = True) -> None:
     """Visualize the convergence of the manual PageRank algorithm."""
-    # construct dictionary mapping article to a list of PageRank scores, one for each iteration
-    all_page_ranks = algorithms.calculate_pagerank_manual(graph)
-    article_convergences = dict.fromkeys(all_page_ranks[0].keys(), [])
-    for article in article_convergences:
-        article_convergences[article] = [iteration[article]
-                                         for iteration in all_page_ranks]
+    # compute the PageRank scores at each iteration, with one column per article
+    history = algorithms.calculate_pagerank_history(graph)
 
     # generate line graph using plotly
-    times = list(range(len(all_page_ranks)))
+    times = list(range(history.shape[0]))
     fig = Figure()
-    for article in article_convergences:
+    for i, article in enumerate(graph.nodes):
         article_scatter = Scatter(x=times,
-                                  y=article_convergences[article],
+                                  y=history[:, i],
                                   mode='lines+markers',
                                   name=article,
                                   text=article)
@@ -238,6 +315,7 @@ if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'max-line-length': 100,
-        'extra-imports': ['networkx', 'plotly.graph_objs', 'decimal', 'algorithms'],
+        'extra-imports': ['networkx', 'numpy', 'plotly.graph_objs', 'decimal', 'algorithms',
+                          'layout', 'metrics', 'page_source', 'wiki_cache'],
         'max-nested-blocks': 4
     })
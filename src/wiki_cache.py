@@ -0,0 +1,184 @@
+"""CSC111 Winter 2021: Project Phase 2
+
+Module Description
+==================
+This module contains a persistent, SQLite-backed cache for data fetched from the Wikipedia API,
+such as category members, links, backlinks and page URLs. Entries are keyed by a hash of what was
+requested, expire after a configurable time to live, and are evicted least recently used first once
+the cache grows past its size limit. An offline cache can be used to work without network access.
+
+Copyright and Usage Information
+===============================
+The usage of this program should follow the GNU General Public License.
+
+This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Optional
+import metrics
+
+# A value that can never be stored in the cache, used to signal a cache miss
+_MISSING = object()
+
+
+class CacheMissError(ValueError):
+    """Raised when an offline cache is asked for an entry that it does not contain."""
+
+
+class WikiCache:
+    """A persistent cache of Wikipedia API results stored in an SQLite database.
+
+    Each entry is identified by a kind (ex. 'links') and a title, and holds any JSON-serializable
+    value. Entries can be shared between threads.
+
+    Instance Attributes:
+      - path: the path of the SQLite database file, or ':memory:' for a temporary cache
+      - ttl: the number of seconds an entry stays valid for, or None if entries never expire
+      - max_size: the maximum total size in bytes of the stored values, or None if unbounded
+      - offline: whether misses raise CacheMissError instead of fetching from the network
+
+    Representation Invariants:
+      - self.ttl is None or self.ttl > 0
+      - self.max_size is None or self.max_size > 0
+
+    >>> c = WikiCache(':memory:')
+    >>> c.fetch('links', 'Prolog', lambda title: ['Logic programming', 'Datalog'])
+    ['Logic programming', 'Datalog']
+    >>> c.get('links', 'Prolog')
+    ['Logic programming', 'Datalog']
+    >>> c.get('links', 'Datalog') is None
+    True
+    """
+    path: str
+    ttl: Optional[float]
+    max_size: Optional[int]
+    offline: bool
+    _connection: sqlite3.Connection
+    _lock: threading.Lock
+
+    def __init__(self, path: str, ttl: Optional[float] = None, max_size: Optional[int] = None,
+                 offline: bool = False) -> None:
+        """Open the cache stored at path, creating it if it does not exist yet."""
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, kind TEXT, title TEXT, '
+                'value TEXT, size INTEGER, created REAL, accessed REAL)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+
+    def get(self, kind: str, title: str, default: Any = None) -> Any:
+        """Return the cached value for kind and title, or default if it is missing or expired."""
+        key = _key(kind, title)
+        now = time.time()
+
+        with self._lock, self._connection:
+            row = self._connection.execute('SELECT value, created FROM entries WHERE key = ?',
+                                           (key,)).fetchone()
+            if row is None:
+                metrics.count('cache_requests', kind=kind, result='miss')
+                return default
+            if self.ttl is not None and now - row[1] > self.ttl:
+                self._connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+                metrics.count('cache_requests', kind=kind, result='miss')
+                return default
+            self._connection.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+
+        metrics.count('cache_requests', kind=kind, result='hit')
+
+        return json.loads(row[0])
+
+    def put(self, kind: str, title: str, value: Any) -> None:
+        """Store value for kind and title, then evict the least recently used entries if the cache
+        is over its size limit.
+        """
+        data = json.dumps(value)
+        now = time.time()
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (_key(kind, title), kind, title, data, len(data), now, now))
+            if self.max_size is not None:
+                self._evict()
+
+    def fetch(self, kind: str, title: str, func: Callable[[str], Any]) -> Any:
+        """Return the cached value for kind and title. On a miss, store and return func(title),
+        unless the cache is offline, in which case raise CacheMissError.
+        """
+        value = self.get(kind, title, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.offline:
+            raise CacheMissError(f'{kind} of {title!r} is not cached')
+
+        value = func(title)
+        self.put(kind, title, value)
+        return value
+
+    def clear(self) -> None:
+        """Remove every entry from the cache."""
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM entries')
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        self._connection.close()
+
+    def _evict(self) -> None:
+        """Delete the least recently used entries until the total size is within self.max_size.
+
+        Preconditions:
+          - self._lock is held by the calling thread
+          - self.max_size is not None
+        """
+        total = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        stale = []
+        for key, size in self._connection.execute(
+                'SELECT key, size FROM entries ORDER BY accessed ASC'):
+            if total <= self.max_size:
+                break
+            stale.append((key,))
+            total -= size
+        self._connection.executemany('DELETE FROM entries WHERE key = ?', stale)
+
+
+def cached(cache: Optional[WikiCache], kind: str, title: str, func: Callable[[str], Any]) -> Any:
+    """Return cache.fetch(kind, title, func), or func(title) if there is no cache.
+
+    >>> cached(None, 'links', 'Prolog', lambda title: [title])
+    ['Prolog']
+    """
+    if cache is None:
+        return func(title)
+    return cache.fetch(kind, title, func)
+
+
+def _key(kind: str, title: str) -> str:
+    """Return the key identifying the entry for kind and title."""
+    return hashlib.sha256(json.dumps([kind, title]).encode('utf-8')).hexdigest()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 100,
+        'extra-imports': ['hashlib', 'json', 'sqlite3', 'threading', 'time', 'metrics'],
+        'max-nested-blocks': 4
+    })
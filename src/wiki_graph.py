@@ -4,18 +4,96 @@ Module Description
 ==================
 This module is for creating NetworkX graphs given a Wikipedia category title.
 
+create_digraph returns the graph once every page's links have been fetched. stream_digraph (or
+astream_digraph, in asyncio code) instead yields the graph as it is built, so that it can be shown
+and analyzed before the category has been fetched completely.
+
 Copyright and Usage Information
 ===============================
 The usage of this program should follow the GNU General Public License.
 
 This file is Copyright (c) 2021 Gabe Guralnick, Matthew Toohey, Nathan Hansen, and Azka Azmi.
 """
+import asyncio
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
 import networkx as nx
-import wikipediaapi as wa
+import fetch
+import metrics
+import page_source
+import wiki_cache
+import versioned_graph
+import compact_graph
+
+# The prefix of the titles of category pages
+CATEGORY_PREFIX = 'Category:'
+
+# The default number of pages whose links are fetched between the updates of stream_digraph
+DEFAULT_UPDATE_EVERY = 50
+
+
+class GraphUpdate:
+    """The progress of a graph being built by stream_digraph.
+
+    Instance Attributes:
+      - graph: the graph built so far, which is the same object in every update of a stream, and
+        keeps changing until the stream is complete
+      - nodes: the pages whose links were fetched since the previous update
+      - edges: the links added to the graph since the previous update
+      - fetched: the number of pages whose links have been fetched so far
+      - total: the number of pages in the category
+      - complete: whether every page's links have been fetched, so that graph has the same nodes
+        and edges as the graph returned by create_digraph
+
+    Representation Invariants:
+      - 0 <= self.fetched <= self.total
+      - self.complete == (self.fetched == self.total)
+    """
+    graph: nx.DiGraph
+    nodes: list[str]
+    edges: list[tuple[str, str]]
+    fetched: int
+    total: int
+    complete: bool
 
+    def __init__(self, graph: nx.DiGraph, nodes: list[str], edges: list[tuple[str, str]],
+                 fetched: int) -> None:
+        self.graph = graph
+        self.nodes = nodes
+        self.edges = edges
+        self.fetched = fetched
+        self.total = graph.number_of_nodes()
+        self.complete = fetched == self.total
 
-def create_digraph(category: str) -> nx.DiGraph:
-    """Return a NetworkX DiGraph of the given Wikipedia category.
+
+@metrics.timed('wiki_graph.create_digraph')
+def create_digraph(category: str, workers: int = 1, rate: Optional[float] = None,
+                   retries: int = 3, cache: Optional[wiki_cache.WikiCache] = None,
+                   depth: int = 0, max_nodes: Optional[int] = None,
+                   source: Optional[page_source.PageSource] = None) -> nx.DiGraph:
+    """Return a NetworkX DiGraph of the given Wikipedia category, with the pages fetched from
+    source, which is the live English Wikipedia by default.
+
+    If depth is greater than 0, the category's subcategories are expanded breadth-first, up to
+    depth levels down: their members are added to the graph instead of the subcategory pages
+    themselves. Each subcategory is expanded and each page is added only once, even if it is
+    reached through several subcategories. If max_nodes is given, no more than max_nodes pages are
+    added to the graph.
+
+    The links of the category's members are fetched on up to workers threads at once, with at most
+    rate requests per second to each host (unlimited if rate is None), counting the continuations
+    of long lists of members and links. Failed requests are retried up to retries times with
+    exponential backoff, without repeating the requests for the list which succeeded. The resulting
+    graph is the same no matter how many workers are used.
+
+    If cache is given, the category's members and each page's links are read from it when
+    available, and stored in it otherwise.
+
+    Preconditions:
+      - workers >= 1
+      - rate is None or rate > 0
+      - retries >= 0
+      - depth >= 0
+      - max_nodes is None or max_nodes > 0
 
     >>> graph = create_digraph('Logic programming languages')
     >>> len(graph.nodes())
@@ -24,29 +102,234 @@ def create_digraph(category: str) -> nx.DiGraph:
     86
     >>> 'Prolog' in graph.nodes()
     True
+    >>> source = page_source.StubSource({'Category:Logic': ['Prolog', 'Datalog']},
+    ...                                 {'Prolog': ['Datalog', 'Logic'], 'Datalog': ['Prolog']})
+    >>> sorted(create_digraph('Logic', source=source).edges)
+    [('Datalog', 'Prolog'), ('Prolog', 'Datalog')]
+
+    Building the same category on one worker and on many gives the same nodes and edges, in the
+    same order, even when the lists of members and links are split into several responses:
+
+    >>> titles = [f'Page {i}' for i in range(40)]
+    >>> links = {title: [titles[(i * 7 + j) % 40] for j in range(i % 5)]
+    ...          for i, title in enumerate(titles)}
+    >>> source = page_source.StubSource({'Category:Logic': titles}, links, page_size=3)
+    >>> serial = create_digraph('Logic', workers=1, source=source)
+    >>> parallel = create_digraph('Logic', workers=8, source=source)
+    >>> list(serial.nodes) == list(parallel.nodes) and list(serial.edges) == list(parallel.edges)
+    True
+    >>> parallel.number_of_edges()
+    80
+    """
+    mems, all_links = _fetch_category(category, workers, rate, retries, cache, depth, max_nodes,
+                                      source)
+    with metrics.stage('wiki_graph.build'):
+        digraph = versioned_graph.VersionedDiGraph(category=category)
+
+        # Add each page to the graph
+        digraph.add_nodes_from(mems)
+
+        # Add links between pages within the category in the same order as the pages were added
+        for page, links in zip(mems, all_links):
+            for linked in links:
+                if linked in digraph:
+                    digraph.add_edge(page, linked)
+
+    return digraph
+
+
+def stream_digraph(category: str, every: int = DEFAULT_UPDATE_EVERY, workers: int = 1,
+                   rate: Optional[float] = None, retries: int = 3,
+                   cache: Optional[wiki_cache.WikiCache] = None, depth: int = 0,
+                   max_nodes: Optional[int] = None,
+                   source: Optional[page_source.PageSource] = None) -> Iterator[GraphUpdate]:
+    """Yield the graph of the given Wikipedia category as it is built, with the same arguments as
+    create_digraph.
+
+    The first update has every page of the category, and no links. Then, the links of the pages
+    within the category are added as each page's links are fetched, with an update after every
+    every pages. The last update is complete, and its graph has the same nodes and edges as
+    create_digraph would return. Each update's graph is the same VersionedDiGraph, so values
+    calculated from it, such as PageRanks, are recalculated when it changes, and should be
+    calculated before the next update is requested.
+
+    Preconditions:
+      - every >= 1
+      - workers >= 1
+      - rate is None or rate > 0
+      - retries >= 0
+      - depth >= 0
+      - max_nodes is None or max_nodes > 0
+
+    >>> source = page_source.StubSource({'Category:Logic': ['Prolog', 'Datalog', 'Mercury']},
+    ...                                 {'Prolog': ['Datalog', 'Logic'], 'Datalog': ['Prolog'],
+    ...                                  'Mercury': ['Prolog']})
+    >>> for update in stream_digraph('Logic', every=2, source=source):
+    ...     print(update.fetched, update.total, update.edges, update.complete)
+    0 3 [] False
+    2 3 [('Prolog', 'Datalog'), ('Datalog', 'Prolog')] False
+    3 3 [('Mercury', 'Prolog')] True
+    """
+    source = _limited_source(source, rate, retries)
+    mems = _fetch_members(category, workers, cache, depth, max_nodes, source)
+
+    digraph = versioned_graph.VersionedDiGraph(category=category)
+    digraph.add_nodes_from(mems)
+    yield GraphUpdate(digraph, [], [], 0)
+
+    nodes, edges = [], []
+    for fetched, (i, links) in enumerate(fetch.fetch_as_completed(
+            lambda title: wiki_cache.cached(cache, 'links', title, source.links),
+            mems, source.host, workers, retries=0), 1):
+        page = mems[i]
+        nodes.append(page)
+        for linked in links:
+            if linked in digraph and not digraph.has_edge(page, linked):
+                digraph.add_edge(page, linked)
+                edges.append((page, linked))
+
+        if fetched == len(mems) or len(nodes) >= every:
+            yield GraphUpdate(digraph, nodes, edges, fetched)
+            nodes, edges = [], []
+
+
+async def astream_digraph(category: str, **kwargs: Any) -> AsyncIterator[GraphUpdate]:
+    """Yield the graph of the given Wikipedia category as it is built, as in stream_digraph, which
+    takes the same keyword arguments. The pages are fetched on another thread, so the event loop
+    keeps running while waiting for each update.
+
+    >>> source = page_source.StubSource({'Category:Logic': ['Prolog']}, {'Prolog': ['Logic']})
+    >>> async def last_update():
+    ...     return [update async for update in astream_digraph('Logic', source=source)][-1]
+    >>> asyncio.run(last_update()).complete
+    True
+    """
+    loop = asyncio.get_running_loop()
+    updates = stream_digraph(category, **kwargs)
+    try:
+        while True:
+            update = await loop.run_in_executor(None, next, updates, None)
+            if update is None:
+                break
+            yield update
+    finally:
+        updates.close()
+
+
+@metrics.timed('wiki_graph.create_compact_graph')
+def create_compact_graph(category: str, **kwargs: Any) -> compact_graph.CompactGraph:
+    """Return a CompactGraph of the given Wikipedia category. This takes the same keyword
+    arguments as create_digraph, and fetches the same pages and links.
+    """
+    mems, all_links = _fetch_category(category, **kwargs)
+
+    with metrics.stage('wiki_graph.build'):
+        ids = {page: i for i, page in enumerate(mems)}
+        sources = []
+        targets = []
+
+        for i, links in enumerate(all_links):
+            for linked in links:
+                if linked in ids:
+                    sources.append(i)
+                    targets.append(ids[linked])
+
+        return compact_graph.CompactGraph(category, mems, sources, targets)
+
+
+def _fetch_category(category: str, workers: int = 1, rate: Optional[float] = None,
+                    retries: int = 3, cache: Optional[wiki_cache.WikiCache] = None,
+                    depth: int = 0, max_nodes: Optional[int] = None,
+                    source: Optional[page_source.PageSource] = None
+                    ) -> tuple[list[str], list[list[str]]]:
+    """Return the titles of the pages in the given category, and the titles of all of the pages
+    linked to by each of them, as described in create_digraph.
+    """
+    source = _limited_source(source, rate, retries)
+    mems = _fetch_members(category, workers, cache, depth, max_nodes, source)
+
+    # Fetch the links of every page, possibly concurrently. Each query is rate limited and retried
+    # by the source, so that the continuations of long lists are too.
+    with metrics.stage('wiki_graph.links'):
+        all_links = fetch.fetch_all(
+            lambda title: wiki_cache.cached(cache, 'links', title, source.links),
+            mems, source.host, workers, retries=0)
+
+    return mems, all_links
+
+
+def _limited_source(source: Optional[page_source.PageSource], rate: Optional[float],
+                    retries: int) -> page_source.PageSource:
+    """Return source, or the live English Wikipedia if source is None, with each query limited
+    to rate queries per second (unlimited if rate is None) and retried up to retries times.
     """
-    # Create necessary api variables
-    wiki = wa.Wikipedia('en')
-    cat = wiki.page(f'Category:{category}')
+    source = source if source is not None else page_source.WikipediaSource()
+    return source.limited(fetch.RateLimiter(rate) if rate is not None else None, retries)
+
+
+def _fetch_members(category: str, workers: int, cache: Optional[wiki_cache.WikiCache],
+                   depth: int, max_nodes: Optional[int],
+                   source: page_source.PageSource) -> list[str]:
+    """Return the titles of the pages in the given category, and possibly its subcategories, as
+    described in create_digraph, with the queries rate limited and retried by source.
+    """
+    def category_members(name: str) -> Optional[list[str]]:
+        return source.category_members(f'{CATEGORY_PREFIX}{name}')
+
+    with metrics.stage('wiki_graph.categorymembers'):
+        return _crawl_members(
+            category, depth, max_nodes,
+            lambda categories: fetch.fetch_all(
+                lambda title: wiki_cache.cached(cache, 'categorymembers', title, category_members),
+                categories, source.host, workers, retries=0))
+
+
+def _crawl_members(category: str, depth: int, max_nodes: Optional[int],
+                   fetch_members: Callable[[list[str]], list[Optional[list[str]]]]) -> list[str]:
+    """Return the titles of the pages in the given category and its subcategories up to depth levels
+    down, in breadth-first order and without duplicates. Subcategories that are depth levels down
+    are included as pages rather than expanded. At most max_nodes titles are returned, if given.
+
+    fetch_members(categories) returns the titles of the members of each of the given categories,
+    or None for categories that don't exist.
+
+    >>> categories = {'A': ['x', 'Category:B', 'Category:C'], 'B': ['y', 'Category:C'],
+    ...               'C': ['x', 'z', 'Category:A']}
+    >>> fetch_members = lambda titles: [categories.get(title) for title in titles]
+    >>> _crawl_members('A', 0, None, fetch_members)
+    ['x', 'Category:B', 'Category:C']
+    >>> _crawl_members('A', 2, None, fetch_members)
+    ['x', 'y', 'z']
+    >>> _crawl_members('A', 2, 2, fetch_members)
+    ['x', 'y']
+    """
+    level_members = fetch_members([category])
 
     # Throw an error if the provided category doesn't exist
-    if not cat.exists():
+    if level_members[0] is None:
         raise ValueError('Category not found.')
 
-    mems = cat.categorymembers
-    digraph = nx.DiGraph(category=category)
+    # A dictionary is used as an ordered set of the pages found so far
+    pages = {}
+    visited = {category}
+    level = 0
 
-    # Add each page to the graph and add its wikipediaapi object to the node as an attribute
-    for page in mems:
-        digraph.add_node(page, object=mems[page])
+    while level_members and (max_nodes is None or len(pages) < max_nodes):
+        frontier = []
+        for title in (title for members in level_members if members for title in members):
+            if level < depth and title.startswith(CATEGORY_PREFIX):
+                # Expand the subcategory on the next level, unless it has already been visited
+                subcategory = title[len(CATEGORY_PREFIX):]
+                if subcategory not in visited:
+                    visited.add(subcategory)
+                    frontier.append(subcategory)
+            elif max_nodes is None or len(pages) < max_nodes:
+                pages[title] = None
 
-    # Add links between pages within the cateogory
-    for page in mems:
-        for linked in mems[page].links:
-            if linked in mems:
-                digraph.add_edge(page, linked)
+        level += 1
+        level_members = fetch_members(frontier) if frontier else []
 
-    return digraph
+    return list(pages)
 
 
 if __name__ == '__main__':
@@ -56,6 +339,7 @@ if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'max-line-length': 100,
-        'extra-imports': ['networkx', 'wikipediaapi'],
+        'extra-imports': ['asyncio', 'networkx', 'fetch', 'metrics', 'page_source', 'wiki_cache',
+                          'versioned_graph', 'compact_graph'],
         'max-nested-blocks': 4
     })